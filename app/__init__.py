@@ -51,6 +51,11 @@ def create_app():
     app.register_blueprint(categories_bp, url_prefix='/api/v1')
     app.register_blueprint(dashboard_bp, url_prefix='/api/v1')
 
+    # 5. Register CLI commands (e.g. `flask --app main embeddings migrate`)
+    from app.cli import embeddings_cli, search_cli
+    app.cli.add_command(embeddings_cli)
+    app.cli.add_command(search_cli)
+
     # A simple route to test the server is running
     @app.route('/hello')
     def hello():
@@ -1,13 +1,15 @@
 import logging
 import threading
 from flask import current_app
-from langchain_community.chat_models import ChatOllama
+from app.llm_client import PooledChatOllama, get_endpoint_pool
+from app.embedding_client import RemoteEmbeddings
 from langchain.embeddings import HuggingFaceEmbeddings
 
 # --- Globals for AI Models ---
 # Using threading locks to ensure thread-safe, single initialization of models.
 l_llm = None
 l_embeddings = None
+l_remote_embeddings = None
 llm_lock = threading.Lock()
 embeddings_lock = threading.Lock()
 
@@ -17,18 +19,39 @@ def get_llm():
     """
     Provides a thread-safe, global instance of the ChatOllama model.
     Initializes the model on the first call.
+
+    Its requests are spread over the Ollama hosts in OLLAMA_BASE_URLS (least
+    outstanding requests first, skipping hosts whose circuit is open and failing
+    over to the others), each with a pooled keep-alive HTTP session and at most
+    OLLAMA_MAX_CONCURRENCY requests in flight per process.
     """
     global l_llm
     with llm_lock:
         if l_llm is None:
             try:
                 logger.info("Initializing ChatOllama model for the first time...")
-                l_llm = ChatOllama(
-                    base_url=current_app.config['OLLAMA_BASE_URL'],
-                    model=current_app.config['CHAT_MODEL_NAME'],
-                    temperature=0
+                config = current_app.config
+                base_urls = config['OLLAMA_BASE_URLS']
+                get_endpoint_pool(
+                    base_urls,
+                    health_check_seconds=config['OLLAMA_HEALTH_CHECK_SECONDS'],
+                    max_concurrency=config['OLLAMA_MAX_CONCURRENCY'],
+                    redis_url=config['OLLAMA_CONCURRENCY_REDIS_URL'],
+                    global_max_concurrency=config['OLLAMA_GLOBAL_MAX_CONCURRENCY'],
+                    lease_seconds=config['OLLAMA_REQUEST_TIMEOUT'],
+                    failure_threshold=config['OLLAMA_CIRCUIT_FAILURE_THRESHOLD'],
+                    cooldown_seconds=config['OLLAMA_CIRCUIT_COOLDOWN_SECONDS']
+                )
+                l_llm = PooledChatOllama(
+                    base_url=base_urls[0],
+                    base_urls=base_urls,
+                    model=config['CHAT_MODEL_NAME'],
+                    temperature=0,
+                    num_ctx=config['LLM_CONTEXT_TOKENS'],
+                    timeout=config['OLLAMA_REQUEST_TIMEOUT']
                 )
-                logger.info(f"ChatOllama model initialized successfully. Using model: {current_app.config['CHAT_MODEL_NAME']}")
+                logger.info(f"ChatOllama model initialized successfully. Using model: {current_app.config['CHAT_MODEL_NAME']} "
+                            f"on {', '.join(base_urls)}")
             except Exception as e:
                 logger.critical(f"Failed to initialize the Ollama LLM. Ensure Ollama is running and the model is available. Error: {e}", exc_info=True)
                 raise ConnectionError("Could not connect to the local AI model via Ollama.") from e
@@ -38,12 +61,31 @@ def get_embeddings():
     """
     Provides a thread-safe, global instance of the HuggingFace Embeddings model.
     Initializes the model on the first call.
+
+    With EMBEDDINGS_SERVICE_URL set, it returns a client of that embedding service
+    (`python -m app.embedding_server`) instead, and no model is loaded in this process.
+    """
+    global l_remote_embeddings
+    service_url = current_app.config['EMBEDDINGS_SERVICE_URL']
+    if service_url:
+        with embeddings_lock:
+            if l_remote_embeddings is None or l_remote_embeddings.base_url != service_url.rstrip('/'):
+                logger.info(f"Using the embedding service at {service_url}.")
+                l_remote_embeddings = RemoteEmbeddings(
+                    service_url, timeout=current_app.config['EMBEDDINGS_SERVICE_TIMEOUT_SECONDS']
+                )
+        return l_remote_embeddings
+    return init_embeddings(current_app.config['EMBEDDINGS_MODEL_NAME'])
+
+def init_embeddings(model_name: str):
+    """
+    Initializes the global embeddings model, like `get_embeddings`, without needing
+    an app context, e.g. in a gunicorn master or Celery parent process before it forks.
     """
     global l_embeddings
     with embeddings_lock:
         if l_embeddings is None:
             try:
-                model_name = current_app.config['EMBEDDINGS_MODEL_NAME']
                 logger.info(f"Initializing HuggingFace Embeddings model '{model_name}' for the first time...")
                 # For local, CPU-based inference, we specify the device as 'cpu'
                 model_kwargs = {'device': 'cpu'} 
@@ -0,0 +1,195 @@
+import json
+import math
+import time
+import logging
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+from app.metrics import metrics
+from app.scheduling import get_broker_redis, lane_stats
+
+logger = logging.getLogger(__name__)
+
+# Redis hash of the average task run time per queue (exponentially weighted, in ms)
+RUNTIME_KEY = 'task-runtime-ms'
+# Weight of the newest run time in the average
+RUNTIME_SMOOTHING = 0.2
+# Run time assumed for a queue before any of its tasks has finished
+DEFAULT_RUNTIME_MS = 1000.0
+
+# Each autoscaling worker publishes its latest state under this prefix
+STATE_KEY_PREFIX = 'autoscaler:'
+# A worker whose state is older than this many check intervals (and at least a minute, as idle
+# workers only check every 30 seconds) no longer counts as a consumer of its queues
+LIVE_STATE_CHECKS = 6
+MIN_LIVE_STATE_SECONDS = 60
+
+
+def record_task_runtime(redis_client, queue: str, runtime_ms: float):
+    """Folds the run time of one finished task into the average of its queue."""
+    previous = redis_client.hget(RUNTIME_KEY, queue)
+    average = runtime_ms if previous is None else (
+        RUNTIME_SMOOTHING * runtime_ms + (1 - RUNTIME_SMOOTHING) * float(previous)
+    )
+    redis_client.hset(RUNTIME_KEY, queue, round(average, 1))
+
+
+def desired_concurrency(depth: float, active: int, runtime_ms: float, oldest_wait_ms, processes: int,
+                        target_drain_seconds: float, max_wait_seconds: float) -> int:
+    """
+    The number of pool processes a worker needs: one per task it is running, plus
+    enough to work off the `depth` waiting tasks of `runtime_ms` each within
+    `target_drain_seconds`. While the oldest waiting task has waited longer than
+    `max_wait_seconds`, it is at least one more than the current `processes`.
+
+    `depth` is the worker's own share of the backlog (see `queue_consumers`), so
+    replicas consuming the same queue do not each provision for all of it.
+    """
+    desired = active + math.ceil(depth * runtime_ms / (target_drain_seconds * 1000))
+    if oldest_wait_ms is not None and oldest_wait_ms > max_wait_seconds * 1000:
+        desired = max(desired, processes + 1)
+    return desired
+
+
+def read_autoscaler_states(redis_client) -> list:
+    """Returns the latest published state of every autoscaling worker."""
+    keys = sorted(redis_client.scan_iter(match=f"{STATE_KEY_PREFIX}*"))
+    return [json.loads(value) for value in redis_client.mget(keys) if value] if keys else []
+
+
+def queue_consumers(states: list, queues: list, hostname: str, live_after: float) -> dict:
+    """
+    Counts, per queue of `queues`, the autoscaling workers consuming it: this worker
+    (`hostname`) and every other one whose published state is newer than `live_after`.
+    Workers without --autoscale publish no state and are not counted.
+    """
+    consumers = {queue: 1 for queue in queues}
+    for record in states:
+        if record.get('hostname') == hostname or record.get('updated_at', 0) <= live_after:
+            continue
+        for queue in record.get('queues', []):
+            if queue in consumers:
+                consumers[queue] += 1
+    return consumers
+
+
+class QueueDepthAutoscaler(Autoscaler):
+    """
+    A Celery autoscaler (`worker_autoscaler`, active with `celery worker --autoscale=max,min`)
+    that sizes the pool from the backlog of the queues the worker consumes instead of
+    from the tasks it has already reserved, which with a prefetch of one message says
+    little about the work waiting.
+
+    Every `autoscale_check_seconds` it reads, from the Redis broker, the number of
+    waiting messages of all lanes and the age of the oldest one, and the average run
+    time of the queue's tasks (recorded by the workers in RUNTIME_KEY), and scales the
+    pool between the --autoscale bounds to `desired_concurrency`. The waiting messages
+    of each queue are divided among the live autoscaling workers consuming it, as
+    found in their published states. Each scaling decision
+    is logged, counted in metrics, and published to Redis (`autoscaler:<hostname>`)
+    for `GET /metrics/autoscaler`. Without a Redis broker it behaves like Celery's own
+    autoscaler. Only the prefork pool can be resized.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        conf = self.worker.app.conf
+        self._check_seconds = conf.get('autoscale_check_seconds', 5)
+        self._target_drain_seconds = conf.get('autoscale_target_drain_seconds', 60)
+        self._max_wait_seconds = conf.get('autoscale_max_wait_seconds', 30)
+        self._redis = get_broker_redis(conf.broker_url or '')
+        self._queues = None
+        self._next_check = 0.0
+        self._desired = None
+        self._signals = {}
+        self._measured = False
+        self._last_decision = None
+
+    @property
+    def queues(self) -> list:
+        if self._queues is None:
+            self._queues = sorted(self.worker.app.amqp.queues.consume_from) or ['celery']
+        return self._queues
+
+    def _measure(self):
+        processes = self.processes
+        lanes = lane_stats(self._redis, self.queues)
+        depth = sum(lane['depth'] for lane in lanes.values())
+        live_after = time.time() - max(MIN_LIVE_STATE_SECONDS, self._check_seconds * LIVE_STATE_CHECKS)
+        consumers = queue_consumers(read_autoscaler_states(self._redis), self.queues, self.worker.hostname, live_after)
+        depth_share = sum(entry['depth'] / consumers[queue]
+                          for lane in lanes.values() for queue, entry in lane['queues'].items())
+        waits = [entry['oldest_wait_ms'] for lane in lanes.values() for entry in lane['queues'].values()
+                 if entry['oldest_wait_ms'] is not None]
+        runtimes = [float(value) for value in self._redis.hmget(RUNTIME_KEY, self.queues) if value is not None]
+        runtime_ms = max(runtimes) if runtimes else DEFAULT_RUNTIME_MS
+        active = len(state.active_requests)
+        self._signals = {
+            'depth': depth,
+            'consumers': consumers,
+            'active': active,
+            'runtime_ms': runtime_ms,
+            'oldest_wait_ms': max(waits) if waits else None,
+        }
+        self._desired = desired_concurrency(
+            depth_share, active, runtime_ms, self._signals['oldest_wait_ms'], processes,
+            self._target_drain_seconds, self._max_wait_seconds
+        )
+
+    @property
+    def qty(self):
+        if self._redis is None:
+            return super().qty
+        if time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self._check_seconds
+            try:
+                self._measure()
+                self._measured = True
+            except Exception as e:
+                logger.warning(f"Autoscaler could not read the queue state, keeping the pool as is: {e}")
+                self._desired = None
+        return self.processes if self._desired is None else self._desired
+
+    def _maybe_scale(self, req=None):
+        before = self.processes
+        scaled = super()._maybe_scale(req)
+        after = self.processes
+        name = ','.join(self.queues)
+        metrics.set_gauge(f'autoscaler_processes:{name}', after)
+        if self._desired is not None:
+            metrics.set_gauge(f'autoscaler_desired_processes:{name}', self._desired)
+        if scaled and after != before:
+            metrics.increment('autoscaler_scale_ups_total' if after > before else 'autoscaler_scale_downs_total')
+            logger.info(f"Autoscaler [{name}]: {before} -> {after} processes (bounds {self.min_concurrency}-"
+                        f"{self.max_concurrency}; {self._signals.get('depth')} waiting (consumers "
+                        f"{self._signals.get('consumers')}), oldest "
+                        f"{self._signals.get('oldest_wait_ms')} ms; {self._signals.get('active')} running; "
+                        f"~{self._signals.get('runtime_ms')} ms per task)")
+            self._last_decision = {'from': before, 'to': after, 'at': time.time()}
+            self._publish(after)
+        elif self._measured:
+            self._publish(after)
+        self._measured = False
+        return scaled
+
+    def scale_down(self, n):
+        # Celery only shrinks a pool it has grown before; a pool started at its maximum may shrink too
+        if self._last_scale_up is None:
+            self._last_scale_up = time.monotonic() - self.keepalive - 1
+        return super().scale_down(n)
+
+    def _publish(self, processes):
+        record = {
+            'hostname': self.worker.hostname,
+            'queues': self.queues,
+            'processes': processes,
+            'desired': self._desired,
+            'min': self.min_concurrency,
+            'max': self.max_concurrency,
+            **self._signals,
+            'last_decision': self._last_decision,
+            'updated_at': time.time(),
+        }
+        try:
+            self._redis.set(f"{STATE_KEY_PREFIX}{self.worker.hostname}", json.dumps(record),
+                            ex=max(120, int(self._check_seconds * 6)))
+        except Exception as e:
+            logger.warning(f"Autoscaler could not publish its state: {e}")
@@ -1,67 +1,81 @@
+import json
 import logging
-from flask import Blueprint, request, jsonify, current_app
-from langchain.chains import ConversationalRetrievalChain
-from app.vector_store import get_vector_store # Centralized vector store access
-from app.ai_models import get_llm, get_embeddings # Centralized model access
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from app.chat_engine import get_chat_engine
 
 chat_bp = Blueprint('chat_bp', __name__)
 logger = logging.getLogger(__name__)
 
+
+def _format_sources(documents):
+    return [
+        {
+            "filename": doc.metadata.get('filename', 'N/A'),
+            "doc_id": str(doc.metadata.get('doc_id')),
+            "chunk_index": doc.metadata.get('chunk_index'),
+            "score": doc.metadata.get('score', 'N/A')
+        }
+        for doc in documents or []
+    ]
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _stream_answer(query, doc_id, chat_history):
+    """
+    Streams the chat engine's answer as Server-Sent Events: `retrieval` with the
+    sources, one `token` per generated piece of the answer, then `done` with the
+    full answer, sources and timings.
+    """
+    try:
+        for event, data in get_chat_engine().stream(query, doc_id, chat_history):
+            if 'source_documents' in data:
+                data = dict(data, source_documents=_format_sources(data['source_documents']))
+            yield _sse(event, data)
+    except Exception as e:
+        logger.error(f"Error during streamed chat processing: {e}", exc_info=True)
+        yield _sse('error', {"error": "An internal error occurred while processing your chat message."})
+
+
 @chat_bp.route('/chat', methods=['POST'])
 def chat_with_doc():
     """
     Handles chat queries for all documents or a specific document.
+
+    With `"stream": true` in the body (or `Accept: text/event-stream`), the answer is
+    streamed as Server-Sent Events instead of returned once it is complete. With
+    `"timings": true` (or `?timings=true`) a JSON answer includes the milliseconds
+    spent per stage; streamed answers always report them in the `done` event.
     """
     data = request.get_json()
     query = data.get('query')
     doc_id = data.get('doc_id') # Optional document ID to scope the chat
     # chat_history is currently not implemented on the frontend, but the backend supports it.
-    chat_history = data.get('chat_history', []) 
+    # Turns arrive as [question, answer] JSON arrays; the condense prompt expects tuples.
+    chat_history = [tuple(turn) for turn in data.get('chat_history', [])]
 
     if not query:
         logger.warning("Chat request received with no query.")
         return jsonify({"error": "Query is required"}), 400
 
-    try:
-        # 1. Get the globally managed AI models and vector store
-        llm = get_llm()
-        embeddings = get_embeddings()
-        vector_store = get_vector_store(current_app.db, embeddings)
-
-        # 2. Configure the retriever
-        # If a doc_id is provided, the search is filtered to that specific document.
-        search_kwargs = {"k": 4}
-        if doc_id:
-            logger.info(f"Chat query scoped to doc_id: {doc_id}")
-            search_kwargs["filter"] = {"doc_id": doc_id}
-            # When querying a single doc, we can retrieve more chunks
-            search_kwargs["k"] = 6
-        
-        retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
-
-        # 3. Create and run the Conversational Retrieval Chain
-        qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=llm, 
-            retriever=retriever,
-            return_source_documents=True,
-            chain_type="stuff",
+    if data.get('stream') or request.accept_mimetypes.best == 'text/event-stream':
+        logger.info(f"Streaming answer for query: '{query[:50]}...'")
+        return Response(
+            stream_with_context(_stream_answer(query, doc_id, chat_history)),
+            mimetype='text/event-stream',
+            # Keeps reverse proxies from buffering the events
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
         )
 
-        logger.info(f"Invoking retrieval chain for query: '{query[:50]}...'")
-        result = qa_chain({"question": query, "chat_history": chat_history})
-        answer = result.get('answer', "Sorry, I couldn't find an answer based on the provided documents.")
-
-        # 4. Format the source documents for the response
-        source_documents = []
-        if result.get('source_documents'):
-            for doc in result['source_documents']:
-                source_documents.append({
-                    "filename": doc.metadata.get('filename', 'N/A'),
-                    "doc_id": str(doc.metadata.get('doc_id')),
-                    "score": doc.metadata.get('score', 'N/A')
-                })
-
-        return jsonify({"answer": answer, "source_documents": source_documents})
+    try:
+        logger.info(f"Answering chat query: '{query[:50]}...'")
+        result = get_chat_engine().answer(query, doc_id, chat_history)
+        response = {"answer": result['answer'], "source_documents": _format_sources(result['source_documents'])}
+        if data.get('timings') or request.args.get('timings', '').lower() == 'true':
+            response['timings'] = result['timings']
+        return jsonify(response)
 
     except Exception as e:
         logger.error(f"Error during chat processing: {e}", exc_info=True)
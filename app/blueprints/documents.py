@@ -1,15 +1,70 @@
 import os
+import time
+import uuid
+import zipfile
+import tarfile
 import datetime
 import logging
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app, Response
+from pymongo.errors import ExecutionTimeout
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
-from io import BytesIO
+from app.ai_models import get_embeddings
+from app.vector_store import get_vector_store
+from app.hybrid_search import hybrid_search
+from app.metrics import metrics
+from app.scheduling import INTERACTIVE_LANE, BULK_LANE, lane_priority
+from app.utils.archives import ArchiveLimits, ArchiveLimitError, archive_kind, iter_archive_files
 
 documents_bp = Blueprint('documents_bp', __name__)
 logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'md', 'xlsx'}
 
+# Default and maximum number of documents per listing page
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+DEFAULT_SEARCH_PAGE_SIZE = 20
+
+# Size of the pieces a download is streamed out of GridFS in
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Bulk uploads are stored and inserted in batches of this many files
+BULK_UPLOAD_BATCH_SIZE = 500
+
+def _parse_search_filters(args):
+    """Reads the optional search filters from the query string. Raises ValueError for a malformed date."""
+    filters = {'category': args.get('category'), 'status': args.get('status')}
+    for name in ('created_from', 'created_to'):
+        if args.get(name):
+            try:
+                filters[name] = datetime.datetime.fromisoformat(args[name])
+            except ValueError:
+                raise ValueError(f"'{name}' must be an ISO 8601 date or datetime")
+    return filters
+
+def _new_document(file, stored, batch_id=None):
+    """Builds the initial record of an uploaded document from its StoredFile."""
+    doc_data = {
+        "filename": secure_filename(file.filename),
+        "content_type": file.content_type,
+        "file_id": stored.file_id,
+        "content_sha256": stored.sha256,
+        "status": "Queued for Processing",
+        "created_at": datetime.datetime.utcnow(),
+        "processed_at": None,
+        "kvps": {},
+        "category": None,
+        "categorization_explanation": None,
+        "text": None,
+        "embedding": None
+    }
+    if batch_id:
+        doc_data["batch_id"] = batch_id
+        # Fed into processing by dispatch_bulk_documents_task, fairly across batches
+        doc_data["processing_lane"] = BULK_LANE
+    return doc_data
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -18,55 +73,221 @@ def allowed_file(filename):
 def upload_document():
     db = current_app.db
     
-    if 'file' not in request.files:
+    if 'file' in request.files:
+        file = request.files['file']
+    elif request.args.get('filename') and request.content_length:
+        # Raw body upload (e.g. `curl --data-binary`): the request stream is piped
+        # straight into GridFS without going through form parsing.
+        file = FileStorage(
+            stream=request.stream,
+            filename=request.args['filename'],
+            content_type=request.mimetype or 'application/octet-stream'
+        )
+    else:
         return jsonify({"error": "No file part"}), 400
-    file = request.files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
     if file and allowed_file(file.filename):
-        file_id = db.save_file(file)
-        doc_data = {
-            "filename": secure_filename(file.filename),
-            "content_type": file.content_type,
-            "file_id": file_id,
-            "status": "Queued for Processing",
-            "created_at": datetime.datetime.utcnow(),
-            "processed_at": None,
-            "kvps": {},
-            "category": None,
-            "categorization_explanation": None,
-            "text": None,
-            "embedding": None
-        }
-        doc_id = db.create_document(doc_data)
+        stored = db.save_file(file)
+        doc_id = db.create_document(_new_document(file, stored))
 
         from app.celery_worker import process_document_task
-        process_document_task.delay(doc_id)
+        process_document_task.apply_async((doc_id,), priority=lane_priority(INTERACTIVE_LANE))
         
         created_doc = db.get_document(doc_id)
-        return jsonify({"message": "File uploaded and queued for processing", "document": created_doc}), 202
+        return jsonify({
+            "message": "File uploaded and queued for processing",
+            "document": created_doc,
+            "deduplicated": stored.deduplicated
+        }), 202
     else:
         return jsonify({"error": "File type not allowed"}), 400
 
+def _ingest_files(db, files, batch_id, results):
+    """
+    Stores and registers `files` in batches of BULK_UPLOAD_BATCH_SIZE: one batched
+    GridFS write and one insert_many per batch. The documents join the bulk lane and
+    the dispatcher is woken up after each batch, so processing starts while the upload
+    continues. Files are consumed strictly in order, so `files` may be a streaming
+    archive reader. A result entry per file is appended to `results`.
+
+    If a batch fails (e.g. the archive turns out to be broken halfway), the files it
+    stored so far are released, its files are reported as not queued, and the error
+    is re-raised; the documents of earlier batches stay queued.
+    """
+    from app.celery_worker import dispatch_bulk_documents_task
+
+    files = iter(files)
+    accepted = []
+
+    def next_batch():
+        for file in files:
+            if not file.filename or not allowed_file(file.filename):
+                results.append({"filename": file.filename, "error": "File type not allowed"})
+                continue
+            result = {"filename": secure_filename(file.filename)}
+            results.append(result)
+            accepted.append((result, file))
+            yield file
+            if len(accepted) == BULK_UPLOAD_BATCH_SIZE:
+                return
+
+    while True:
+        accepted.clear()
+        stored_files = []
+        try:
+            # save_files releases what it stored itself when it fails
+            stored_files = db.save_files(next_batch())
+            if not accepted:
+                break
+            doc_ids = db.create_documents([
+                _new_document(file, stored, batch_id) for (_, file), stored in zip(accepted, stored_files)
+            ])
+        except Exception:
+            db.release_files([stored.file_id for stored in stored_files])
+            for result, _ in accepted:
+                result["error"] = "Not queued: the upload was aborted"
+            raise
+        dispatch_bulk_documents_task.delay()
+        for (result, _), doc_id, stored in zip(accepted, doc_ids, stored_files):
+            result["document_id"] = doc_id
+            result["deduplicated"] = stored.deduplicated
+        logger.info(f"Bulk upload {batch_id}: queued {len(doc_ids)} documents.")
+
+@documents_bp.route('/documents/bulk', methods=['POST'])
+def bulk_upload_documents():
+    """
+    Uploads many documents at once, either as several multipart `files` parts or as
+    one zip/tar archive (a multipart `archive` part, or the raw request body), and
+    queues them all for processing. Returns a batch id and a result per file.
+    """
+    db = current_app.db
+    config = current_app.config
+    limits = ArchiveLimits(config['ARCHIVE_MAX_FILES'], config['ARCHIVE_MAX_UNCOMPRESSED_BYTES'],
+                           config['ARCHIVE_MAX_COMPRESSION_RATIO'])
+    if 'archive' in request.files:
+        archive = request.files['archive']
+        kind = archive_kind(archive.mimetype, archive.filename)
+        files = iter_archive_files(archive.stream, kind, limits) if kind else None
+    elif request.files:
+        kind = None
+        files = request.files.getlist('files') + request.files.getlist('file')
+    else:
+        kind = archive_kind(request.mimetype, request.args.get('filename', ''))
+        # The raw body is unpacked while it streams in
+        files = iter_archive_files(request.stream, kind, limits) if kind else None
+    if files is None:
+        return jsonify({"error": "Send multipart 'files' parts or a zip/tar archive"}), 400
+
+    batch_id = uuid.uuid4().hex
+    results = []
+    error = None
+    started = time.perf_counter()
+    try:
+        _ingest_files(db, files, batch_id, results)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        logger.warning(f"Bulk upload {batch_id}: unreadable {kind} archive: {e}")
+        error = f"Invalid {kind} archive: {e}"
+    except ArchiveLimitError as e:
+        metrics.increment('bulk_upload_archives_rejected_total')
+        logger.warning(f"Bulk upload {batch_id}: {kind} archive refused: {e}")
+        error = f"Archive refused: {e}"
+    elapsed = time.perf_counter() - started
+
+    accepted = sum(1 for result in results if "document_id" in result)
+    files_per_second = accepted / elapsed if elapsed > 0 else None
+    metrics.increment('bulk_upload_files_total', accepted)
+    metrics.increment('bulk_upload_rejected_total', len(results) - accepted)
+    if files_per_second:
+        metrics.observe('bulk_upload_files_per_second', files_per_second)
+    logger.info(f"Bulk upload {batch_id}: {accepted}/{len(results)} files queued in {elapsed:.2f}s.")
+    body = {
+        "message": f"{accepted} files uploaded and queued for processing",
+        "batch_id": batch_id,
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_second": round(files_per_second, 1) if files_per_second else None,
+        "files": results
+    }
+    if error is None:
+        return jsonify(body), 202
+    # Documents of the batches stored before the error stay queued
+    return jsonify({"error": error, **body}), 207 if accepted else 400
+
 @documents_bp.route('/documents', methods=['GET'])
 def get_documents():
-    """Fetches documents, optionally filtering by category."""
+    """
+    Fetches one page of documents, newest first, optionally filtering by category.
+    Pass the returned `next_cursor` as `after` to get the next page.
+    """
     db = current_app.db
     category = request.args.get('category')
     # Add a new parameter to fetch deleted documents for the trash view
     include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
-    docs = db.get_documents(category=category, include_deleted=include_deleted)
-    return jsonify(docs)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"'limit' must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or None
+
+    try:
+        page = db.get_documents(
+            category=category,
+            include_deleted=include_deleted,
+            limit=limit,
+            after=request.args.get('after'),
+            fields=fields
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
 
 @documents_bp.route('/documents/search', methods=['GET'])
 def search_documents():
+    """
+    Ranked search over filenames, extracted text and KVP values. `mode=lexical` (default)
+    uses the full-text index only; `mode=hybrid` also runs a semantic search over the
+    document chunks and fuses both rankings. Pass the returned `next_offset` as `offset`
+    to get the next page.
+    """
     db = current_app.db
-    query = request.args.get('q', '')
+    query = request.args.get('q', '').strip()
+    mode = request.args.get('mode', 'lexical')
+    if mode not in ('lexical', 'hybrid'):
+        return jsonify({"error": "'mode' must be 'lexical' or 'hybrid'"}), 400
     if not query:
-        return jsonify([])
+        return jsonify({"documents": [], "next_offset": None})
+    limit = request.args.get('limit', DEFAULT_SEARCH_PAGE_SIZE, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE or offset < 0:
+        return jsonify({"error": f"'limit' must be between 1 and {MAX_PAGE_SIZE} and 'offset' must not be negative"}), 400
+    max_results = current_app.config['SEARCH_MAX_RESULTS']
+    if offset >= max_results:
+        return jsonify({"error": f"Only the first {max_results} results of a search can be paged through; refine the query"}), 400
+    try:
+        filters = _parse_search_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    results = db.search_documents(query)
+    try:
+        if mode == 'lexical':
+            return jsonify(db.search_documents(query, limit=limit, offset=offset, filters=filters))
+
+        results = hybrid_search(
+            db,
+            get_vector_store(db, get_embeddings()),
+            query,
+            limit=limit,
+            offset=offset,
+            filters=filters,
+            rrf_k=current_app.config['HYBRID_SEARCH_RRF_K'],
+            min_candidates=current_app.config['HYBRID_SEARCH_CANDIDATES']
+        )
+    except ExecutionTimeout:
+        logger.warning(f"Search for '{query}' exceeded SEARCH_MAX_TIME_MS")
+        metrics.increment('search_timeouts_total')
+        return jsonify({"error": "The search matches too many documents to rank in time; refine the query"}), 503
     return jsonify(results)
 
 @documents_bp.route('/documents/<doc_id>', methods=['GET'])
@@ -106,9 +327,43 @@ def restore_document(doc_id):
         logger.error(f"Error restoring document {doc_id}: {e}", exc_info=True)
         return jsonify({"error": "An internal error occurred"}), 500
 
+@documents_bp.route('/documents/<doc_id>/purge', methods=['DELETE'])
+def purge_document(doc_id):
+    """
+    Permanently deletes a soft-deleted document. Its stored file is removed once
+    no other document with the same content references it.
+    """
+    try:
+        if current_app.db.purge_document(doc_id):
+            logger.info(f"Permanently deleted document with ID {doc_id}")
+            return jsonify({"message": "Document permanently deleted"}), 200
+        else:
+            logger.warning(f"Purge failed: Document with ID {doc_id} not found or not deleted.")
+            return jsonify({"error": "Document not found or not in trash"}), 404
+    except Exception as e:
+        logger.error(f"Error purging document {doc_id}: {e}", exc_info=True)
+        return jsonify({"error": "An internal error occurred"}), 500
+
+def _iter_file_range(stream, start, end):
+    """Yields the bytes [start, end) of a seekable file in DOWNLOAD_CHUNK_SIZE pieces."""
+    try:
+        stream.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = stream.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        stream.close()
+
 @documents_bp.route('/documents/<doc_id>/download', methods=['GET'])
 def download_document(doc_id):
-    """Downloads the original file for a given document."""
+    """
+    Streams the original file for a given document out of GridFS.
+    Supports single-range `Range` requests so clients can resume or seek.
+    """
     db = current_app.db
     doc = db.get_document(doc_id)
     if not doc:
@@ -118,11 +373,31 @@ def download_document(doc_id):
     if not file_data:
         return jsonify({"error": "File not found in storage"}), 404
 
-    return send_file(
-        BytesIO(file_data['content']),
+    length = file_data['length']
+    start, end = 0, length
+    status = 200
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="{file_data["filename"]}"'
+    }
+
+    # Multi-range requests are answered with the full file, which RFC 9110 allows.
+    if request.range is not None and len(request.range.ranges) == 1:
+        byte_range = request.range.range_for_length(length)
+        if byte_range is None:
+            file_data['stream'].close()
+            return Response(status=416, headers={'Content-Range': f'bytes */{length}'})
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{length}'
+
+    headers['Content-Length'] = str(end - start)
+    return Response(
+        _iter_file_range(file_data['stream'], start, end),
+        status=status,
         mimetype=file_data['content_type'],
-        as_attachment=True,
-        download_name=file_data['filename']
+        headers=headers,
+        direct_passthrough=True
     )
 
 @documents_bp.route('/documents/<doc_id>/kvp', methods=['PUT'])
@@ -132,12 +407,10 @@ def update_kvp(doc_id):
     if not isinstance(new_kvps, dict):
         return jsonify({"error": "Invalid JSON: body must be a dictionary"}), 400
 
-    if not db.get_document(doc_id):
+    updated_doc = db.update_document_kvp(doc_id, new_kvps)
+    if not updated_doc:
         return jsonify({"error": "Document not found"}), 404
 
-    db.update_document_kvp(doc_id, new_kvps)
-
-    updated_doc = db.get_document(doc_id)
     return jsonify({"message": "KVP updated successfully", "document": updated_doc})
 
 @documents_bp.route('/documents/<doc_id>/recategorize', methods=['PUT'])
@@ -150,16 +423,20 @@ def recategorize(doc_id):
     if not new_category:
         return jsonify({"error": "New category is required"}), 400
 
-    if not db.get_document(doc_id):
+    updated_doc = db.recategorize_document(doc_id, new_category, explanation)
+    if not updated_doc:
         return jsonify({"error": "Document not found"}), 404
 
-    db.recategorize_document(doc_id, new_category, explanation)
-
-    updated_doc = db.get_document(doc_id)
     return jsonify({"message": f"Document re-categorized to '{new_category}'", "document": updated_doc})
 
 # --- Interactive KVP Management Endpoints ---
 
+def _kvp_not_found(db, doc_id, key):
+    """Tells apart a missing document from a missing key after a failed KVP edit."""
+    if not db.get_document(doc_id):
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify({"error": f"KVP with key '{key}' not found in document"}), 404
+
 @documents_bp.route('/documents/<doc_id>/kvp/add', methods=['POST'])
 def add_kvp_interactively(doc_id):
     """
@@ -174,13 +451,11 @@ def add_kvp_interactively(doc_id):
     if not key or value is None: # value can be an empty string
         return jsonify({"error": "Both 'key' and 'value' are required"}), 400
 
-    if not db.get_document(doc_id):
-        return jsonify({"error": "Document not found"}), 404
-
     try:
-        # This new DB function will add the KVP and log for fine-tuning
-        db.add_interactive_kvp(doc_id, key, value)
-        updated_doc = db.get_document(doc_id)
+        # This DB function adds the KVP, logs it for fine-tuning and returns the updated document
+        updated_doc = db.add_interactive_kvp(doc_id, key, value)
+        if not updated_doc:
+            return jsonify({"error": "Document not found"}), 404
         logger.info(f"Interactively added KVP '{key}' to document {doc_id}")
         return jsonify({"message": "KVP added and logged for training", "document": updated_doc}), 200
     except Exception as e:
@@ -202,16 +477,12 @@ def update_kvp_interactively(doc_id):
     if not key or value is None:
         return jsonify({"error": "Both 'key' and 'value' are required"}), 400
 
-    if not db.get_document(doc_id):
-        return jsonify({"error": "Document not found"}), 404
-
     try:
-        # This new DB function will update the KVP and log for fine-tuning
-        result = db.update_interactive_kvp(doc_id, key, value)
-        if not result:
-             return jsonify({"error": f"KVP with key '{key}' not found in document"}), 404
-        
-        updated_doc = db.get_document(doc_id)
+        # This DB function updates the KVP, logs it for fine-tuning and returns the updated document
+        updated_doc = db.update_interactive_kvp(doc_id, key, value)
+        if not updated_doc:
+            return _kvp_not_found(db, doc_id, key)
+
         logger.info(f"Interactively updated KVP '{key}' in document {doc_id}")
         return jsonify({"message": "KVP updated and logged for training", "document": updated_doc}), 200
     except Exception as e:
@@ -232,16 +503,12 @@ def delete_kvp_interactively(doc_id):
     if not key:
         return jsonify({"error": "'key' is required in the request body"}), 400
 
-    if not db.get_document(doc_id):
-        return jsonify({"error": "Document not found"}), 404
-
     try:
-        # This new DB function will delete the KVP and log for fine-tuning
-        result = db.delete_interactive_kvp(doc_id, key)
-        if not result:
-            return jsonify({"error": f"KVP with key '{key}' not found in document"}), 404
+        # This DB function deletes the KVP, logs it for fine-tuning and returns the updated document
+        updated_doc = db.delete_interactive_kvp(doc_id, key)
+        if not updated_doc:
+            return _kvp_not_found(db, doc_id, key)
 
-        updated_doc = db.get_document(doc_id)
         logger.info(f"Interactively deleted KVP '{key}' from document {doc_id}")
         return jsonify({"message": "KVP deleted and logged for training", "document": updated_doc}), 200
     except Exception as e:
@@ -252,17 +519,17 @@ def delete_kvp_interactively(doc_id):
 def reprocess_document(doc_id):
     """
     Re-triggers the AI processing for a document, typically after a failure.
+    With `?force=true` the document is processed from scratch even if another
+    document with identical content has already been processed.
     """
     db = current_app.db
-    if not db.get_document(doc_id):
+    force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+    updated_doc = db.update_document_for_reprocessing(doc_id)
+    if not updated_doc:
         return jsonify({"error": "Document not found"}), 404
 
-    db.update_document_for_reprocessing(doc_id)
-
     from app.celery_worker import process_document_task
-    process_document_task.delay(doc_id)
-
-    updated_doc = db.get_document(doc_id)
+    process_document_task.apply_async((doc_id,), {'force': force}, priority=lane_priority(INTERACTIVE_LANE))
 
     return jsonify({
         "message": "Document has been re-queued for processing.",
@@ -1,9 +1,68 @@
 
-from flask import Blueprint, jsonify
+import datetime
+import logging
+from flask import Blueprint, jsonify, current_app
+from app.metrics import metrics
+from app.scheduling import BULK_LANE, get_broker_redis, lane_stats
+from app.autoscaler import read_autoscaler_states
 
 health_bp = Blueprint('health_bp', __name__)
+logger = logging.getLogger(__name__)
 
 @health_bp.route('/health', methods=['GET'])
 def health_check():
     """Returns a 200 OK status to indicate the service is running."""
     return jsonify({"status": "ok"}), 200
+
+@health_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Returns the in-process metrics (counters, gauges and summaries) of the serving worker."""
+    return jsonify(metrics.snapshot()), 200
+
+@health_bp.route('/metrics/lanes', methods=['GET'])
+def get_lane_metrics():
+    """
+    Returns the depth of each processing lane: the task messages waiting in the Redis
+    broker per queue, with the age of the oldest one, and the bulk documents that are
+    in flight or still held back by fair-share dispatching.
+    """
+    from app.celery_worker import STAGE_QUEUES
+    config = current_app.config
+    queues = ['celery'] + sorted(set(STAGE_QUEUES.values()))
+
+    redis_client = get_broker_redis(config['CELERY_BROKER_URL'])
+    if redis_client is None:
+        return jsonify({"error": "Lane metrics need a Redis broker"}), 501
+    try:
+        lanes = lane_stats(redis_client, queues)
+    except Exception as e:
+        logger.error(f"Could not read the lane depths from the broker: {e}")
+        return jsonify({"error": "The broker is unavailable"}), 503
+
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=config['BULK_DISPATCH_STALE_SECONDS'])
+    waiting, in_flight = current_app.db.get_bulk_dispatch_state(stale_before)
+    lanes[BULK_LANE]['documents_waiting'] = sum(waiting.values())
+    lanes[BULK_LANE]['documents_in_flight'] = sum(in_flight.values())
+    lanes[BULK_LANE]['batches'] = {
+        batch_id: {"waiting": waiting.get(batch_id, 0), "in_flight": in_flight.get(batch_id, 0)}
+        for batch_id in list(waiting) + [batch_id for batch_id in in_flight if batch_id not in waiting]
+    }
+    for lane, stats in lanes.items():
+        metrics.set_gauge(f'lane_depth:{lane}', stats['depth'])
+    return jsonify({"lanes": lanes}), 200
+
+@health_bp.route('/metrics/autoscaler', methods=['GET'])
+def get_autoscaler_metrics():
+    """
+    Returns the latest state of every autoscaling Celery worker: its queues, pool size,
+    bounds, the signals it scaled on and its last scaling decision.
+    """
+    redis_client = get_broker_redis(current_app.config['CELERY_BROKER_URL'])
+    if redis_client is None:
+        return jsonify({"error": "Autoscaler metrics need a Redis broker"}), 501
+    try:
+        workers = read_autoscaler_states(redis_client)
+    except Exception as e:
+        logger.error(f"Could not read the autoscaler states from the broker: {e}")
+        return jsonify({"error": "The broker is unavailable"}), 503
+    return jsonify({"workers": workers}), 200
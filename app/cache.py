@@ -0,0 +1,181 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# After a Redis error the Redis tier is skipped for this many seconds
+REDIS_RETRY_SECONDS = 5
+
+# Each invalidation bumps a per-key generation counter in Redis, kept at least this long
+# after the last invalidation of the key (longer than any read-through should take)
+GENERATION_TTL_SECONDS = 600
+
+# Writes a value only if the key's generation is still the one read before loading it
+SET_IF_GENERATION_SCRIPT = """
+local generation = redis.call('GET', KEYS[2]) or ''
+if generation ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# Deletes the keys KEYS[1..n] and bumps their generations KEYS[n+1..2n]
+INVALIDATE_SCRIPT = """
+local count = #KEYS / 2
+for i = 1, count do
+    redis.call('DEL', KEYS[i])
+    redis.call('INCR', KEYS[count + i])
+    redis.call('EXPIRE', KEYS[count + i], ARGV[1])
+end
+return count
+"""
+
+
+class TwoTierCache:
+    """
+    A read-through cache of serialized values (bytes) with two tiers:
+
+    1. An in-process LRU of at most `max_entries` values and `max_bytes` bytes, each
+       kept for at most `local_ttl` seconds. The TTL bounds how long a process can
+       serve a value that another process (e.g. a Celery worker) has since changed.
+    2. An optional Redis tier shared by all API and worker processes, with
+       entries expiring after `redis_ttl` seconds. Mutations delete keys from
+       both tiers, so other processes see the change once their local entry expires.
+
+    A read-through takes the key's `generation` before loading the value and passes it
+    to `set`, which drops the value if the key was invalidated in between; otherwise a
+    reader that loaded a value just before a mutation would cache the old value after
+    the mutation's invalidation.
+
+    Redis errors are logged and treated as misses; the cache never fails a request.
+    Hits and misses are counted in the metrics registry.
+    """
+    def __init__(self, max_entries: int = 10_000, local_ttl: float = 5, redis_url: str = None,
+                 redis_ttl: float = 300, namespace: str = 'dp-cache', max_bytes: int = 64 * 1024 * 1024):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        # Bumped by every invalidation in this process; guards read-throughs of the local tier
+        self._local_generation = 0
+        self._local_ttl = local_ttl
+        self._redis_ttl = int(redis_ttl)
+        self._namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_retry_at = 0.0
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            except ImportError:
+                logger.warning("CACHE_REDIS_URL is set but the 'redis' package is not installed; using the local cache only.")
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self._namespace}:{key}"
+
+    def _generation_key(self, key: str) -> str:
+        return f"{self._namespace}:generation:{key}"
+
+    def _call_redis(self, description: str, method: str, *args, **kwargs):
+        """Runs a Redis command, returning None (and pausing the Redis tier) if it fails."""
+        if self._redis is None or time.monotonic() < self._redis_retry_at:
+            return None
+        try:
+            return getattr(self._redis, method)(*args, **kwargs)
+        except Exception as e:
+            self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+            logger.warning(f"Redis cache {description} failed, skipping Redis for {REDIS_RETRY_SECONDS}s: {e}")
+            return None
+
+    def get(self, key: str):
+        """Returns the cached bytes for `key`, or None on a miss."""
+        if self._max_entries > 0:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    expires_at, value = entry
+                    if expires_at > time.monotonic():
+                        self._entries.move_to_end(key)
+                        metrics.increment('cache_local_hits_total')
+                        return value
+                    self._pop_local(key)
+
+        value = self._call_redis(f"read of '{key}'", 'get', self._redis_key(key))
+        if value is not None:
+            metrics.increment('cache_redis_hits_total')
+            self._set_local(key, value)
+            return value
+
+        metrics.increment('cache_misses_total')
+        return None
+
+    def generation(self, key: str):
+        """
+        Returns the current generation of `key`, to be taken before loading its value
+        and passed to `set`. None for the Redis part means Redis could not be read.
+        """
+        with self._lock:
+            local_generation = self._local_generation
+        values = self._call_redis(f"generation read of '{key}'", 'mget', [self._generation_key(key)])
+        redis_generation = None if values is None else (values[0] or b'').decode()
+        return local_generation, redis_generation
+
+    def set(self, key: str, value: bytes, generation=None):
+        """
+        Caches `value`. With a `generation` from `generation(key)`, the value is only
+        cached if `key` has not been invalidated since.
+        """
+        if generation is None:
+            self._set_local(key, value)
+            self._call_redis(f"write of '{key}'", 'set', self._redis_key(key), value, ex=self._redis_ttl)
+            return
+        local_generation, redis_generation = generation
+        if self._redis is not None:
+            if redis_generation is None:
+                return
+            written = self._call_redis(f"write of '{key}'", 'eval', SET_IF_GENERATION_SCRIPT, 2,
+                                       self._redis_key(key), self._generation_key(key),
+                                       redis_generation, value, self._redis_ttl)
+            if not written:
+                metrics.increment('cache_stale_writes_skipped_total')
+                return
+        self._set_local(key, value, local_generation)
+
+    def _set_local(self, key: str, value: bytes, generation: int = None):
+        if self._max_entries <= 0 or len(value) > self._max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._local_generation:
+                metrics.increment('cache_stale_writes_skipped_total')
+                return
+            self._pop_local(key)
+            self._entries[key] = (time.monotonic() + self._local_ttl, value)
+            self._bytes += len(value)
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                metrics.increment('cache_evictions_total')
+
+    def _pop_local(self, key: str):
+        """Removes `key` from the local tier; the caller holds the lock."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def delete(self, *keys: str):
+        """Invalidates `keys` in both tiers."""
+        with self._lock:
+            self._local_generation += 1
+            for key in keys:
+                self._pop_local(key)
+        if keys:
+            self._call_redis(f"invalidation of {list(keys)}", 'eval', INVALIDATE_SCRIPT, 2 * len(keys),
+                             *[self._redis_key(key) for key in keys],
+                             *[self._generation_key(key) for key in keys],
+                             max(GENERATION_TTL_SECONDS, self._redis_ttl))
+        metrics.increment('cache_invalidations_total', len(keys))
@@ -1,14 +1,41 @@
+import time
+import uuid
 import logging
-from celery import Celery
+import datetime
+from contextlib import contextmanager
+from celery import Celery, chain
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_init, worker_process_init
 from flask import current_app, Flask
-from app.utils.doc_utils import extract_text, extract_kvps_and_category
-from app.ai_models import get_llm, get_embeddings
+from app.utils.doc_utils import (
+    TextSegment, TextExtractionError, iter_doc_segments, join_segments, get_kvps_and_category
+)
+from app.utils.chunking import chunk_segments
+from app.embedding_batcher import get_embedding_batcher
 from app.database import Database
+from app.pipeline_checkpoints import pack_embeddings, unpack_embeddings
+from app.metrics import metrics
+from app.scheduling import (
+    INTERACTIVE_LANE, BULK_LANE, broker_transport_options, lane_priority, lane_for_priority, fair_share,
+    get_broker_redis
+)
+from app.autoscaler import record_task_runtime
+from app.model_preload import preload_models, after_fork
 
 # Initialize Celery
 celery = Celery(__name__)
 logger = logging.getLogger(__name__)
 
+# Queue of each processing stage, so each can be served by its own pool of workers
+# (`celery worker -Q extract`, `-Q llm`, `-Q embed`). The entry task, the persist stage
+# and periodic tasks stay on the default 'celery' queue.
+STAGE_QUEUES = {
+    'extract_text_task': 'extract',
+    'classify_document_task': 'llm',
+    'embed_document_task': 'embed',
+}
+
 def make_celery(app: Flask) -> Celery:
     """
     Factory to create and configure a Celery instance that is integrated
@@ -16,7 +43,27 @@ def make_celery(app: Flask) -> Celery:
     """
     celery.conf.update(
         broker_url=app.config["CELERY_BROKER_URL"],
-        result_backend=app.config["CELERY_RESULT_BACKEND"]
+        result_backend=app.config["CELERY_RESULT_BACKEND"],
+        task_routes={name: {'queue': queue} for name, queue in STAGE_QUEUES.items()},
+        # One Redis list per lane and queue, served highest priority first
+        broker_transport_options=broker_transport_options(),
+        # Workers reserve one message at a time, so a bulk backlog is not prefetched ahead of interactive work
+        worker_prefetch_multiplier=1,
+        # Sizes the pools of workers started with --autoscale=max,min from the backlog of their queues
+        worker_autoscaler='app.autoscaler:QueueDepthAutoscaler',
+        autoscale_check_seconds=app.config["AUTOSCALE_CHECK_SECONDS"],
+        autoscale_target_drain_seconds=app.config["AUTOSCALE_TARGET_DRAIN_SECONDS"],
+        autoscale_max_wait_seconds=app.config["AUTOSCALE_MAX_WAIT_SECONDS"],
+        beat_schedule={
+            'reconcile-dashboard-statistics': {
+                'task': 'reconcile_dashboard_statistics_task',
+                'schedule': app.config["DASHBOARD_STATS_RECONCILE_SECONDS"]
+            },
+            'dispatch-bulk-documents': {
+                'task': 'dispatch_bulk_documents_task',
+                'schedule': app.config["BULK_DISPATCH_INTERVAL_SECONDS"]
+            }
+        }
     )
 
     class ContextTask(celery.Task):
@@ -26,65 +73,285 @@ def make_celery(app: Flask) -> Celery:
                 return self.run(*args, **kwargs)
 
     celery.Task = ContextTask
+
+    if app.config["MODEL_PRELOAD"] and not app.config["EMBEDDINGS_SERVICE_URL"]:
+        # worker_init runs in the parent before the pool forks; worker_process_init in each child
+        @worker_init.connect(weak=False)
+        def _preload_models(sender=None, **kwargs):
+            # Thread pools (worker-embed) do not fork, so they keep torch's thread pool
+            forks = get_implementation(sender.pool_cls) is PreforkPool
+            preload_models(app.config["EMBEDDINGS_MODEL_NAME"], warm_up=app.config["MODEL_PRELOAD_WARM_UP"],
+                           forks=forks)
+
+        @worker_process_init.connect(weak=False)
+        def _after_fork(**kwargs):
+            after_fork()
+
     logger.info("Celery instance configured.")
     return celery
 
+@before_task_publish.connect
+def _stamp_lane(headers=None, properties=None, **kwargs):
+    """Records the lane and the publishing time of every task message, for the lane wait metrics."""
+    headers['lane'] = lane_for_priority((properties or {}).get('priority'))
+    headers['enqueued_at'] = time.time()
+
+
+@task_prerun.connect
+def _observe_lane_wait(task=None, **kwargs):
+    task.request.started_at = time.perf_counter()
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    if enqueued_at:
+        lane = getattr(task.request, 'lane', None) or INTERACTIVE_LANE
+        metrics.observe(f'queue_wait_ms:{lane}', round((time.time() - enqueued_at) * 1000, 1))
+
+
+@task_postrun.connect
+def _record_runtime(task=None, **kwargs):
+    """Keeps the average run time of each queue's tasks in Redis, for the autoscaler."""
+    started_at = getattr(task.request, 'started_at', None)
+    queue = (task.request.delivery_info or {}).get('routing_key')
+    if started_at is None or not queue:
+        return
+    try:
+        redis_client = get_broker_redis(celery.conf.broker_url or '')
+        if redis_client is not None:
+            record_task_runtime(redis_client, queue, (time.perf_counter() - started_at) * 1000)
+    except Exception as e:
+        logger.warning(f"Could not record the run time of {task.name}: {e}")
+
+
+# Stage tasks retry on their own; the stages before them are not run again
+STAGE_RETRY_OPTIONS = dict(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+
+
+def _load_checkpoint(db: Database, run: dict, stage: str) -> dict:
+    output = db.pipeline_checkpoints.load(run['doc_id'], run['run_id'], stage)
+    if output is None:
+        raise LookupError(f"No '{stage}' checkpoint for document {run['doc_id']} (run {run['run_id']}); it may have expired.")
+    return output
+
+
+def _load_segments(db: Database, run: dict) -> list:
+    return [TextSegment(*values) for values in _load_checkpoint(db, run, 'extract')['segments']]
+
+
+def _chunks(segments: list) -> list:
+    # Chunking is deterministic, so the chunks are recomputed from the segments instead of checkpointed
+    return chunk_segments(
+        segments,
+        chunk_size=current_app.config['CHUNK_SIZE'],
+        chunk_overlap=current_app.config['CHUNK_OVERLAP']
+    )
+
+
+@contextmanager
+def _stage(task, run: dict, stage: str):
+    """
+    Wraps one stage of a processing run: records its duration, and marks the document
+    as failed once the stage has used up its retries.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        logger.error(f"[STAGE_FAILURE] Stage '{stage}' failed for document ID {run['doc_id']} "
+                     f"(attempt {task.request.retries + 1}): {e}", exc_info=True)
+        if task.request.retries >= task.max_retries:
+            task.db.update_document_status(run['doc_id'], "Error", {}, None, "An unexpected error occurred during processing.", None)
+        raise
+    finally:
+        metrics.observe(f'pipeline_{stage}_ms', round((time.perf_counter() - started) * 1000, 1))
+
+
 @celery.task(bind=True, name='process_document_task', autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
-def process_document_task(self, doc_id: str):
+def process_document_task(self, doc_id: str, force: bool = False, lane: str = INTERACTIVE_LANE):
     """
-    Asynchronous task to process a single document. This task is the core of the document analysis pipeline.
-    It uses automatic retry for robustness.
+    Entry point of document processing. Starts a run of the staged pipeline
+
+        extract_text_task -> classify_document_task -> embed_document_task -> persist_document_task
+
+    as a Celery chain. The stages are routed to their own queues (STAGE_QUEUES), so
+    text extraction, LLM and embedding workers are scaled separately, and each stage
+    checkpoints its output so a retry resumes at the stage that failed. Every stage is
+    published with the priority of the document's `lane`.
+
+    If another document with identical content has already been processed, its result
+    is copied instead of extracting, classifying and embedding the same bytes again,
+    unless `force` is set; `force` also bypasses the LLM result cache.
     """
     db: Database = self.db
 
-    try:
-        logger.info(f"[TASK_START] Processing document ID: {doc_id}")
+    logger.info(f"[TASK_START] Processing document ID: {doc_id}")
+    doc = db.get_document(doc_id)
+    if not doc:
+        logger.error(f"Document with ID {doc_id} not found. Aborting task.")
+        return
+
+    if not force:
+        source_id = db.find_processed_duplicate(doc_id, doc.get('content_sha256'))
+        if source_id and db.reuse_processing_result(doc_id, source_id):
+            metrics.increment('processing_reuse_total')
+            logger.info(f"[TASK_SUCCESS] Reused the processing result of identical document {source_id} for {doc_id}")
+            if lane == BULK_LANE:
+                dispatch_bulk_documents_task.delay()
+            return {"status": "success", "doc_id": doc_id, "reused_from": source_id}
+
+    run = {"doc_id": doc_id, "run_id": uuid.uuid4().hex, "force": force, "lane": lane}
+    priority = lane_priority(lane)
+    chain(
+        extract_text_task.s(run).set(priority=priority),
+        classify_document_task.s().set(priority=priority),
+        embed_document_task.s().set(priority=priority),
+        persist_document_task.s().set(priority=priority)
+    ).apply_async()
+    return {"status": "started", "doc_id": doc_id, "run_id": run['run_id']}
+
+
+@celery.task(bind=True, name='extract_text_task', **STAGE_RETRY_OPTIONS)
+def extract_text_task(self, run: dict):
+    """
+    Stage 1/4: extracts the text segments of the document, streaming them out of GridFS.
+    Returns `run` for the next stage, or None (ending the chain) if there is nothing to process.
+    """
+    db: Database = self.db
+    doc_id = run['doc_id']
+    with _stage(self, run, 'extract'):
+        if db.pipeline_checkpoints.load(doc_id, run['run_id'], 'extract') is not None:
+            return run
+
         doc = db.get_document(doc_id)
         if not doc:
             logger.error(f"Document with ID {doc_id} not found. Aborting task.")
-            return
-
-        file_content = db.get_file_content(doc.get('file_id'))
-        if not file_content:
+            return None
+        file_data = db.get_file_with_metadata(doc.get('file_id'))
+        if not file_data:
             db.update_document_status(doc_id, "Error", {}, None, "File content not found in storage.", None)
             logger.error(f"File content for doc ID {doc_id} not found. Aborting.")
-            return
+            return None
 
-        # 1. Extract Text
         logger.info(f"Step 1/4: Extracting text from '{doc['filename']}'.")
-        text = extract_text(file_content, doc['content_type'])
-        if not text:
+        try:
+            with file_data['stream'] as file_stream:
+                segments = list(iter_doc_segments(
+                    file_stream,
+                    doc['content_type'],
+                    pdf_workers=current_app.config['PDF_EXTRACTION_WORKERS'],
+                    pdf_parallel_threshold=current_app.config['PDF_PARALLEL_PAGE_THRESHOLD']
+                ))
+        except TextExtractionError:
+            # A corrupt file fails the same way on every retry
+            segments = []
+        if not join_segments(segments):
             db.update_document_status(doc_id, "Error", {}, None, "Failed to extract text.", None)
             logger.warning(f"Could not extract text from '{doc['filename']}'.")
-            return
-
-        # 2. Extract Key-Value Pairs and Category
-        logger.info(f"Step 2/4: Extracting KVPs and category for '{doc['filename']}'.")
-        llm = get_llm()
-        all_categories = db.get_all_categories()
-        kvps, category_name, explanation = extract_kvps_and_category(text, all_categories, llm)
-
-        # 3. Generate Embeddings
-        logger.info(f"Step 3/4: Generating embeddings for '{doc['filename']}'.")
-        embeddings_model = get_embeddings()
-        embedding = embeddings_model.embed_query(text)
-        
-        # 4. Update the document in the database with all the new information
-        logger.info(f"Step 4/4: Saving all extracted data for '{doc['filename']}'.")
+            return None
+
+        db.pipeline_checkpoints.save(doc_id, run['run_id'], 'extract', {'segments': [list(segment) for segment in segments]})
+    return run
+
+
+@celery.task(bind=True, name='classify_document_task', **STAGE_RETRY_OPTIONS)
+def classify_document_task(self, run: dict):
+    """Stage 2/4: extracts the key-value pairs and the category of the document with the LLM."""
+    if run is None:
+        return None
+    db: Database = self.db
+    with _stage(self, run, 'classify'):
+        if db.pipeline_checkpoints.load(run['doc_id'], run['run_id'], 'classify') is not None:
+            return run
+
+        logger.info(f"Step 2/4: Extracting KVPs and category for document ID {run['doc_id']}.")
+        text = join_segments(_load_segments(db, run))
+        kvps, category_name = get_kvps_and_category(
+            text, categories=db.get_all_categories(), cache=db.llm_cache, refresh_cache=run['force']
+        )
+        db.pipeline_checkpoints.save(run['doc_id'], run['run_id'], 'classify', {'kvps': kvps, 'category': category_name})
+    return run
+
+
+@celery.task(bind=True, name='embed_document_task', **STAGE_RETRY_OPTIONS)
+def embed_document_task(self, run: dict):
+    """Stage 3/4: splits the document into chunks and embeds each one."""
+    if run is None:
+        return None
+    db: Database = self.db
+    with _stage(self, run, 'embed'):
+        if db.pipeline_checkpoints.load(run['doc_id'], run['run_id'], 'embed') is not None:
+            return run
+
+        logger.info(f"Step 3/4: Generating embeddings for document ID {run['doc_id']}.")
+        chunks = _chunks(_load_segments(db, run))
+        # Chunks of concurrently processed documents share micro-batches
+        chunk_embeddings = get_embedding_batcher().embed_documents([chunk.text for chunk in chunks])
+        db.pipeline_checkpoints.save(run['doc_id'], run['run_id'], 'embed', pack_embeddings(chunk_embeddings))
+    return run
+
+
+@celery.task(bind=True, name='persist_document_task', **STAGE_RETRY_OPTIONS)
+def persist_document_task(self, run: dict):
+    """Stage 4/4: saves the results of the earlier stages to the document and its chunks."""
+    if run is None:
+        return None
+    db: Database = self.db
+    doc_id = run['doc_id']
+    with _stage(self, run, 'persist'):
+        logger.info(f"Step 4/4: Saving all extracted data for document ID {doc_id}.")
+        segments = _load_segments(db, run)
+        classified = _load_checkpoint(db, run, 'classify')
+        chunks = _chunks(segments)
+        chunk_embeddings = unpack_embeddings(_load_checkpoint(db, run, 'embed'))
+        # The document-level vector is the mean of its chunk vectors
+        embedding = [sum(values) / len(chunk_embeddings) for values in zip(*chunk_embeddings)]
+
         db.update_document_status(
             doc_id=doc_id,
             status="Processed",
-            kvps=kvps,
-            category=category_name,
-            text=text,
+            kvps=classified['kvps'],
+            category=classified['category'],
+            text=join_segments(segments),
             embedding=embedding
         )
+        db.replace_document_chunks(doc_id, chunks, chunk_embeddings)
+        db.pipeline_checkpoints.clear(doc_id, run['run_id'])
+
+    logger.info(f"[TASK_SUCCESS] Successfully processed document ID: {doc_id}")
+    if run.get('lane') == BULK_LANE:
+        # Hands the freed slot to the next waiting bulk document right away
+        dispatch_bulk_documents_task.delay()
+    return {"status": "success", "doc_id": doc_id}
 
-        logger.info(f"[TASK_SUCCESS] Successfully processed document ID: {doc_id}")
+@celery.task(bind=True, name='reconcile_dashboard_statistics_task')
+def reconcile_dashboard_statistics_task(self):
+    """
+    Periodic task (scheduled by `celery beat`) that recomputes the materialized
+    dashboard statistics from the documents, repairing any counter drift.
+    """
+    drifted = self.db.reconcile_dashboard_statistics()
+    return {"status": "success", "drifted_categories": drifted}
 
-    except Exception as e:
-        logger.error(f"[TASK_FAILURE] An unexpected error occurred while processing document ID {doc_id}: {e}", exc_info=True)
-        db.update_document_status(doc_id, "Error", {}, None, "An unexpected error occurred during processing.", None)
-        raise
+@celery.task(bind=True, name='dispatch_bulk_documents_task')
+def dispatch_bulk_documents_task(self):
+    """
+    Feeds documents of bulk uploads into the bulk lane with per-batch fair sharing
+    (see `fair_share`): at most BULK_MAX_IN_FLIGHT bulk documents are in flight, at
+    most BULK_MAX_IN_FLIGHT_PER_BATCH of each batch, and free slots go to the batches
+    in turn. Runs on a `celery beat` schedule, after bulk uploads and whenever a bulk
+    document finishes. Documents dispatched more than BULK_DISPATCH_STALE_SECONDS ago
+    that are still queued no longer count as in flight and are dispatched again.
+    """
+    config = current_app.config
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=config['BULK_DISPATCH_STALE_SECONDS'])
+    waiting, in_flight = self.db.get_bulk_dispatch_state(stale_before)
+    shares = fair_share(waiting, in_flight, config['BULK_MAX_IN_FLIGHT'], config['BULK_MAX_IN_FLIGHT_PER_BATCH'])
 
-    return {"status": "success", "doc_id": doc_id}
+    dispatched = 0
+    for batch_id, count in shares.items():
+        for doc_id in self.db.claim_bulk_documents(batch_id, count, stale_before):
+            process_document_task.apply_async((doc_id,), {'lane': BULK_LANE}, priority=lane_priority(BULK_LANE))
+            dispatched += 1
+    metrics.increment('bulk_documents_dispatched_total', dispatched)
+    if dispatched:
+        logger.info(f"Dispatched {dispatched} bulk documents from {len(shares)} batches; "
+                    f"{sum(waiting.values()) - dispatched} still waiting.")
+    return {"status": "success", "dispatched": dispatched}
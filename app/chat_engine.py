@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR
+from langchain_core.output_parsers import StrOutputParser
+from app.ai_models import get_llm, get_embeddings
+from app.vector_store import get_vector_store
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+NO_ANSWER = "Sorry, I couldn't find an answer based on the provided documents."
+
+# Chunks retrieved for questions about all documents, and about a single document
+DEFAULT_K = 4
+DOCUMENT_K = 6
+
+# --- Global Chat Engine ---
+g_chat_engine = None
+g_chat_engine_key = None
+chat_engine_lock = threading.Lock()
+
+
+def get_chat_engine():
+    """
+    Returns the global ChatEngine, built on the first call and rebuilt only when the
+    models, vector store or cache size it was built with change.
+    """
+    global g_chat_engine, g_chat_engine_key
+    llm = get_llm()
+    embeddings = get_embeddings()
+    vector_store = get_vector_store(current_app.db, embeddings)
+    cache_size = current_app.config['CHAT_QUERY_EMBEDDING_CACHE_SIZE']
+    key = (id(llm), id(embeddings), id(vector_store), cache_size)
+    with chat_engine_lock:
+        if g_chat_engine is None or g_chat_engine_key != key:
+            logger.info("Building the chat engine...")
+            g_chat_engine = ChatEngine(llm, embeddings, vector_store, query_cache_size=cache_size)
+            g_chat_engine_key = key
+    return g_chat_engine
+
+
+class QueryEmbeddingCache:
+    """
+    A thread-safe LRU cache of query embeddings, keyed by the question with its
+    whitespace collapsed. `max_entries=0` disables it.
+    """
+    def __init__(self, embeddings, max_entries: int = 1024):
+        self._embeddings = embeddings
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_query(self, query: str):
+        key = ' '.join(query.split())
+        if self._max_entries > 0:
+            with self._lock:
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                    metrics.increment('chat_query_embedding_cache_hits_total')
+                    return embedding
+        metrics.increment('chat_query_embedding_cache_misses_total')
+        embedding = self._embeddings.embed_query(key)
+        if self._max_entries > 0:
+            with self._lock:
+                self._entries[key] = embedding
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return embedding
+
+
+class ChatEngine:
+    """
+    Answers chat questions over the document chunks, with the steps of LangChain's
+    ConversationalRetrievalChain ('stuff' chain type) built once instead of per request:
+
+        condense -> embed -> retrieve -> generate
+
+    The question is only condensed with the chat history when there is one, and query
+    embeddings of repeated questions come from a QueryEmbeddingCache. Every call
+    records the milliseconds spent in each stage in `timings`.
+    """
+    def __init__(self, llm, embeddings, vector_store, query_cache_size: int = 1024):
+        self._vector_store = vector_store
+        self._query_embeddings = QueryEmbeddingCache(embeddings, query_cache_size)
+        self._condense_chain = CONDENSE_QUESTION_PROMPT | llm | StrOutputParser()
+        self._qa_chain = PROMPT_SELECTOR.get_prompt(llm) | llm | StrOutputParser()
+
+    @staticmethod
+    def _record(stage: str, started: float, timings: dict):
+        timings[f'{stage}_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        metrics.observe(f'chat_{stage}_ms', timings[f'{stage}_ms'])
+
+    def condense(self, query: str, chat_history: list, timings: dict) -> str:
+        """Rewrites a follow-up question into a standalone one; without history it is returned as is."""
+        if not chat_history:
+            timings['condense_ms'] = 0.0
+            return query
+        started = time.perf_counter()
+        question = self._condense_chain.invoke({"question": query, "chat_history": _get_chat_history(chat_history)})
+        self._record('condense', started, timings)
+        return question
+
+    def retrieve(self, question: str, doc_id: str = None, timings: dict = None) -> list:
+        """Returns the chunks most similar to `question`, limited to `doc_id`'s if given."""
+        timings = {} if timings is None else timings
+        started = time.perf_counter()
+        embedding = self._query_embeddings.embed_query(question)
+        self._record('embed', started, timings)
+
+        started = time.perf_counter()
+        if doc_id:
+            logger.info(f"Chat query scoped to doc_id: {doc_id}")
+            # When querying a single doc, we can retrieve more chunks
+            documents = self._vector_store.similarity_search_by_vector(
+                embedding, k=DOCUMENT_K, filter={"doc_id": doc_id}
+            )
+        else:
+            documents = self._vector_store.similarity_search_by_vector(embedding, k=DEFAULT_K)
+        self._record('retrieve', started, timings)
+        return documents
+
+    def _qa_input(self, question: str, documents: list) -> dict:
+        return {"context": "\n\n".join(doc.page_content for doc in documents), "question": question}
+
+    def answer(self, query: str, doc_id: str = None, chat_history: list = None) -> dict:
+        """Returns {"answer", "source_documents", "timings"} for `query`."""
+        started = time.perf_counter()
+        timings = {}
+        question = self.condense(query, chat_history, timings)
+        documents = self.retrieve(question, doc_id, timings)
+
+        generate_started = time.perf_counter()
+        answer = self._qa_chain.invoke(self._qa_input(question, documents))
+        self._record('generate', generate_started, timings)
+        self._record('total', started, timings)
+        return {"answer": answer or NO_ANSWER, "source_documents": documents, "timings": timings}
+
+    def stream(self, query: str, doc_id: str = None, chat_history: list = None):
+        """
+        Like `answer`, but yields (event, data) pairs as it goes: ('retrieval', ...) once
+        the chunks are retrieved, ('token', ...) per generated piece of the answer, and
+        finally ('done', {"answer", "source_documents", "timings"}). Timings also include
+        the time to the first token (`ttft_ms`), overall and after retrieval.
+        """
+        started = time.perf_counter()
+        timings = {}
+        question = self.condense(query, chat_history, timings)
+        documents = self.retrieve(question, doc_id, timings)
+        retrieved = time.perf_counter()
+        yield 'retrieval', {"source_documents": documents, "timings": dict(timings)}
+
+        answer = []
+        for token in self._qa_chain.stream(self._qa_input(question, documents)):
+            if not token:
+                continue
+            if not answer:
+                first_token = time.perf_counter()
+                timings['ttft_ms'] = round((first_token - started) * 1000, 1)
+                timings['ttft_after_retrieval_ms'] = round((first_token - retrieved) * 1000, 1)
+                metrics.observe('chat_ttft_ms', timings['ttft_ms'])
+                metrics.observe('chat_ttft_after_retrieval_ms', timings['ttft_after_retrieval_ms'])
+            answer.append(token)
+            yield 'token', {"token": token}
+
+        self._record('generate', retrieved, timings)
+        self._record('total', started, timings)
+        yield 'done', {"answer": ''.join(answer) or NO_ANSWER, "source_documents": documents, "timings": timings}
@@ -0,0 +1,100 @@
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from pymongo import UpdateOne
+from app.utils.embedding_codec import STORAGE_FORMATS, encode_embedding, decode_embedding, embedding_format
+from app.utils.search_text import kvp_search_text
+
+embeddings_cli = AppGroup('embeddings', help="Manage how document and chunk embeddings are stored.")
+search_cli = AppGroup('search', help="Maintain the full-text search index.")
+
+EMBEDDING_COLLECTIONS = ('documents', 'document_chunks')
+
+
+def _print_storage_report(db):
+    """Prints collection sizes and the latency of the two queries that read embeddings in bulk."""
+    click.echo(f"{'collection':<16} {'count':>9} {'data MB':>9} {'storage MB':>11} {'avg obj B':>10}")
+    for name in EMBEDDING_COLLECTIONS:
+        stats = db.db.command('collStats', name)
+        click.echo(
+            f"{name:<16} {stats.get('count', 0):>9} {stats.get('size', 0) / 2**20:>9.1f} "
+            f"{stats.get('storageSize', 0) / 2**20:>11.1f} {stats.get('avgObjSize', 0):>10.0f}"
+        )
+
+    started = time.perf_counter()
+    listed = len(list(db.documents.find({'deleted_at': {'$exists': False}})))
+    listing_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    scanned = len(list(db.document_chunks.find({'deleted_at': {'$exists': False}}, {'embedding': 1})))
+    scan_ms = (time.perf_counter() - started) * 1000
+    click.echo(f"Full document listing: {listed} documents in {listing_ms:.0f} ms")
+    click.echo(f"Chunk embedding scan:  {scanned} chunks in {scan_ms:.0f} ms")
+
+
+@embeddings_cli.command('report')
+def report():
+    """Shows collection sizes and bulk read latency."""
+    _print_storage_report(current_app.db)
+
+
+@embeddings_cli.command('migrate')
+@click.option('--format', 'storage_format', type=click.Choice(STORAGE_FORMATS), default=None,
+              help="Target format. Defaults to EMBEDDING_STORAGE_FORMAT.")
+@click.option('--batch-size', default=500, show_default=True, help="Number of updates per bulk write.")
+def migrate(storage_format, batch_size):
+    """Re-encodes all stored embeddings into the target storage format."""
+    db = current_app.db
+    storage_format = storage_format or current_app.config['EMBEDDING_STORAGE_FORMAT']
+
+    click.echo("Before:")
+    _print_storage_report(db)
+
+    for name in EMBEDDING_COLLECTIONS:
+        collection = db.db[name]
+        converted = 0
+        operations = []
+        for record in collection.find({'embedding': {'$ne': None}}, {'embedding': 1}).batch_size(batch_size):
+            if embedding_format(record['embedding']) == storage_format:
+                continue
+            encoded = encode_embedding(decode_embedding(record['embedding']), storage_format)
+            operations.append(UpdateOne({'_id': record['_id']}, {'$set': {'embedding': encoded}}))
+            if len(operations) == batch_size:
+                collection.bulk_write(operations, ordered=False)
+                converted += len(operations)
+                operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+            converted += len(operations)
+        click.echo(f"Converted {converted} embeddings in '{name}' to {storage_format}.")
+
+    click.echo("After (run `compact` on the collections to return freed disk space):")
+    _print_storage_report(db)
+
+
+@search_cli.command('backfill')
+@click.option('--batch-size', default=500, show_default=True, help="Number of updates per bulk write.")
+def backfill(batch_size):
+    """Fills in search fields missing from documents and chunks processed before they existed."""
+    documents = current_app.db.documents
+    updated = 0
+    operations = []
+    for doc in documents.find({'kvp_text': {'$exists': False}}, {'kvps': 1}).batch_size(batch_size):
+        operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {'kvp_text': kvp_search_text(doc.get('kvps'))}}))
+        if len(operations) == batch_size:
+            documents.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        documents.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    click.echo(f"Backfilled searchable KVP text for {updated} documents.")
+
+    # Chunks written before search filters existed lack their document's creation time
+    chunks = current_app.db.document_chunks
+    updated = 0
+    for doc_id in chunks.distinct('doc_id', {'created_at': {'$exists': False}}):
+        doc = documents.find_one({'_id': doc_id}, {'created_at': 1})
+        if doc:
+            updated += chunks.update_many({'doc_id': doc_id}, {'$set': {'created_at': doc.get('created_at')}}).modified_count
+    click.echo(f"Backfilled the document creation time of {updated} chunks.")
@@ -0,0 +1,170 @@
+"""
+Materialized dashboard statistics.
+
+Instead of aggregating every document on each dashboard request, the
+`dashboard_stats` collection keeps one counter record per category:
+
+    {
+        "category": "Invoices",            # None for uncategorized documents
+        "document_count": 120,
+        "status_counts": {"Processed": 100, "Validated": 15, "Processing": 5},
+        "processing_time_count": 115,      # documents with a processing time
+        "processing_time_ms_sum": 5230000
+    }
+
+Every write that changes a document's status, category, processing time or
+deleted state computes the counter delta from the document before and after
+the write, and `$inc`s it into the affected records. Soft-deleted documents do
+not count. A periodic reconciliation recomputes the records from scratch to
+repair any drift (e.g. a process dying between a write and its `$inc`), and
+`$inc`s the difference into the drifted records only.
+"""
+import datetime
+
+# Fields a document's contribution to the statistics depends on
+STATS_FIELDS = {'status': 1, 'category': 1, 'created_at': 1, 'processed_at': 1, 'deleted_at': 1}
+
+PROCESSED_STATUSES = ('Processed', 'Validated', 'Re-categorized')
+ACCURATE_STATUSES = ('Processed', 'Validated')
+IN_PROGRESS_STATUSES = ('Queued for Processing', 'Processing')
+
+# Recomputed processing time sums may differ from the incremented ones by float rounding
+PROCESSING_TIME_TOLERANCE_MS = 1.0
+
+
+def apply_update(doc: dict, update: dict) -> dict:
+    """Returns a copy of `doc` with the `$set` and `$unset` parts of an update applied."""
+    result = dict(doc)
+    for path, value in update.get('$set', {}).items():
+        field, _, key = path.partition('.')
+        if key:
+            result[field] = {**(result.get(field) or {}), key: value}
+        else:
+            result[field] = value
+    for path in update.get('$unset', {}):
+        field, _, key = path.partition('.')
+        if key:
+            result[field] = {k: v for k, v in (result.get(field) or {}).items() if k != key}
+        else:
+            result.pop(field, None)
+    return result
+
+
+def _stored_precision(value: datetime.datetime) -> datetime.datetime:
+    """Truncates a datetime to the milliseconds MongoDB stores, so in-memory and stored dates agree."""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _contribution(doc: dict):
+    """Returns the (category, counters) a document adds to the statistics, or None if it does not count."""
+    if doc is None or doc.get('deleted_at') is not None:
+        return None
+    counters = {'document_count': 1, f"status_counts.{doc.get('status')}": 1}
+    created_at, processed_at = doc.get('created_at'), doc.get('processed_at')
+    if isinstance(created_at, datetime.datetime) and isinstance(processed_at, datetime.datetime):
+        counters['processing_time_count'] = 1
+        processing_time = _stored_precision(processed_at) - _stored_precision(created_at)
+        counters['processing_time_ms_sum'] = processing_time // datetime.timedelta(milliseconds=1)
+    return doc.get('category'), counters
+
+
+def stats_delta(before, after) -> dict:
+    """
+    Returns {category: {counter_path: increment}} to turn the statistics of
+    `before` into those of `after`; either may be None (created / removed).
+    Counters that do not change are left out.
+    """
+    delta = {}
+    for sign, doc in ((-1, before), (1, after)):
+        contribution = _contribution(doc)
+        if contribution is None:
+            continue
+        category, counters = contribution
+        bucket = delta.setdefault(category, {})
+        for path, value in counters.items():
+            bucket[path] = bucket.get(path, 0) + sign * value
+    return {
+        category: {path: value for path, value in counters.items() if value}
+        for category, counters in delta.items()
+        if any(counters.values())
+    }
+
+
+def _counter_paths(record) -> dict:
+    """Flattens a counter record into {counter_path: value}."""
+    if not record:
+        return {}
+    counters = {f"status_counts.{status}": count for status, count in record.get('status_counts', {}).items()}
+    for path in ('document_count', 'processing_time_count', 'processing_time_ms_sum'):
+        if path in record:
+            counters[path] = record[path]
+    return counters
+
+
+def reconciliation(expected, actual):
+    """
+    Compares a recomputed counter record (`expected`, None if the category has no
+    documents) with the stored one (`actual`). Returns (guard, increments): the `$inc`
+    that turns `actual` into `expected` (empty if nothing drifted), and a filter on the
+    counters `actual` was read with, so the correction only applies if no other write
+    has changed them since.
+    """
+    expected_counters, actual_counters = _counter_paths(expected), _counter_paths(actual)
+    paths = set(expected_counters) | set(actual_counters)
+    increments = {}
+    for path in paths:
+        difference = expected_counters.get(path, 0) - actual_counters.get(path, 0)
+        tolerance = PROCESSING_TIME_TOLERANCE_MS if path == 'processing_time_ms_sum' else 0
+        if abs(difference) > tolerance:
+            increments[path] = difference
+    return {path: actual_counters.get(path) for path in paths}, increments
+
+
+def build_dashboard(records: list) -> dict:
+    """Builds the `/dashboard/stats` response from the per-category counter records."""
+    total_docs = processed_count = auto_classified_count = 0
+    processing_time_count = processing_time_ms_sum = 0
+    document_pools = []
+    unknown_count = 0
+
+    for record in records:
+        count = record.get('document_count', 0)
+        if count <= 0:
+            continue
+        statuses = record.get('status_counts', {})
+        total_docs += count
+        processed_count += sum(statuses.get(status, 0) for status in PROCESSED_STATUSES)
+        auto_classified_count += statuses.get('Processed', 0)
+        processing_time_count += record.get('processing_time_count', 0)
+        processing_time_ms_sum += record.get('processing_time_ms_sum', 0)
+
+        if record.get('category') is None:
+            unknown_count = count
+            continue
+        in_progress = sum(statuses.get(status, 0) for status in IN_PROGRESS_STATUSES)
+        document_pools.append({
+            'pool_name': record['category'],
+            'document_count': count,
+            'status': 'processing' if in_progress > 0 else 'active',
+            'accuracy': sum(statuses.get(status, 0) for status in ACCURATE_STATUSES) / count * 100
+        })
+
+    processing_accuracy = (processed_count / total_docs * 100) if total_docs > 0 else 0
+    auto_classified_accuracy = (auto_classified_count / processed_count * 100) if processed_count > 0 else 0
+    avg_processing_time = (processing_time_ms_sum / processing_time_count / 1000) if processing_time_count else None
+
+    dashboard_data = {
+        'total_documents': total_docs,
+        'processing_accuracy': round(processing_accuracy, 2),
+        'avg_processing_time': round(avg_processing_time, 2) if avg_processing_time is not None else None,
+        'auto_classified_accuracy': round(auto_classified_accuracy, 2),
+        'document_pools': sorted(document_pools, key=lambda pool: pool['pool_name'])
+    }
+    if unknown_count:
+        dashboard_data['document_pools'].append({
+            'pool_name': 'Unknown',
+            'document_count': unknown_count,
+            'status': 'pending',
+            'accuracy': 0
+        })
+    return dashboard_data
@@ -1,17 +1,48 @@
-import re
+import bson
 import gridfs
+import hashlib
 import datetime
 import logging
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.operations import SearchIndexModel
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 from werkzeug.utils import secure_filename
 from abc import ABC, abstractmethod
+from typing import NamedTuple
 from .auditing import add_audit_log
+from .utils.embedding_codec import encode_embedding, decode_embedding
+from .utils.search_text import kvp_search_text, make_snippet
+from .dashboard_stats import (
+    STATS_FIELDS, PROCESSED_STATUSES, apply_update, stats_delta, build_dashboard, reconciliation
+)
+from .cache import TwoTierCache
+from .llm_cache import LLMResponseCache
+from .pipeline_checkpoints import PipelineCheckpoints
+from .metrics import metrics
 
 # Global variable to hold the database instance
 db_client = None
 logger = logging.getLogger(__name__)
 
+# Uploads are copied into GridFS in pieces of one GridFS chunk
+STREAM_CHUNK_SIZE = gridfs.DEFAULT_CHUNK_SIZE
+
+# In bulk uploads, files up to BULK_INLINE_FILE_SIZE bytes are buffered and their GridFS
+# records written with insert_many once BULK_WRITE_BYTES are pending; larger files are streamed
+BULK_INLINE_FILE_SIZE = 4 * 1024 * 1024
+BULK_WRITE_BYTES = 16 * 1024 * 1024
+
+# MongoDB's error code for a unique index violation
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+class StoredFile(NamedTuple):
+    """Where an upload's content was stored; `deduplicated` is True if identical bytes were already stored."""
+    file_id: str
+    sha256: str
+    deduplicated: bool
+
 
 def _format_document(doc):
     """Helper to format document fields for JSON serialization."""
@@ -22,8 +53,81 @@ def _format_document(doc):
         doc['created_at'] = doc['created_at'].isoformat()
     if 'processed_at' in doc and isinstance(doc['processed_at'], datetime.datetime):
         doc['processed_at'] = doc['processed_at'].isoformat()
+    if isinstance(doc.get('embedding'), bytes):
+        # Packed float16/int8 embeddings are returned as plain lists
+        doc['embedding'] = decode_embedding(doc['embedding']).tolist()
     return doc
 
+# Fields left out of document listings unless explicitly requested
+LIST_EXCLUDED_FIELDS = {'text': 0, 'embedding': 0, 'kvp_text': 0}
+
+# Top-level fields that may be requested from document listings (`fields`)
+LISTABLE_FIELDS = frozenset({
+    '_id', 'filename', 'content_type', 'file_id', 'content_sha256', 'status', 'created_at',
+    'processed_at', 'kvps', 'category', 'categorization_explanation', 'batch_id',
+    'processing_lane', 'dispatched_at', 'deleted_at', 'vectors_updated_at'
+})
+
+# Cache keys of single documents and of the category list
+CATEGORIES_CACHE_KEY = 'categories'
+
+
+def _document_cache_key(doc_id):
+    return f"document:{doc_id}"
+
+
+# Fields the interactive KVP edits change
+KVP_FIELDS = {'kvps': 1, 'kvp_text': 1}
+
+
+def _changed(before, after, fields):
+    """True if a tracked update matched a document and changed any of `fields` (or the status)."""
+    if before is None:
+        return False
+    return any(before.get(field) != after.get(field) for field in [*fields, 'status'])
+
+
+def _search_filter(filters):
+    """
+    Translates search filters (`category`, `status`, `created_from`, `created_to`)
+    into a query on the documents collection. Soft-deleted documents are excluded.
+    """
+    query = {'deleted_at': {'$exists': False}}
+    filters = filters or {}
+    if filters.get('category'):
+        query['category'] = None if filters['category'] == 'Uncategorized' else filters['category']
+    if filters.get('status'):
+        query['status'] = filters['status']
+    created_range = {}
+    if filters.get('created_from'):
+        created_range['$gte'] = filters['created_from']
+    if filters.get('created_to'):
+        created_range['$lt'] = filters['created_to']
+    if created_range:
+        query['created_at'] = created_range
+    return query
+
+
+def _undispatched_since(stale_before):
+    """Matches bulk documents not dispatched since `stale_before` (never, or longer ago)."""
+    return {'$or': [{'dispatched_at': {'$exists': False}}, {'dispatched_at': {'$lt': stale_before}}]}
+
+
+def _encode_cursor(doc):
+    """Encodes the (created_at, _id) sort key of the last listed document as an opaque cursor."""
+    created_ms = int(doc['created_at'].replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    return f"{created_ms}_{doc['_id']}"
+
+
+def _decode_cursor(cursor):
+    try:
+        created_ms, last_id = cursor.split('_', 1)
+        created_at = datetime.datetime.fromtimestamp(int(created_ms) / 1000, tz=datetime.timezone.utc).replace(tzinfo=None)
+        return created_at, ObjectId(last_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor '{cursor}'.") from e
+
+
 class Database(ABC):
     """
     Abstract base class (Interface) for all database operations.
@@ -33,6 +137,10 @@ class Database(ABC):
     def save_file(self, file_storage):
         pass
 
+    @abstractmethod
+    def save_files(self, file_storages):
+        pass
+
     @abstractmethod
     def get_file_content(self, file_id):
         pass
@@ -45,22 +153,42 @@ class Database(ABC):
     def create_document(self, doc_data):
         pass
 
+    @abstractmethod
+    def create_documents(self, docs_data):
+        pass
+
     @abstractmethod
     def get_document(self, doc_id):
         pass
 
     @abstractmethod
-    def get_documents(self, category=None, include_deleted=False):
+    def get_documents(self, category=None, include_deleted=False, limit=50, after=None, fields=None):
+        pass
+
+    @abstractmethod
+    def search_documents(self, query, limit=20, offset=0, filters=None):
         pass
 
     @abstractmethod
-    def search_documents(self, query):
+    def get_documents_by_ids(self, doc_ids, filters=None):
         pass
 
     @abstractmethod
     def update_document_status(self, doc_id, status, kvps, category, text, embedding):
         pass
 
+    @abstractmethod
+    def replace_document_chunks(self, doc_id, chunks, embeddings):
+        pass
+
+    @abstractmethod
+    def find_processed_duplicate(self, doc_id, content_sha256):
+        pass
+
+    @abstractmethod
+    def reuse_processing_result(self, doc_id, source_id):
+        pass
+
     @abstractmethod
     def update_document_kvp(self, doc_id, new_kvps):
         pass
@@ -81,10 +209,22 @@ class Database(ABC):
     def update_document_for_reprocessing(self, doc_id):
         pass
 
+    @abstractmethod
+    def get_bulk_dispatch_state(self, stale_before):
+        pass
+
+    @abstractmethod
+    def claim_bulk_documents(self, batch_id, count, stale_before):
+        pass
+
     @abstractmethod
     def get_dashboard_statistics(self):
         pass
 
+    @abstractmethod
+    def reconcile_dashboard_statistics(self):
+        pass
+
     @abstractmethod
     def soft_delete_document(self, doc_id):
         pass
@@ -92,6 +232,18 @@ class Database(ABC):
     @abstractmethod
     def restore_document(self, doc_id):
         pass
+
+    @abstractmethod
+    def purge_document(self, doc_id):
+        pass
+
+    @abstractmethod
+    def release_files(self, file_ids):
+        pass
+
+    @abstractmethod
+    def release_file(self, file_id):
+        pass
         
     @abstractmethod
     def get_all_categories(self):
@@ -122,21 +274,257 @@ class MongoDatabase(Database):
     """
     MongoDB implementation of the Database interface.
     """
-    def __init__(self, mongo_uri, vector_dimensions):
+    def __init__(self, mongo_uri, vector_dimensions, embedding_format='float32', cache=None, llm_cache_ttl=30 * 24 * 3600,
+                 llm_cache_max_entries=100_000, checkpoint_ttl=7 * 24 * 3600, search_max_results=1000,
+                 search_max_time_ms=0):
         self.client = MongoClient(mongo_uri)
         self.db = self.client.get_default_database()
         self.fs = gridfs.GridFS(self.db)
         self.documents = self.db.documents
+        self.document_chunks = self.db.document_chunks
         self.fine_tuning_data = self.db.fine_tuning_data
         self.audit_log = self.db.audit_log
         self.categories = self.db.categories
         self.kvp_corrections = self.db.kvp_corrections
+        self.dashboard_stats = self.db.dashboard_stats
         self.vector_dimensions = vector_dimensions
+        self.embedding_format = embedding_format
+        # Read-through cache of single documents and the category list (disabled by default)
+        self.cache = cache or TwoTierCache(max_entries=0)
+        # Persistent cache of LLM extraction results, shared by all workers
+        self.llm_cache = LLMResponseCache(self.db.llm_cache, ttl_seconds=llm_cache_ttl, max_entries=llm_cache_max_entries)
+        # Outputs of the processing stages, so retried stages resume where they failed
+        self.pipeline_checkpoints = PipelineCheckpoints(self.db.pipeline_checkpoints, ttl_seconds=checkpoint_ttl)
+        # Deepest result a search pages to, and the most time its query may take (0: unlimited)
+        self.search_max_results = search_max_results
+        self.search_max_time_ms = search_max_time_ms
 
     def save_file(self, file_storage):
+        """
+        Streams an uploaded file into GridFS one chunk at a time, so the upload
+        is never held in memory as a whole, regardless of its size.
+
+        The content is SHA-256 hashed on the way; if identical bytes are already
+        stored, the new copy is dropped and the existing GridFS file is shared.
+        Returns a StoredFile.
+        """
+        return self._stream_to_gridfs(file_storage)
+
+    def _claim_file(self, sha256):
+        """Adds a reference to the stored file with this content hash; returns its id, or None if there is none."""
+        # A file without references is being deleted (release_file) and must not be revived
+        existing = self.db['fs.files'].find_one_and_update(
+            {'sha256': sha256, 'ref_count': {'$gt': 0}},
+            {'$inc': {'ref_count': 1}},
+            projection={'_id': 1, 'length': 1}
+        )
+        if existing is None:
+            return None
+        metrics.increment('upload_dedup_hits_total')
+        metrics.increment('upload_dedup_bytes_saved_total', existing.get('length', 0))
+        return str(existing['_id'])
+
+    def _stream_to_gridfs(self, file_storage, head=b''):
+        """Writes `head` followed by the rest of the file's stream into GridFS, deduplicating by content hash."""
         filename = secure_filename(file_storage.filename)
-        file_id = self.fs.put(file_storage.read(), filename=filename, content_type=file_storage.content_type)
-        return str(file_id)
+        digest = hashlib.sha256(head)
+        grid_in = self.fs.new_file(filename=filename, content_type=file_storage.content_type, ref_count=1)
+        try:
+            grid_in.write(head)
+            while True:
+                chunk = file_storage.stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                grid_in.write(chunk)
+            sha256 = digest.hexdigest()
+            existing_id = self._claim_file(sha256)
+            if existing_id:
+                grid_in.abort()
+                return StoredFile(existing_id, sha256, True)
+            grid_in.sha256 = sha256
+            grid_in.close()
+        except gridfs.errors.FileExists:
+            # A concurrent upload of the same bytes was stored first (unique sha256 index)
+            grid_in.abort()
+            existing_id = self._claim_file(sha256)
+            if existing_id is None:
+                # ...and released again since
+                raise
+            return StoredFile(existing_id, sha256, True)
+        except Exception:
+            grid_in.abort()
+            raise
+        return StoredFile(str(grid_in._id), sha256, False)
+
+    def save_files(self, file_storages):
+        """
+        Stores several uploaded files in GridFS and returns a StoredFile for each, in order.
+
+        Instead of two or more round trips per file, the GridFS chunk and file records
+        of small files are buffered and written with one insert_many each per
+        BULK_WRITE_BYTES. Files larger than BULK_INLINE_FILE_SIZE are streamed as usual.
+        Like save_file, identical contents (within the batch or already stored) share
+        one GridFS file.
+
+        If storing fails, or `file_storages` raises (e.g. a broken archive), every file
+        and reference stored so far is released again before the error is re-raised.
+        """
+        stored = []
+        written = []  # indexes into stored whose file or reference is in GridFS
+        pending = {}  # sha256 -> {'file': fs.files record, 'chunks': [...], 'slots': [indexes into stored]}
+        pending_bytes = 0
+
+        def flush():
+            files_collection = self.db['fs.files']
+            existing = {
+                record['sha256']: record
+                for record in files_collection.find(
+                    {'sha256': {'$in': list(pending)}, 'ref_count': {'$gt': 0}}, {'sha256': 1, 'length': 1}
+                )
+            }
+            new_entries = []
+            for sha256, entry in pending.items():
+                if sha256 in existing and self._reference_existing(entry['slots'], stored, existing[sha256]):
+                    written.extend(entry['slots'])
+                else:
+                    new_entries.append(entry)
+            pending.clear()
+            if not new_entries:
+                return
+            # Chunks go first, so a file record never points at missing data
+            try:
+                self.db['fs.chunks'].insert_many([chunk for entry in new_entries for chunk in entry['chunks']], ordered=False)
+            except Exception:
+                self.db['fs.chunks'].delete_many({'files_id': {'$in': [entry['file']['_id'] for entry in new_entries]}})
+                raise
+            try:
+                files_collection.insert_many([entry['file'] for entry in new_entries], ordered=False)
+            except BulkWriteError as e:
+                unresolved = False
+                failed = set()
+                for error in e.details.get('writeErrors', []):
+                    entry = new_entries[error['index']]
+                    failed.add(error['index'])
+                    self.db['fs.chunks'].delete_many({'files_id': entry['file']['_id']})
+                    if error.get('code') != DUPLICATE_KEY_ERROR_CODE:
+                        unresolved = True
+                        continue
+                    # A concurrent upload stored the same content first
+                    record = files_collection.find_one(
+                        {'sha256': entry['file']['sha256'], 'ref_count': {'$gt': 0}}, {'length': 1}
+                    )
+                    if record is None or not self._reference_existing(entry['slots'], stored, record):
+                        unresolved = True
+                    else:
+                        written.extend(entry['slots'])
+                for index, entry in enumerate(new_entries):
+                    if index not in failed:
+                        written.extend(entry['slots'])
+                if unresolved:
+                    raise
+                return
+            for entry in new_entries:
+                written.extend(entry['slots'])
+
+        try:
+            for file_storage in file_storages:
+                head = file_storage.stream.read(BULK_INLINE_FILE_SIZE + 1)
+                if len(head) > BULK_INLINE_FILE_SIZE:
+                    stored.append(self._stream_to_gridfs(file_storage, head))
+                    written.append(len(stored) - 1)
+                    continue
+
+                sha256 = hashlib.sha256(head).hexdigest()
+                entry = pending.get(sha256)
+                if entry is not None:
+                    # Same content earlier in this batch
+                    entry['file']['ref_count'] += 1
+                    entry['slots'].append(len(stored))
+                    stored.append(StoredFile(str(entry['file']['_id']), sha256, True))
+                    metrics.increment('upload_dedup_hits_total')
+                    metrics.increment('upload_dedup_bytes_saved_total', len(head))
+                    continue
+
+                file_id = ObjectId()
+                pending[sha256] = {
+                    'file': {
+                        '_id': file_id,
+                        'filename': secure_filename(file_storage.filename),
+                        'contentType': file_storage.content_type,
+                        'chunkSize': STREAM_CHUNK_SIZE,
+                        'length': len(head),
+                        'uploadDate': datetime.datetime.utcnow(),
+                        'sha256': sha256,
+                        'ref_count': 1
+                    },
+                    'chunks': [
+                        {'files_id': file_id, 'n': n, 'data': bson.Binary(head[start:start + STREAM_CHUNK_SIZE])}
+                        for n, start in enumerate(range(0, len(head), STREAM_CHUNK_SIZE))
+                    ],
+                    'slots': [len(stored)]
+                }
+                stored.append(StoredFile(str(file_id), sha256, False))
+                pending_bytes += len(head)
+                if pending_bytes >= BULK_WRITE_BYTES:
+                    flush()
+                    pending_bytes = 0
+            if pending:
+                flush()
+        except Exception:
+            self.release_files([stored[slot].file_id for slot in written])
+            raise
+        return stored
+
+    def _reference_existing(self, slots, stored, record):
+        """
+        Points the given StoredFile slots at an already stored file and adds their references
+        to it. Returns False, changing nothing, if the file has lost its last reference since.
+        """
+        result = self.db['fs.files'].update_one(
+            {'_id': record['_id'], 'ref_count': {'$gt': 0}}, {'$inc': {'ref_count': len(slots)}}
+        )
+        if not result.matched_count:
+            return False
+        metrics.increment('upload_dedup_hits_total', len(slots))
+        metrics.increment('upload_dedup_bytes_saved_total', len(slots) * record.get('length', 0))
+        for slot in slots:
+            stored[slot] = StoredFile(str(record['_id']), stored[slot].sha256, True)
+        return True
+
+    def release_files(self, file_ids):
+        """
+        Releases one reference per id in `file_ids` (see release_file), e.g. to undo a
+        partly stored upload. Failures are logged, so the caller's own error is not masked.
+        """
+        for file_id in file_ids:
+            try:
+                self.release_file(file_id)
+            except Exception as e:
+                logger.error(f"Could not release stored file {file_id}: {e}", exc_info=True)
+
+    def release_file(self, file_id):
+        """
+        Drops one reference to a stored file, and deletes the file once nothing references it.
+
+        The last reference is dropped by deleting the file record in one conditional
+        operation, so a concurrent upload of the same content either adds its reference
+        first (and the file stays) or finds no file and stores its own copy.
+        """
+        files_collection = self.db['fs.files']
+        file_id = ObjectId(file_id)
+        while True:
+            # Files stored before reference counting have no ref_count and belong to a single document
+            orphan = files_collection.find_one_and_delete(
+                {'_id': file_id, '$or': [{'ref_count': {'$lte': 1}}, {'ref_count': {'$exists': False}}]},
+                projection={'_id': 1}
+            )
+            if orphan:
+                self.db['fs.chunks'].delete_many({'files_id': file_id})
+                return
+            result = files_collection.update_one({'_id': file_id, 'ref_count': {'$gt': 1}}, {'$inc': {'ref_count': -1}})
+            if result.matched_count or not files_collection.count_documents({'_id': file_id}, limit=1):
+                return
 
     def get_file_content(self, file_id):
         try:
@@ -146,26 +534,109 @@ class MongoDatabase(Database):
             return None
             
     def get_file_with_metadata(self, file_id):
-        """Retrieves a file and its metadata from GridFS."""
+        """
+        Opens a file in GridFS for streaming and returns it with its metadata.
+        The 'stream' is a seekable GridOut; callers read it in chunks and must close it.
+        """
         try:
             grid_out = self.fs.get(ObjectId(file_id))
             return {
-                "content": grid_out.read(),
+                "stream": grid_out,
+                "length": grid_out.length,
                 "filename": grid_out.filename,
                 "content_type": grid_out.content_type
             }
         except gridfs.errors.NoFile:
             return None
 
+    def _apply_stats_delta(self, delta):
+        """Adds a `stats_delta` to the per-category counter records."""
+        for category, increments in delta.items():
+            try:
+                self.dashboard_stats.update_one({'category': category}, {'$inc': increments}, upsert=True)
+            except DuplicateKeyError:
+                # Another process created the record first; it now exists
+                self.dashboard_stats.update_one({'category': category}, {'$inc': increments})
+
+    def _update_document_tracked(self, query, update, full_document=False):
+        """
+        Applies `update` to the document matching `query` in one round trip, records
+        the resulting change in the dashboard statistics and invalidates the cached
+        document. Returns the (before, after) states of the document, or (None, None)
+        if nothing matched; unless `full_document` is set, only STATS_FIELDS are read.
+
+        The statistics need the state before the update, so the document is read with
+        ReturnDocument.BEFORE and the state after it is derived locally.
+        """
+        before = self.documents.find_one_and_update(
+            query,
+            update,
+            projection=None if full_document else STATS_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return None, None
+        self.cache.delete(_document_cache_key(before['_id']))
+        after = apply_update(before, update)
+        self._apply_stats_delta(stats_delta(before, after))
+        return before, after
+
     def create_document(self, doc_data):
         result = self.documents.insert_one(doc_data)
+        self._apply_stats_delta(stats_delta(None, doc_data))
+        # The upload response reads the new document straight back
+        self.cache.set(_document_cache_key(result.inserted_id), bson.encode(doc_data))
         return str(result.inserted_id)
 
+    def create_documents(self, docs_data):
+        """
+        Inserts several new documents with one insert_many and returns their ids, in order.
+        If the insert fails, the documents inserted before the error are removed again.
+        """
+        if not docs_data:
+            return []
+        try:
+            result = self.documents.insert_many(docs_data)
+        except Exception:
+            # insert_many has set the _id of every document it was given
+            self.documents.delete_many({'_id': {'$in': [doc['_id'] for doc in docs_data if '_id' in doc]}})
+            raise
+        delta = {}
+        for doc_data in docs_data:
+            for category, increments in stats_delta(None, doc_data).items():
+                bucket = delta.setdefault(category, {})
+                for path, value in increments.items():
+                    bucket[path] = bucket.get(path, 0) + value
+        self._apply_stats_delta(delta)
+        return [str(inserted_id) for inserted_id in result.inserted_ids]
+
     def get_document(self, doc_id):
+        """Returns a single document, served from the cache when possible."""
+        key = _document_cache_key(doc_id)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return _format_document(bson.decode(cached))
+        generation = self.cache.generation(key)
         doc = self.documents.find_one({'_id': ObjectId(doc_id)})
+        if doc:
+            self.cache.set(key, bson.encode(doc), generation=generation)
         return _format_document(doc)
 
-    def get_documents(self, category=None, include_deleted=False):
+    def get_documents(self, category=None, include_deleted=False, limit=50, after=None, fields=None):
+        """
+        Returns one page of documents, newest first, as
+        {"documents": [...], "next_cursor": <cursor or None>}.
+
+        Pages are keyset-paginated on (created_at, _id): pass the previous page's
+        `next_cursor` as `after`. `fields` names the fields to return; by default
+        every field except the bulky `text` and `embedding` is returned, and only
+        LISTABLE_FIELDS may be named.
+        Raises ValueError for a malformed cursor or an unknown field.
+        """
+        unknown = sorted(set(fields or ()) - LISTABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
         query = {}
         if not include_deleted:
             query['deleted_at'] = {'$exists': False}
@@ -178,66 +649,243 @@ class MongoDatabase(Database):
             else:
                 query['category'] = category
 
-        docs = self.documents.find(query)
-        return [_format_document(doc) for doc in docs]
+        if after:
+            created_at, last_id = _decode_cursor(after)
+            query['$or'] = [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': last_id}}
+            ]
+
+        if fields:
+            # created_at is always needed to build the next cursor
+            projection = {field: 1 for field in fields}
+            projection['created_at'] = 1
+        else:
+            projection = dict(LIST_EXCLUDED_FIELDS)
 
-    def search_documents(self, query):
-        regex = re.compile(f'.*{re.escape(query)}.*', re.IGNORECASE)
-        search_query = {
-            'filename': regex,
-            'deleted_at': {'$exists': False}
-        }
-        
-        docs = self.documents.find(search_query)
-        return [_format_document(doc) for doc in docs]
+        docs = list(
+            self.documents.find(query, projection)
+            .sort([('created_at', -1), ('_id', -1)])
+            .limit(limit)
+        )
+        next_cursor = _encode_cursor(docs[-1]) if len(docs) == limit else None
+        return {"documents": [_format_document(doc) for doc in docs], "next_cursor": next_cursor}
+
+    def search_documents(self, query, limit=20, offset=0, filters=None):
+        """
+        Full-text search over filename, extracted text and KVP values using the
+        documents' text index, ranked by relevance (filename and KVP matches weigh more).
+        `filters` restricts the results (see `_search_filter`).
+
+        Returns {"documents": [...], "next_offset": <offset or None>}; each document
+        carries its relevance `score`, a `snippet` of the best matching passage and
+        the `highlights` ([start, end) offsets of matched terms within the snippet).
+
+        MongoDB scores every match of a query before sorting, so the results are bounded:
+        only the first `search_max_results` can be paged to (a page past them is empty),
+        and with `search_max_time_ms` a query running longer raises ExecutionTimeout.
+        """
+        limit = min(limit, self.search_max_results - offset)
+        if limit <= 0:
+            return {"documents": [], "next_offset": None}
+        search_query = {'$text': {'$search': query}, **_search_filter(filters)}
+        projection = {**LIST_EXCLUDED_FIELDS, 'score': {'$meta': 'textScore'}}
+        cursor = (
+            self.documents.find(search_query, projection)
+            .sort([('score', {'$meta': 'textScore'})])
+            .skip(offset)
+            .limit(limit)
+        )
+        if self.search_max_time_ms:
+            cursor = cursor.max_time_ms(self.search_max_time_ms)
+        docs = list(cursor)
+
+        # Snippets come from the best matching chunk of each hit, so the (possibly huge)
+        # full document text never has to be read
+        best_chunks = {}
+        if docs:
+            chunks = self.document_chunks.find(
+                {'$text': {'$search': query}, 'doc_id': {'$in': [doc['_id'] for doc in docs]}},
+                {'doc_id': 1, 'text': 1, 'score': {'$meta': 'textScore'}}
+            ).sort([('score', {'$meta': 'textScore'})])
+            for chunk in chunks:
+                best_chunks.setdefault(chunk['doc_id'], chunk['text'])
+
+        results = []
+        for doc in docs:
+            snippet_source = best_chunks.get(doc['_id']) or kvp_search_text(doc.get('kvps')) or doc.get('filename')
+            doc['snippet'], doc['highlights'] = make_snippet(snippet_source, query)
+            results.append(_format_document(doc))
+
+        next_offset = offset + limit if len(docs) == limit and offset + limit < self.search_max_results else None
+        return {"documents": results, "next_offset": next_offset}
+
+    def get_documents_by_ids(self, doc_ids, filters=None):
+        """
+        Returns the listing view of the given documents that also match `filters`,
+        in the order of `doc_ids`.
+        """
+        query = {'_id': {'$in': [ObjectId(doc_id) for doc_id in doc_ids]}, **_search_filter(filters)}
+        docs = {str(doc['_id']): doc for doc in self.documents.find(query, LIST_EXCLUDED_FIELDS)}
+        return [_format_document(docs[doc_id]) for doc_id in map(str, doc_ids) if doc_id in docs]
 
     def update_document_status(self, doc_id, status, kvps, category, text, embedding):
         update_data = {
             'status': status,
             'kvps': kvps,
+            'kvp_text': kvp_search_text(kvps),
             'category': category,
             'text': text,
-            'embedding': embedding
+            'embedding': encode_embedding(embedding, self.embedding_format)
         }
         if status == 'Processed':
             update_data['processed_at'] = datetime.datetime.utcnow()
+        if embedding is None:
+            update_data['vectors_updated_at'] = datetime.datetime.utcnow()
 
-        self.documents.update_one(
+        self._update_document_tracked(
             {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}},
             {'$set': update_data}
         )
+        if embedding is None:
+            # A failed (re)processing run must not leave stale passages searchable
+            self.document_chunks.delete_many({'doc_id': ObjectId(doc_id)})
+
+    def replace_document_chunks(self, doc_id, chunks, embeddings):
+        """
+        Replaces the retrieval chunks of a document with `chunks` (TextChunks)
+        and their corresponding `embeddings`.
+        """
+        doc = self.documents.find_one({'_id': ObjectId(doc_id)}, {'filename': 1, 'category': 1, 'created_at': 1, 'deleted_at': 1})
+        if not doc:
+            return
+        chunk_docs = []
+        for chunk, embedding in zip(chunks, embeddings):
+            chunk_doc = {
+                'doc_id': doc['_id'],
+                'chunk_index': chunk.index,
+                'text': chunk.text,
+                'start': chunk.start,
+                'end': chunk.end,
+                'segment_kind': chunk.segment_kind,
+                'first_segment': chunk.first_segment,
+                'last_segment': chunk.last_segment,
+                'sheet_name': chunk.sheet_name,
+                'filename': doc.get('filename'),
+                'category': doc.get('category'),
+                # Copied so date filters can be pushed down into vector search
+                'created_at': doc.get('created_at'),
+                'embedding': encode_embedding(embedding, self.embedding_format)
+            }
+            if 'deleted_at' in doc:
+                chunk_doc['deleted_at'] = doc['deleted_at']
+            chunk_docs.append(chunk_doc)
+
+        self.document_chunks.delete_many({'doc_id': doc['_id']})
+        if chunk_docs:
+            self.document_chunks.insert_many(chunk_docs)
+        # Lets in-process vector indexes pick up the new chunks on their next sync
+        self.documents.update_one({'_id': doc['_id']}, {'$set': {'vectors_updated_at': datetime.datetime.utcnow()}})
+        self.cache.delete(_document_cache_key(doc['_id']))
+
+    def find_processed_duplicate(self, doc_id, content_sha256):
+        """Returns the id of another processed document with the same content, or None."""
+        if not content_sha256:
+            return None
+        source = self.documents.find_one(
+            {
+                '_id': {'$ne': ObjectId(doc_id)},
+                'content_sha256': content_sha256,
+                'status': {'$in': list(PROCESSED_STATUSES)},
+                'text': {'$ne': None}
+            },
+            {'_id': 1},
+            sort=[('processed_at', -1)]
+        )
+        return str(source['_id']) if source else None
+
+    def reuse_processing_result(self, doc_id, source_id):
+        """
+        Copies the processing result (text, KVPs, category, embedding and retrieval
+        chunks) of `source_id` to `doc_id`, which has the same content, instead of
+        processing it again. Returns False if either document is gone.
+        """
+        source = self.documents.find_one(
+            {'_id': ObjectId(source_id)},
+            {'text': 1, 'kvps': 1, 'kvp_text': 1, 'category': 1, 'embedding': 1}
+        )
+        if not source:
+            return False
+        now = datetime.datetime.utcnow()
+        _, after = self._update_document_tracked(
+            {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}},
+            {'$set': {
+                'status': 'Processed',
+                'text': source.get('text'),
+                'kvps': source.get('kvps'),
+                'kvp_text': source.get('kvp_text'),
+                'category': source.get('category'),
+                'embedding': source.get('embedding'),
+                'processed_at': now,
+                'deduplicated_from': source['_id']
+            }},
+            full_document=True
+        )
+        if after is None:
+            return False
+
+        chunk_docs = []
+        for chunk in self.document_chunks.find({'doc_id': source['_id']}, {'_id': 0}):
+            chunk.pop('deleted_at', None)
+            chunk.update({
+                'doc_id': after['_id'],
+                'filename': after.get('filename'),
+                'category': after.get('category'),
+                'created_at': after.get('created_at')
+            })
+            chunk_docs.append(chunk)
+        self.document_chunks.delete_many({'doc_id': after['_id']})
+        if chunk_docs:
+            self.document_chunks.insert_many(chunk_docs)
+        self.documents.update_one({'_id': after['_id']}, {'$set': {'vectors_updated_at': now}})
+        self.cache.delete(_document_cache_key(after['_id']))
+        add_audit_log(doc_id, 'reuse_processing_result', {'source_doc_id': source_id})
+        return True
 
     def update_document_kvp(self, doc_id, new_kvps):
-        self.documents.update_one(
+        """Replaces a document's KVPs. Returns the updated document, or None if it does not exist."""
+        _, after = self._update_document_tracked(
             {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}},
             {'$set': {
                 'kvps': new_kvps,
+                'kvp_text': kvp_search_text(new_kvps),
                 'status': 'Validated'
-            }}
+            }},
+            full_document=True
         )
+        return _format_document(after)
 
     def recategorize_document(self, doc_id, new_category, explanation):
         """
         Updates a document's category and saves the correction as a
-        fine-tuning example for the AI.
+        fine-tuning example for the AI. Returns the updated document,
+        or None if it does not exist.
         """
-        # First, find the document to get its text content
-        doc = self.documents.find_one({'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}})
-        if not doc:
-            logger.error(f"Could not find document {doc_id} to recategorize.")
-            return False
-
-        # Update the document itself
-        update_result = self.documents.update_one(
-            {'_id': ObjectId(doc_id)},
+        # Update the document, reading its previous state (with the text) in the same call
+        doc, after = self._update_document_tracked(
+            {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}},
             {'$set': {
                 'category': new_category,
                 'categorization_explanation': explanation,
-                'status': 'Re-categorized'
-            }}
+                'status': 'Re-categorized',
+                'vectors_updated_at': datetime.datetime.utcnow()
+            }},
+            full_document=True
         )
 
-        if update_result.modified_count > 0:
+        if doc is not None:
+            self.document_chunks.update_many({'doc_id': ObjectId(doc_id)}, {'$set': {'category': new_category}})
+
             # Save the successful correction as a fine-tuning example
             if 'text' in doc and doc['text']:
                 fine_tuning_example = {
@@ -251,21 +899,25 @@ class MongoDatabase(Database):
                 logger.warning(f"Did not save fine-tuning example for doc {doc_id} because text was missing.")
 
             add_audit_log(doc_id, 'recategorize', {'new_category': new_category, 'explanation': explanation})
-            return True
-        
-        return False
+            return _format_document(after)
+
+        logger.error(f"Could not find document {doc_id} to recategorize.")
+        return None
 
     def add_interactive_kvp(self, doc_id, key, value):
-        doc = self.documents.find_one({'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}})
+        """Adds or overwrites one KVP. Returns the updated document, or None if it does not exist."""
+        doc = self.documents.find_one({'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}}, {'kvps': 1, 'text': 1})
         if not doc:
-            return False
+            return None
         
-        result = self.documents.update_one(
+        new_kvps = {**doc.get('kvps', {}), key: value}
+        before, after = self._update_document_tracked(
             {'_id': ObjectId(doc_id)},
-            {'$set': {f'kvps.{key}': value, 'status': 'Validated'}}
+            {'$set': {f'kvps.{key}': value, 'kvp_text': kvp_search_text(new_kvps), 'status': 'Validated'}},
+            full_document=True
         )
 
-        if result.modified_count > 0:
+        if _changed(before, after, KVP_FIELDS):
             self.kvp_corrections.insert_one({
                 "doc_id": ObjectId(doc_id),
                 "doc_text": doc.get('text', ''),
@@ -275,21 +927,23 @@ class MongoDatabase(Database):
                 "created_at": datetime.datetime.utcnow()
             })
             add_audit_log(doc_id, 'add_kvp_interactive', {'key': key, 'value': value})
-            return True
-        return False
+        return _format_document(after)
 
     def update_interactive_kvp(self, doc_id, key, value):
-        doc = self.documents.find_one({'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}})
+        """Changes an existing KVP. Returns the updated document, or None if the document or key does not exist."""
+        doc = self.documents.find_one({'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}}, {'kvps': 1, 'text': 1})
         if not doc or key not in doc.get('kvps', {}):
-            return False
+            return None
             
         old_value = doc['kvps'].get(key)
-        result = self.documents.update_one(
+        new_kvps = {**doc['kvps'], key: value}
+        before, after = self._update_document_tracked(
             {'_id': ObjectId(doc_id)},
-            {'$set': {f'kvps.{key}': value, 'status': 'Validated'}}
+            {'$set': {f'kvps.{key}': value, 'kvp_text': kvp_search_text(new_kvps), 'status': 'Validated'}},
+            full_document=True
         )
 
-        if result.modified_count > 0:
+        if _changed(before, after, KVP_FIELDS):
             self.kvp_corrections.insert_one({
                 "doc_id": ObjectId(doc_id),
                 "doc_text": doc.get('text', ''),
@@ -300,21 +954,23 @@ class MongoDatabase(Database):
                 "created_at": datetime.datetime.utcnow()
             })
             add_audit_log(doc_id, 'update_kvp_interactive', {'key': key, 'old_value': old_value, 'new_value': value})
-            return True
-        return False
+        return _format_document(after)
 
     def delete_interactive_kvp(self, doc_id, key):
-        doc = self.documents.find_one({'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}})
+        """Removes a KVP. Returns the updated document, or None if the document or key does not exist."""
+        doc = self.documents.find_one({'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}}, {'kvps': 1, 'text': 1})
         if not doc or key not in doc.get('kvps', {}):
-            return False
+            return None
 
         old_value = doc['kvps'].get(key)
-        result = self.documents.update_one(
+        new_kvps = {k: v for k, v in doc['kvps'].items() if k != key}
+        before, after = self._update_document_tracked(
             {'_id': ObjectId(doc_id)},
-            {'$unset': {f'kvps.{key}': ""}, '$set': {'status': 'Validated'}}
+            {'$unset': {f'kvps.{key}': ""}, '$set': {'kvp_text': kvp_search_text(new_kvps), 'status': 'Validated'}},
+            full_document=True
         )
 
-        if result.modified_count > 0:
+        if _changed(before, after, KVP_FIELDS):
             self.kvp_corrections.insert_one({
                 "doc_id": ObjectId(doc_id),
                 "doc_text": doc.get('text', ''),
@@ -324,32 +980,98 @@ class MongoDatabase(Database):
                 "created_at": datetime.datetime.utcnow()
             })
             add_audit_log(doc_id, 'delete_kvp_interactive', {'key': key, 'old_value': old_value})
-            return True
-        return False
+        return _format_document(after)
 
     def update_document_for_reprocessing(self, doc_id):
-        self.documents.update_one(
+        """
+        Marks a document as queued again. Returns the updated document, or None if it does not exist.
+        Reprocessing is interactive, so the document leaves the bulk lane's dispatching.
+        """
+        _, after = self._update_document_tracked(
             {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}},
-            {'$set': {'status': 'Queued for Processing'}}
+            {'$set': {'status': 'Queued for Processing'}, '$unset': {'processing_lane': '', 'dispatched_at': ''}},
+            full_document=True
         )
+        return _format_document(after)
+
+    def get_bulk_dispatch_state(self, stale_before):
+        """
+        Returns the queued bulk-lane documents per batch: those waiting to be dispatched
+        ({batch_id: count}, oldest batch first) and those dispatched since `stale_before`
+        but not finished ({batch_id: count}). Documents dispatched before `stale_before`
+        that are still queued (e.g. their message was lost) are waiting again.
+        """
+        queued = {'processing_lane': 'bulk', 'status': 'Queued for Processing', 'deleted_at': {'$exists': False}}
+        waiting = self.documents.aggregate([
+            {'$match': {**queued, **_undispatched_since(stale_before)}},
+            {'$group': {'_id': '$batch_id', 'count': {'$sum': 1}, 'oldest': {'$min': '$created_at'}}},
+            {'$sort': {'oldest': 1}}
+        ])
+        in_flight = self.documents.aggregate([
+            {'$match': {**queued, 'dispatched_at': {'$gte': stale_before}}},
+            {'$group': {'_id': '$batch_id', 'count': {'$sum': 1}}}
+        ])
+        return (
+            {group['_id']: group['count'] for group in waiting},
+            {group['_id']: group['count'] for group in in_flight}
+        )
+
+    def claim_bulk_documents(self, batch_id, count, stale_before):
+        """
+        Marks up to `count` of the oldest waiting documents of a bulk batch (never dispatched,
+        or dispatched before `stale_before` and still queued) as dispatched and returns their
+        ids. Documents claimed by a concurrent dispatcher are skipped.
+        """
+        waiting = {'processing_lane': 'bulk', 'batch_id': batch_id, 'status': 'Queued for Processing',
+                   'deleted_at': {'$exists': False}, **_undispatched_since(stale_before)}
+        candidates = [doc['_id'] for doc in self.documents.find(waiting, {'_id': 1}).sort('created_at', 1).limit(count)]
+        if not candidates:
+            return []
+        token = str(ObjectId())
+        self.documents.update_many(
+            {'_id': {'$in': candidates}, **_undispatched_since(stale_before)},
+            {'$set': {'dispatched_at': datetime.datetime.utcnow(), 'dispatch_token': token}}
+        )
+        return [str(doc['_id']) for doc in self.documents.find({'_id': {'$in': candidates}, 'dispatch_token': token}, {'_id': 1})]
 
     def soft_delete_document(self, doc_id):
-        result = self.documents.update_one(
+        deleted_at = datetime.datetime.utcnow()
+        before, _ = self._update_document_tracked(
             {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': False}},
-            {'$set': {'deleted_at': datetime.datetime.utcnow()}}
+            {'$set': {'deleted_at': deleted_at, 'vectors_updated_at': deleted_at}}
         )
-        if result.modified_count > 0:
+        if before is not None:
+            self.document_chunks.update_many({'doc_id': ObjectId(doc_id)}, {'$set': {'deleted_at': deleted_at}})
             add_audit_log(doc_id, 'soft_delete')
-        return result.modified_count > 0
+        return before is not None
 
     def restore_document(self, doc_id):
-        result = self.documents.update_one(
+        before, _ = self._update_document_tracked(
             {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': True}},
-            {'$unset': {'deleted_at': ''}}
+            {'$unset': {'deleted_at': ''}, '$set': {'vectors_updated_at': datetime.datetime.utcnow()}}
         )
-        if result.modified_count > 0:
+        if before is not None:
+            self.document_chunks.update_many({'doc_id': ObjectId(doc_id)}, {'$unset': {'deleted_at': ''}})
             add_audit_log(doc_id, 'restore')
-        return result.modified_count > 0
+        return before is not None
+
+    def purge_document(self, doc_id):
+        """
+        Permanently removes a soft-deleted document and its chunks, and releases
+        its stored file. Returns False if the document is not in the trash.
+        """
+        doc = self.documents.find_one_and_delete(
+            {'_id': ObjectId(doc_id), 'deleted_at': {'$exists': True}},
+            projection={'file_id': 1}
+        )
+        if doc is None:
+            return False
+        self.document_chunks.delete_many({'doc_id': doc['_id']})
+        self.cache.delete(_document_cache_key(doc['_id']))
+        if doc.get('file_id'):
+            self.release_file(doc['file_id'])
+        add_audit_log(doc_id, 'purge')
+        return True
 
     def save_fine_tuning_data(self, data):
         self.fine_tuning_data.insert_one(data)
@@ -364,128 +1086,94 @@ class MongoDatabase(Database):
         return examples
 
     def get_dashboard_statistics(self):
+        """
+        Builds the dashboard statistics from the materialized per-category counters,
+        so the cost of a request depends on the number of categories, not documents.
+        """
+        return build_dashboard(list(self.dashboard_stats.find({}, {'_id': 0})))
+
+    def reconcile_dashboard_statistics(self):
+        """
+        Recomputes the per-category counters from the documents and corrects the
+        materialized ones that drifted, logging the drift found. Returns the number of
+        categories whose counters had drifted.
+
+        Corrections are `$inc`s guarded by the counters they were computed from, so a
+        counter changed by a concurrent write is left alone (and checked again on the
+        next run) rather than overwritten, which would lose that write's increment.
+        """
+        # Missing or null dates are falsy
+        has_processing_time = {'$and': ['$created_at', '$processed_at']}
         pipeline = [
+            {'$match': {'deleted_at': {'$exists': False}}},
             {
-                '$match': {
-                    'deleted_at': {'$exists': False}
-                }
-            },
-            {
-                '$facet': {
-                    'overall_stats': [
-                        {
-                            '$group': {
-                                '_id': None,
-                                'total_documents': {'$sum': 1},
-                                'processed_count': {
-                                    '$sum': {
-                                        '$cond': [{'$in': ['$status', ['Processed', 'Validated', 'Re-categorized']]}, 1, 0]
-                                    }
-                                },
-                                'auto_classified_count': {
-                                    '$sum': {
-                                        '$cond': [{'$eq': ['$status', 'Processed']}, 1, 0]
-                                    }
-                                },
-                                'avg_processing_time_ms': {
-                                    '$avg': {
-                                        '$subtract': ['$processed_at', '$created_at']
-                                    }
-                                }
-                            }
-                        }
-                    ],
-                    'document_pools': [
-                        {
-                            '$match': {'category': {'$ne': None}}
-                        },
-                        {
-                            '$group': {
-                                '_id': '$category',
-                                'document_count': {'$sum': 1},
-                                'accuracy_numerator': {
-                                    '$sum': {
-                                        '$cond': [{'$in': ['$status', ['Processed', 'Validated']]}, 1, 0]
-                                    }
-                                },
-                                'processing_count': {
-                                    '$sum': {
-                                        '$cond': [{'$in': ['$status', ['Queued for Processing', 'Processing']]}, 1, 0]
-                                    }
-                                }
-                            }
-                        },
-                        {
-                            '$project': {
-                                'pool_name': '$_id',
-                                'document_count': 1,
-                                'status': {
-                                    '$cond': [{'$gt': ['$processing_count', 0]}, 'processing', 'active']
-                                },
-                                'accuracy': {
-                                    '$cond': [
-                                        {'$eq': ['$document_count', 0]},
-                                        0,
-                                        {'$multiply': [{'$divide': ['$accuracy_numerator', '$document_count']}, 100]}
-                                    ]
-                                },
-                                '_id': 0
-                            }
-                        }
-                    ],
-                    'unknown_pool': [
-                        {
-                            '$match': {'category': None}
-                        },
-                        {
-                            '$count': 'document_count'
-                        }
-                    ]
+                '$group': {
+                    '_id': {'category': '$category', 'status': '$status'},
+                    'document_count': {'$sum': 1},
+                    'processing_time_count': {'$sum': {'$cond': [has_processing_time, 1, 0]}},
+                    'processing_time_ms_sum': {
+                        '$sum': {'$cond': [has_processing_time, {'$subtract': ['$processed_at', '$created_at']}, 0]}
+                    }
                 }
             }
         ]
-
-        result = list(self.documents.aggregate(pipeline))
-        
-        if not result:
-            return {}
-        
-        stats = result[0]
-        overall = stats['overall_stats'][0] if stats['overall_stats'] else {}
-        total_docs = overall.get('total_documents', 0)
-        processed_count = overall.get('processed_count', 0)
-
-        processing_accuracy = (processed_count / total_docs * 100) if total_docs > 0 else 0
-        auto_classified_accuracy = (overall.get('auto_classified_count', 0) / processed_count * 100) if processed_count > 0 else 0
-        avg_time_ms = overall.get('avg_processing_time_ms')
-        avg_processing_time = (avg_time_ms / 1000) if avg_time_ms is not None else None
-
-        dashboard_data = {
-            'total_documents': total_docs,
-            'processing_accuracy': round(processing_accuracy, 2),
-            'avg_processing_time': round(avg_processing_time, 2) if avg_time_ms is not None else None,
-            'auto_classified_accuracy': round(auto_classified_accuracy, 2),
-            'document_pools': stats.get('document_pools', [])
-        }
-
-        if stats.get('unknown_pool'):
-            dashboard_data['document_pools'].append({
-                'pool_name': 'Unknown',
-                'document_count': stats['unknown_pool'][0]['document_count'],
-                'status': 'pending',
-                'accuracy': 0
+        records = {}
+        for group in self.documents.aggregate(pipeline):
+            category = group['_id'].get('category')
+            record = records.setdefault(category, {
+                'category': category,
+                'document_count': 0,
+                'status_counts': {},
+                'processing_time_count': 0,
+                'processing_time_ms_sum': 0
             })
-
-        return dashboard_data
+            record['document_count'] += group['document_count']
+            record['status_counts'][str(group['_id'].get('status'))] = group['document_count']
+            record['processing_time_count'] += group['processing_time_count']
+            record['processing_time_ms_sum'] += group['processing_time_ms_sum']
+
+        current = {record['category']: record for record in self.dashboard_stats.find({}, {'_id': 0})}
+        drifted = 0
+        for category in set(records) | set(current):
+            expected = records.get(category)
+            actual = current.get(category)
+            guard, increments = reconciliation(expected, actual)
+            if not increments:
+                continue
+            drifted += 1
+            logger.warning(f"Dashboard statistics for category '{category}' drifted: "
+                           f"stored {actual}, recomputed {expected}.")
+            if actual is None:
+                try:
+                    self.dashboard_stats.insert_one(dict(expected))
+                    continue
+                except DuplicateKeyError:
+                    corrected = False
+            else:
+                # Records of categories without documents are zeroed; the dashboard skips them
+                result = self.dashboard_stats.update_one({'category': category, **guard}, {'$inc': increments})
+                corrected = bool(result.matched_count)
+            if not corrected:
+                logger.info(f"Dashboard statistics for category '{category}' changed while reconciling; "
+                            f"left for the next run.")
+        logger.info(f"Reconciled dashboard statistics for {len(records)} categories; {drifted} had drifted.")
+        return drifted
 
     def get_all_categories(self):
+        cached = self.cache.get(CATEGORIES_CACHE_KEY)
+        if cached is not None:
+            return bson.decode(cached)['names']
+        generation = self.cache.generation(CATEGORIES_CACHE_KEY)
         categories_cursor = self.categories.find({}, {"_id": 0, "name": 1}).sort("name")
-        return [category["name"] for category in categories_cursor]
+        names = [category["name"] for category in categories_cursor]
+        self.cache.set(CATEGORIES_CACHE_KEY, bson.encode({'names': names}), generation=generation)
+        return names
 
     def create_category(self, category_name):
         if self.categories.find_one({"name": category_name}):
             return False
         self.categories.insert_one({"name": category_name})
+        self.cache.delete(CATEGORIES_CACHE_KEY)
         return True
 
     def delete_category(self, category_name):
@@ -496,33 +1184,70 @@ class MongoDatabase(Database):
             return "in_use"
 
         result = self.categories.delete_one({"name": category_name})
+        self.cache.delete(CATEGORIES_CACHE_KEY)
         if result.deleted_count > 0:
             return "deleted"
         return "not_found"
 
+    def create_indexes(self):
+        """Creates the regular (non-search) indexes the queries rely on."""
+        self.document_chunks.create_index([('doc_id', 1), ('chunk_index', 1)])
+        self.documents.create_index([('vectors_updated_at', 1)], sparse=True)
+        # Serve the paginated listings (all / trash, optionally by category) straight from the index
+        self.documents.create_index([('deleted_at', 1), ('created_at', -1), ('_id', -1)])
+        self.documents.create_index([('deleted_at', 1), ('category', 1), ('created_at', -1), ('_id', -1)])
+        # Full-text search over filename, KVP values and extracted text, plus chunk text for snippets
+        self.documents.create_index(
+            [('filename', 'text'), ('kvp_text', 'text'), ('text', 'text')],
+            weights={'filename': 10, 'kvp_text': 5, 'text': 1},
+            name='document_text_search'
+        )
+        self.document_chunks.create_index([('text', 'text')], name='chunk_text_search')
+        self.dashboard_stats.create_index([('category', 1)], unique=True)
+        self.llm_cache.create_indexes()
+        self.pipeline_checkpoints.create_indexes()
+        self.documents.create_index([('batch_id', 1)], sparse=True)
+        # Bulk-lane dispatching only looks at documents that are in the bulk lane
+        self.documents.create_index(
+            [('processing_lane', 1), ('status', 1), ('batch_id', 1), ('created_at', 1)],
+            partialFilterExpression={'processing_lane': {'$exists': True}}
+        )
+        self.documents.create_index([('content_sha256', 1)], sparse=True)
+        # GridFS creates these on its first write, but bulk uploads bypass GridIn
+        self.db['fs.chunks'].create_index([('files_id', 1), ('n', 1)], unique=True)
+        self.db['fs.files'].create_index([('filename', 1), ('uploadDate', 1)])
+        # Identical uploads share one GridFS file; files stored before hashing have no sha256
+        self.db['fs.files'].create_index(
+            [('sha256', 1)], unique=True, partialFilterExpression={'sha256': {'$exists': True}}
+        )
+
     def create_vector_search_index(self):
         index_name = "vector_index"
-        if index_name in self.documents.list_search_indexes():
+        if any(index.get('name') == index_name for index in self.document_chunks.list_search_indexes()):
             logger.info(f"Vector search index '{index_name}' already exists.")
             return
 
         logger.info(f"Creating vector search index '{index_name}'. This may take a minute...")
-        index_definition = {
-            "name": index_name,
-            "definition": {
-                "mappings": {
-                    "dynamic": True,
-                    "fields": {
-                        "embedding": {
-                            "type": "vector",
-                            "dimensions": self.vector_dimensions,
-                            "similarity": "cosine"
-                        }
-                    }
-                }
+        # A vectorSearch index; the filter fields are the ones $vectorSearch pre-filters can use
+        index_definition = SearchIndexModel(
+            name=index_name,
+            type="vectorSearch",
+            definition={
+                "fields": [
+                    {
+                        "type": "vector",
+                        "path": "embedding",
+                        "numDimensions": self.vector_dimensions,
+                        "similarity": "cosine"
+                    },
+                    {"type": "filter", "path": "doc_id"},
+                    {"type": "filter", "path": "deleted_at"},
+                    {"type": "filter", "path": "category"},
+                    {"type": "filter", "path": "created_at"}
+                ]
             }
-        }
-        self.documents.create_search_index(index_definition)
+        )
+        self.document_chunks.create_search_index(index_definition)
         logger.info("Vector search index created successfully.")
 
 def init_db(app):
@@ -530,7 +1255,37 @@ def init_db(app):
     if db_client is None:
         mongo_uri = app.config['MONGO_URI']
         vector_dimensions = app.config.get('VECTOR_DIMENSIONS', 384)
-        db_client = MongoDatabase(mongo_uri, vector_dimensions)
+        embedding_format = app.config.get('EMBEDDING_STORAGE_FORMAT', 'float32')
+        cache = TwoTierCache(
+            max_entries=app.config.get('CACHE_MAX_ENTRIES', 0),
+            local_ttl=app.config.get('CACHE_LOCAL_TTL_SECONDS', 5),
+            redis_url=app.config.get('CACHE_REDIS_URL'),
+            redis_ttl=app.config.get('CACHE_REDIS_TTL_SECONDS', 300),
+            max_bytes=app.config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        )
+        db_client = MongoDatabase(
+            mongo_uri, vector_dimensions, embedding_format, cache,
+            llm_cache_ttl=app.config.get('LLM_CACHE_TTL_SECONDS', 30 * 24 * 3600),
+            llm_cache_max_entries=app.config.get('LLM_CACHE_MAX_ENTRIES', 0),
+            checkpoint_ttl=app.config.get('PIPELINE_CHECKPOINT_TTL_SECONDS', 7 * 24 * 3600),
+            search_max_results=app.config.get('SEARCH_MAX_RESULTS', 1000),
+            search_max_time_ms=app.config.get('SEARCH_MAX_TIME_MS', 0)
+        )
     
     app.db = db_client
-    app.db.create_vector_search_index()
+    app.db.create_indexes()
+    # Cached results of a previously configured model are no longer valid
+    app.db.llm_cache.invalidate_other_models(app.config.get('CHAT_MODEL_NAME', 'phi3:mini'))
+    # Existing deployments get their statistics counters built on first start
+    if db_client.dashboard_stats.estimated_document_count() == 0 and db_client.documents.estimated_document_count() > 0:
+        app.db.reconcile_dashboard_statistics()
+    # Search indexes only exist on Atlas; the 'local' backend indexes vectors in-process
+    if app.config.get('VECTOR_STORE_BACKEND', 'atlas') == 'atlas':
+        if db_client.embedding_format != 'float32':
+            logger.warning(f"EMBEDDING_STORAGE_FORMAT '{db_client.embedding_format}' cannot be searched by Atlas $vectorSearch; "
+                           f"use it with VECTOR_STORE_BACKEND=local.")
+        try:
+            app.db.create_vector_search_index()
+        except OperationFailure as e:
+            logger.error(f"Could not create the Atlas vector search index; semantic search will return no results. "
+                         f"Set VECTOR_STORE_BACKEND=local on deployments without Atlas Search. Error: {e}")
@@ -0,0 +1,150 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import List
+from flask import current_app
+from langchain.schema.embeddings import Embeddings
+from app.ai_models import get_embeddings
+from app.embedding_client import RemoteEmbeddings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingTimeoutError(TimeoutError):
+    """Raised when the embeddings of a request are not ready within the batcher's timeout."""
+
+# --- Global Embedding Batcher ---
+g_embedding_batcher = None
+embedding_batcher_lock = threading.Lock()
+
+
+def get_embedding_batcher():
+    """
+    Returns a global EmbeddingBatcher wrapping the shared embeddings model,
+    configured from EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS and
+    EMBEDDING_REQUEST_TIMEOUT_SECONDS. An embedding
+    service batches on its own side, so its client is returned as is.
+    """
+    global g_embedding_batcher
+    embeddings = get_embeddings()
+    if isinstance(embeddings, RemoteEmbeddings):
+        return embeddings
+    with embedding_batcher_lock:
+        if g_embedding_batcher is None:
+            g_embedding_batcher = EmbeddingBatcher(
+                embeddings,
+                max_batch_size=current_app.config['EMBEDDING_BATCH_SIZE'],
+                max_wait_ms=current_app.config['EMBEDDING_BATCH_WAIT_MS'],
+                timeout=current_app.config['EMBEDDING_REQUEST_TIMEOUT_SECONDS']
+            )
+    return g_embedding_batcher
+
+
+class EmbeddingBatcher(Embeddings):
+    """
+    Collects embedding requests from concurrent callers (e.g. the threads of a
+    Celery worker processing several documents) into micro-batches, and calls
+    `embed_documents` on the wrapped model once per batch.
+
+    A batch is sent as soon as it holds `max_batch_size` texts or the oldest
+    request has waited `max_wait_ms`, whichever comes first. Callers block
+    until their own slice of the results is ready, for at most `timeout` seconds
+    (None: no limit); then EmbeddingTimeoutError is raised, and a request whose
+    batch has not started yet is dropped.
+    """
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 64, max_wait_ms: float = 20,
+                 timeout: float = 120):
+        self._embeddings = embeddings
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._timeout = timeout
+        self._requests = queue.Queue()
+        self._carried_over = None
+        self._thread = None
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        future = Future()
+        self._ensure_thread()
+        self._requests.put((list(texts), future, time.perf_counter()))
+        try:
+            return future.result(timeout=self._timeout)
+        except FutureTimeoutError:
+            # Fails if the batch is already being embedded; its result is then left unread
+            future.cancel()
+            metrics.increment('embedding_request_timeouts_total')
+            raise EmbeddingTimeoutError(f"Embedding {len(texts)} texts took longer than {self._timeout}s") from None
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a forked child starts its own
+        with self._thread_lock:
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._requests = queue.Queue()
+                self._carried_over = None
+                self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def _collect_batch(self):
+        """Blocks for the first request, then gathers more until the batch is full or the wait expires."""
+        first, self._carried_over = self._carried_over, None
+        batch = [first or self._requests.get()]
+        batch_size = len(batch[0][0])
+        deadline = batch[0][2] + self._max_wait
+        while batch_size < self._max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if batch_size + len(request[0]) > self._max_batch_size:
+                # Does not fit; it opens the next batch instead of splitting this one
+                self._carried_over = request
+                break
+            batch.append(request)
+            batch_size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            # Requests whose callers timed out in the meantime were cancelled
+            batch = [request for request in self._collect_batch() if request[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            texts = [text for request_texts, _, _ in batch for text in request_texts]
+            try:
+                vectors = []
+                # A single oversized request is still sent in model-sized slices
+                for start in range(0, len(texts), self._max_batch_size):
+                    piece = texts[start:start + self._max_batch_size]
+                    vectors.extend(self._embeddings.embed_documents(piece))
+                    metrics.observe('embedding_batch_size', len(piece))
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(texts)} texts failed: {e}", exc_info=True)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            metrics.increment('embedding_batches_total')
+            metrics.increment('embedding_texts_total', len(texts))
+            metrics.observe('embedding_batch_latency_ms', (finished - started) * 1000)
+            offset = 0
+            for request_texts, future, enqueued_at in batch:
+                metrics.observe('embedding_request_latency_ms', (finished - enqueued_at) * 1000)
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+            logger.debug(f"Embedded a batch of {len(texts)} texts from {len(batch)} requests in {(finished - started) * 1000:.1f} ms.")
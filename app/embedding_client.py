@@ -0,0 +1,73 @@
+import os
+import time
+import logging
+import threading
+from typing import List
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain.schema.embeddings import Embeddings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Texts sent per HTTP request; longer lists are split, so one document cannot build a huge body
+MAX_TEXTS_PER_REQUEST = 256
+
+
+class EmbeddingServiceError(ConnectionError):
+    """Raised when the embedding service cannot be reached or fails a request."""
+
+
+class RemoteEmbeddings(Embeddings):
+    """
+    The embeddings of a standalone embedding service (`python -m app.embedding_server`),
+    used in place of the in-process model when EMBEDDINGS_SERVICE_URL is set.
+
+    Requests go over a keep-alive session with a connection pool of `max_connections`;
+    connection errors and 502/503/504 replies (e.g. while the service restarts) are
+    retried up to `retries` times, as embedding the same texts again is harmless.
+    """
+    def __init__(self, base_url: str, timeout: float = 30, max_connections: int = 16, retries: int = 3):
+        self.base_url = base_url.rstrip('/')
+        self._timeout = timeout
+        self._max_connections = max_connections
+        self._retries = retries
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self) -> requests.Session:
+        # Pooled connections must not be shared with a forked child, so each process opens its own
+        with self._session_lock:
+            if self._session is None or self._session_pid != os.getpid():
+                retry = Retry(total=self._retries, connect=self._retries, read=0, backoff_factor=0.2,
+                              status_forcelist=(502, 503, 504), allowed_methods=None)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._max_connections, max_retries=retry)
+                self._session = requests.Session()
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+                self._session_pid = os.getpid()
+        return self._session
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        try:
+            response = self._get_session().post(f"{self.base_url}/embed", json={"texts": texts}, timeout=self._timeout)
+            response.raise_for_status()
+            vectors = response.json()['embeddings']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            metrics.increment('embedding_service_client_errors_total')
+            logger.error(f"Embedding service at {self.base_url} failed to embed {len(texts)} texts: {e}")
+            raise EmbeddingServiceError(f"Embedding service at {self.base_url} is unavailable: {e}") from e
+        metrics.observe_histogram('embedding_service_client_latency_ms', (time.perf_counter() - started) * 1000)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), MAX_TEXTS_PER_REQUEST):
+            vectors.extend(self._embed(list(texts[start:start + MAX_TEXTS_PER_REQUEST])))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
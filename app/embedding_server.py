@@ -0,0 +1,128 @@
+"""
+A standalone embedding service: one process that owns the embeddings model and
+serves it over localhost HTTP to the API and the Celery workers (EMBEDDINGS_SERVICE_URL),
+so the model is loaded once instead of once per process, and the texts of concurrent
+requests from all of them are embedded together in micro-batches (EmbeddingBatcher).
+
+    POST /embed    {"texts": ["...", ...]}  ->  {"embeddings": [[...], ...]}
+    GET  /health   {"status": "ok", "model": "...", "dimensions": 384}
+    GET  /metrics  the service's batching and request metrics
+
+Usage (from the project root):
+    python -m app.embedding_server --host 127.0.0.1 --port 8001
+"""
+import json
+import time
+import logging
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app.ai_models import init_embeddings
+from app.embedding_batcher import EmbeddingBatcher, EmbeddingTimeoutError
+from app.logging_config import setup_logging
+from app.model_preload import WARM_UP_TEXT
+from app.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted, so one client cannot make the service buffer unbounded input
+MAX_REQUEST_BYTES = 32 * 1024 * 1024
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, so clients do not open one per request
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {"status": "ok", "model": self.server.model_name, "dimensions": self.server.dimensions})
+        elif self.path == '/metrics':
+            self._reply(200, metrics.snapshot())
+        else:
+            self._reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != '/embed':
+            self._reply(404, {"error": "Not found"})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            self._reply(413, {"error": f"Request body larger than {MAX_REQUEST_BYTES} bytes"})
+            return
+        try:
+            texts = json.loads(self.rfile.read(length))['texts']
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("'texts' must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {"error": f"Invalid request: {e}"})
+            return
+
+        started = time.perf_counter()
+        try:
+            vectors = self.server.batcher.embed_documents(texts)
+        except EmbeddingTimeoutError as e:
+            logger.warning(f"Embedding {len(texts)} texts timed out: {e}")
+            metrics.increment('embedding_service_errors_total')
+            self._reply(503, {"error": "Embedding timed out"})
+            return
+        except Exception as e:
+            logger.error(f"Embedding {len(texts)} texts failed: {e}", exc_info=True)
+            metrics.increment('embedding_service_errors_total')
+            self._reply(500, {"error": "Embedding failed"})
+            return
+        metrics.increment('embedding_service_requests_total')
+        metrics.observe_histogram('embedding_service_latency_ms', (time.perf_counter() - started) * 1000)
+        self._reply(200, {"embeddings": vectors})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    """An HTTP server embedding the texts of all its request threads through one EmbeddingBatcher."""
+    daemon_threads = True
+
+    def __init__(self, address, model_name: str, max_batch_size: int, max_wait_ms: float, request_timeout: float):
+        embeddings = init_embeddings(model_name)
+        self.model_name = model_name
+        self.dimensions = len(embeddings.embed_query(WARM_UP_TEXT))
+        self.batcher = EmbeddingBatcher(embeddings, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                        timeout=request_timeout)
+        super().__init__(address, EmbeddingRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=Config.EMBEDDINGS_SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=Config.EMBEDDINGS_SERVICE_PORT)
+    parser.add_argument('--model', default=Config.EMBEDDINGS_MODEL_NAME)
+    parser.add_argument('--batch-size', type=int, default=Config.EMBEDDING_BATCH_SIZE)
+    parser.add_argument('--wait-ms', type=float, default=Config.EMBEDDING_BATCH_WAIT_MS)
+    # Clients give up after EMBEDDINGS_SERVICE_TIMEOUT_SECONDS, so a request thread need not wait longer
+    parser.add_argument('--request-timeout', type=float, default=Config.EMBEDDINGS_SERVICE_TIMEOUT_SECONDS,
+                        help="Seconds a request waits for its embeddings before a 503")
+    args = parser.parse_args()
+
+    setup_logging()
+    server = EmbeddingServer((args.host, args.port), args.model, args.batch_size, args.wait_ms, args.request_timeout)
+    logger.info(f"Embedding service for '{args.model}' ({server.dimensions} dimensions) "
+                f"listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.metrics import metrics
+from app.utils.search_text import make_snippet
+
+logger = logging.getLogger(__name__)
+
+# Each vector hit is a chunk, and several chunks can belong to one document, so the
+# vector side fetches this many chunks per wanted document
+CHUNKS_PER_DOCUMENT = 3
+
+# --- Global Search Executor ---
+# Runs the lexical and vector retrievals of a hybrid search side by side.
+g_search_executor = None
+search_executor_lock = threading.Lock()
+
+
+def get_search_executor():
+    global g_search_executor
+    with search_executor_lock:
+        if g_search_executor is None:
+            g_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hybrid-search')
+    return g_search_executor
+
+
+def _chunk_filter(filters: dict) -> dict:
+    """
+    Translates search filters into a vector store filter on chunk fields. Chunks carry
+    their document's category and creation time; `status` changes after the chunks
+    are written, and `Uncategorized` documents have no category to match, so those
+    filters are applied when the vector hits are matched to their documents, before
+    fusion.
+    """
+    chunk_filter = {}
+    if filters.get('category') and filters['category'] != 'Uncategorized':
+        chunk_filter['category'] = filters['category']
+    created_range = {}
+    if filters.get('created_from'):
+        created_range['$gte'] = filters['created_from']
+    if filters.get('created_to'):
+        created_range['$lt'] = filters['created_to']
+    if created_range:
+        chunk_filter['created_at'] = created_range
+    return chunk_filter
+
+
+def _timed(stage: str, timings: dict, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+        metrics.observe(f'hybrid_search_{stage}_latency_ms', timings[stage])
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Merges several best-first lists of ids into one, scoring every id by
+    sum(1 / (k + rank)) over the lists it appears in (ranks start at 1).
+    Returns (id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(db, vector_store, query: str, limit: int = 20, offset: int = 0, filters: dict = None,
+                  rrf_k: int = 60, min_candidates: int = 50) -> dict:
+    """
+    Runs the full-text search (`db.search_documents`) and the semantic search
+    (`vector_store.similarity_search`) concurrently, and fuses their document
+    rankings with reciprocal rank fusion.
+
+    Returns {"documents": [...], "next_offset": ..., "timings_ms": {...}}. Every
+    document carries its fused `score`, its `lexical_rank` / `vector_rank` (None
+    when only one side found it), and a `snippet` with `highlights`.
+    """
+    filters = filters or {}
+    timings = {}
+    started = time.perf_counter()
+    candidates = max(min_candidates, offset + limit)
+
+    executor = get_search_executor()
+    lexical_future = executor.submit(
+        _timed, 'lexical', timings, db.search_documents, query, limit=candidates, offset=0, filters=filters
+    )
+    vector_future = executor.submit(
+        _timed, 'vector', timings, vector_store.similarity_search,
+        query, k=candidates * CHUNKS_PER_DOCUMENT, filter=_chunk_filter(filters)
+    )
+    lexical_docs = lexical_future.result()['documents']
+    vector_chunks = vector_future.result()
+
+    lexical_ranking = [doc['_id'] for doc in lexical_docs]
+    docs_by_id = {doc['_id']: doc for doc in lexical_docs}
+    # A document ranks by its best chunk, which also provides its snippet
+    best_chunks = {}
+    for chunk in vector_chunks:
+        best_chunks.setdefault(chunk.metadata['doc_id'], chunk)
+
+    # Vector-only hits still need their document, which also applies the filters that could
+    # not be pushed down into the vector search; the ones it drops must not take fused ranks
+    missing = [doc_id for doc_id in best_chunks if doc_id not in docs_by_id]
+    if missing:
+        for doc in _timed('hydrate', timings, db.get_documents_by_ids, missing, filters):
+            docs_by_id[doc['_id']] = doc
+    vector_ranking = [doc_id for doc_id in best_chunks if doc_id in docs_by_id]
+
+    fusion_started = time.perf_counter()
+    fused = reciprocal_rank_fusion([lexical_ranking, vector_ranking], k=rrf_k)
+    timings['fusion'] = round((time.perf_counter() - fusion_started) * 1000, 2)
+    page_ids = [doc_id for doc_id, _ in fused[offset:offset + limit]]
+
+    lexical_ranks = {doc_id: rank for rank, doc_id in enumerate(lexical_ranking, start=1)}
+    vector_ranks = {doc_id: rank for rank, doc_id in enumerate(vector_ranking, start=1)}
+    fused_scores = dict(fused)
+    results = []
+    for doc_id in page_ids:
+        doc = dict(docs_by_id[doc_id], score=round(fused_scores[doc_id], 6),
+                   lexical_rank=lexical_ranks.get(doc_id), vector_rank=vector_ranks.get(doc_id))
+        if not doc.get('snippet') and doc_id in best_chunks:
+            # Semantic matches need not share any words with the query, so highlights may be empty
+            doc['snippet'], doc['highlights'] = make_snippet(best_chunks[doc_id].page_content, query)
+        results.append(doc)
+
+    timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+    metrics.observe('hybrid_search_total_latency_ms', timings['total'])
+    next_offset = offset + limit if len(fused) > offset + limit else None
+    logger.info(f"Hybrid search for '{query[:30]}' fused {len(lexical_ranking)} lexical and "
+                f"{len(vector_ranking)} vector hits in {timings['total']} ms.")
+    return {"documents": results, "next_offset": next_offset, "timings_ms": timings}
@@ -0,0 +1,120 @@
+import json
+import hashlib
+import datetime
+import logging
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# The size bound is enforced every TRIM_EVERY writes rather than on each one
+TRIM_EVERY = 100
+
+
+def normalize_prompt_text(text: str) -> str:
+    """Normalizes line endings and trailing whitespace, which do not change what the model is asked."""
+    lines = (text or '').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+def llm_cache_key(model: str, system_prompt: str, text: str) -> str:
+    """
+    Hashes everything that determines a (temperature 0) response: the model name and
+    the normalized system prompt (which embeds the categories and few-shot examples)
+    and input text.
+    """
+    payload = json.dumps([model, normalize_prompt_text(system_prompt), normalize_prompt_text(text)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    A persistent cache of parsed LLM extraction results, stored in MongoDB so it is
+    shared by all workers and survives restarts:
+
+        {"_id": <key>, "model": "phi3:mini", "result": {...},
+         "created_at": ..., "expires_at": ..., "last_used_at": ..., "hits": 3}
+
+    Entries expire `ttl_seconds` after they were written (MongoDB TTL index), and
+    once there are more than `max_entries` the least recently used ones are removed.
+    `max_entries=0` disables the cache. Entries of other models are dropped with
+    `invalidate_other_models` when the configured model changes.
+    """
+    def __init__(self, collection, ttl_seconds: float = 30 * 24 * 3600, max_entries: int = 100_000):
+        self._collection = collection
+        self._ttl = datetime.timedelta(seconds=ttl_seconds)
+        self._max_entries = max_entries
+        self._writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_entries > 0
+
+    def create_indexes(self):
+        self._collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+        self._collection.create_index([('last_used_at', ASCENDING)])
+        self._collection.create_index([('model', ASCENDING)])
+
+    def _record_lookup(self, hit: bool):
+        metrics.increment('llm_cache_hits_total' if hit else 'llm_cache_misses_total')
+        hits, misses = metrics.counter('llm_cache_hits_total'), metrics.counter('llm_cache_misses_total')
+        metrics.set_gauge('llm_cache_hit_rate', round(hits / (hits + misses), 4))
+
+    def get(self, model: str, system_prompt: str, text: str):
+        """Returns the cached result for this prompt, or None on a miss."""
+        if not self.enabled:
+            return None
+        now = datetime.datetime.utcnow()
+        try:
+            # The TTL monitor runs once a minute, so expired entries are also filtered here
+            record = self._collection.find_one_and_update(
+                {'_id': llm_cache_key(model, system_prompt, text), 'expires_at': {'$gt': now}},
+                {'$set': {'last_used_at': now}, '$inc': {'hits': 1}},
+                projection={'result': 1}
+            )
+        except Exception as e:
+            logger.warning(f"LLM cache read failed, calling the model instead: {e}")
+            return None
+        self._record_lookup(record is not None)
+        return record['result'] if record else None
+
+    def set(self, model: str, system_prompt: str, text: str, result: dict):
+        if not self.enabled:
+            return
+        now = datetime.datetime.utcnow()
+        try:
+            self._collection.replace_one(
+                {'_id': llm_cache_key(model, system_prompt, text)},
+                {'model': model, 'result': result, 'created_at': now,
+                 'expires_at': now + self._ttl, 'last_used_at': now, 'hits': 0},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another worker cached the same prompt at the same moment
+            return
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+            return
+        self._writes += 1
+        if self._writes % TRIM_EVERY == 0:
+            self.trim()
+
+    def trim(self) -> int:
+        """Removes the least recently used entries beyond `max_entries`; returns how many were removed."""
+        excess = self._collection.estimated_document_count() - self._max_entries
+        if excess <= 0:
+            return 0
+        oldest = [record['_id'] for record in
+                  self._collection.find({}, {'_id': 1}).sort('last_used_at', ASCENDING).limit(excess)]
+        removed = self._collection.delete_many({'_id': {'$in': oldest}}).deleted_count
+        metrics.increment('llm_cache_evictions_total', removed)
+        return removed
+
+    def invalidate_other_models(self, model: str) -> int:
+        """Drops the entries of every model but `model`; returns how many were removed."""
+        removed = self._collection.delete_many({'model': {'$ne': model}}).deleted_count
+        if removed:
+            logger.info(f"Removed {removed} cached LLM results of models other than '{model}'.")
+        metrics.increment('llm_cache_invalidations_total', removed)
+        return removed
@@ -0,0 +1,417 @@
+import time
+import uuid
+import asyncio
+import functools
+import random
+import logging
+import threading
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_community.chat_models import ChatOllama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often a worker waiting for a cluster-wide slot checks again
+GLOBAL_SLOT_POLL_SECONDS = 0.05
+
+# Timeout of a single health check request
+HEALTH_CHECK_TIMEOUT_SECONDS = 2
+
+# Circuit breaker states
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class EndpointUnavailableError(ConnectionError):
+    """Raised when no endpoint of the pool could serve a request."""
+
+
+class RedisSemaphore:
+    """
+    A semaphore shared by every process using the same Redis, so the API and all
+    Celery workers together keep at most `limit` requests in flight to one host.
+
+    Holders are members of a sorted set scored by acquisition time; a holder that
+    died without releasing its slot is dropped after `lease_seconds`.
+    """
+    def __init__(self, redis_client, name: str, limit: int, lease_seconds: float):
+        self._redis = redis_client
+        self._key = f"llm-slots:{name}"
+        self._limit = limit
+        self._lease_seconds = lease_seconds
+
+    def acquire(self) -> str:
+        token = uuid.uuid4().hex
+        while True:
+            now = time.time()
+            pipe = self._redis.pipeline()
+            pipe.zremrangebyscore(self._key, '-inf', now - self._lease_seconds)
+            pipe.zadd(self._key, {token: now})
+            pipe.zrank(self._key, token)
+            _, _, rank = pipe.execute()
+            if rank is not None and rank < self._limit:
+                return token
+            self._redis.zrem(self._key, token)
+            time.sleep(GLOBAL_SLOT_POLL_SECONDS)
+
+    def release(self, token: str):
+        self._redis.zrem(self._key, token)
+
+
+class OllamaEndpoint:
+    """
+    One Ollama host: a keep-alive HTTP session with a connection pool, a limit of
+    `max_concurrency` requests in flight from this process (plus, optionally, a
+    cluster-wide limit through a RedisSemaphore) and a circuit breaker.
+
+    Requests beyond the limit wait for a slot; the wait, the number of requests in
+    flight and the request latency are reported as metrics. After
+    `failure_threshold` consecutive failures the circuit opens and the endpoint
+    gets no traffic for `cooldown_seconds` (cut short by a successful health
+    check); then a single trial request decides whether it closes again.
+    """
+    def __init__(self, base_url: str, max_concurrency: int = 4, global_semaphore: RedisSemaphore = None,
+                 failure_threshold: int = 3, cooldown_seconds: float = 30):
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._global_semaphore = global_semaphore
+        self._failure_threshold = failure_threshold
+        self._cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        # Requests routed here that are waiting for a slot or in flight
+        self.outstanding = 0
+        self.in_flight = 0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._open_until = 0.0
+        self._trial_in_progress = False
+
+    # --- Circuit breaker ---
+
+    def is_routable(self, now: float) -> bool:
+        """True if the circuit lets a request through now (without claiming the half-open trial)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return now >= self._open_until
+        return not self._trial_in_progress
+
+    def _claim(self, now: float):
+        """Counts a request routed here; past an open circuit's cooldown it becomes the half-open trial."""
+        with self._lock:
+            self.outstanding += 1
+            if self.state == OPEN and now >= self._open_until:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                self._trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self._trial_in_progress = False
+            if self.state != CLOSED:
+                logger.info(f"Ollama endpoint {self.base_url} recovered; closing its circuit.")
+                self._set_state(CLOSED)
+
+    def record_failure(self, reason: str):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_progress = False
+            metrics.increment(f'llm_endpoint_failures_total:{self.base_url}')
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self._failure_threshold):
+                logger.warning(f"Opening the circuit of Ollama endpoint {self.base_url} for {self._cooldown_seconds}s "
+                               f"after {self.consecutive_failures} consecutive failures: {reason}")
+                self._set_state(OPEN)
+            if self.state == OPEN:
+                self._open_until = time.monotonic() + self._cooldown_seconds
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.set_gauge(f'llm_endpoint_up:{self.base_url}', 0 if state == OPEN else 1)
+
+    def check_health(self) -> bool:
+        """
+        Asks the host for its model list. A failure counts towards opening the circuit;
+        a success ends an open circuit's cooldown, so the next request is its trial.
+        """
+        try:
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+            healthy = response.status_code == 200
+            response.close()
+        except requests.RequestException as e:
+            healthy, response = False, e
+        if healthy:
+            with self._lock:
+                if self.state == OPEN:
+                    self._open_until = 0.0
+        else:
+            self.record_failure(f"health check: {response}")
+        return healthy
+
+    # --- Requests ---
+
+    def _acquire_slot(self):
+        started = time.perf_counter()
+        self._slots.acquire()
+        token = None
+        if self._global_semaphore is not None:
+            try:
+                token = self._global_semaphore.acquire()
+            except Exception:
+                self._slots.release()
+                raise
+        metrics.observe('llm_queue_wait_ms', (time.perf_counter() - started) * 1000)
+        with self._lock:
+            self.in_flight += 1
+            metrics.set_gauge(f'llm_in_flight:{self.base_url}', self.in_flight)
+        return token
+
+    def _release_slot(self, token):
+        with self._lock:
+            self.in_flight -= 1
+            self.outstanding -= 1
+            metrics.set_gauge(f'llm_in_flight:{self.base_url}', self.in_flight)
+        if token is not None:
+            self._global_semaphore.release(token)
+        self._slots.release()
+
+    def open_stream(self, path: str, headers: dict, payload: dict, timeout=None) -> Iterator[str]:
+        """
+        POSTs `payload` to `path` once a slot is free and checks the response status.
+        Returns an iterator over the lines of the streamed response; the slot is held
+        until it is exhausted or closed. Connection errors, 5xx and 404 responses
+        count as failures for the circuit breaker and are raised; a 200 response
+        counts as a success.
+        """
+        try:
+            token = self._acquire_slot()
+        except Exception:
+            with self._lock:
+                self.outstanding -= 1
+            raise
+        started = time.perf_counter()
+        try:
+            metrics.increment('llm_requests_total')
+            response = self.session.post(f"{self.base_url}{path}", headers=headers, json=payload,
+                                         stream=True, timeout=timeout)
+            response.encoding = 'utf-8'
+            if response.status_code == 404:
+                response.close()
+                raise OllamaEndpointNotFoundError(
+                    f"Ollama call failed with status code 404. Maybe the model '{payload.get('model')}' "
+                    f"is not pulled on {self.base_url}."
+                )
+            if response.status_code >= 500:
+                detail = response.text
+                response.close()
+                raise requests.HTTPError(f"Ollama call failed with status code {response.status_code}. Details: {detail}")
+            if response.status_code != 200:
+                detail = response.text
+                response.close()
+                raise ValueError(f"Ollama call failed with status code {response.status_code}. Details: {detail}")
+        except (requests.RequestException, OllamaEndpointNotFoundError) as e:
+            self.record_failure(str(e))
+            self._release_slot(token)
+            raise
+        except Exception:
+            self._release_slot(token)
+            raise
+        self.record_success()
+        return self._iter_lines(response, token, started)
+
+    def _iter_lines(self, response, token, started: float) -> Iterator[str]:
+        try:
+            yield from response.iter_lines(decode_unicode=True)
+        except requests.RequestException as e:
+            self.record_failure(str(e))
+            raise
+        else:
+            metrics.observe_histogram(f'llm_request_latency_ms:{self.base_url}', (time.perf_counter() - started) * 1000)
+        finally:
+            # Returns the connection to the pool
+            response.close()
+            self._release_slot(token)
+
+
+class OllamaEndpointPool:
+    """
+    Routes requests over several Ollama hosts serving the same models.
+
+    Each request goes to the routable endpoint (circuit not open) with the fewest
+    outstanding requests from this process, ties broken at random. If the request
+    fails before the response starts streaming (connection error, 5xx, model not
+    found), it fails over to the next best endpoint. A background thread checks the
+    health of every endpoint every `health_check_seconds` (0 disables it).
+    """
+    def __init__(self, endpoints: List[OllamaEndpoint], health_check_seconds: float = 0):
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+        self._health_check_seconds = health_check_seconds
+        self._health_thread = None
+        self._health_lock = threading.Lock()
+
+    def _choose(self, exclude) -> Optional[OllamaEndpoint]:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in exclude and endpoint.is_routable(now)]
+            if not candidates:
+                return None
+            fewest = min(endpoint.outstanding for endpoint in candidates)
+            endpoint = random.choice([endpoint for endpoint in candidates if endpoint.outstanding == fewest])
+            endpoint._claim(now)
+            return endpoint
+
+    def open_stream(self, path: str, headers: dict, payload: dict, timeout=None) -> Iterator[str]:
+        """Opens a streamed request on the best endpoint, failing over to the others."""
+        self._start_health_checks()
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self._choose(tried)
+            if endpoint is None:
+                break
+            tried.append(endpoint)
+            try:
+                return endpoint.open_stream(path, headers, payload, timeout=timeout)
+            except (requests.RequestException, OllamaEndpointNotFoundError) as e:
+                last_error = e
+                logger.warning(f"Ollama request to {endpoint.base_url} failed, trying another endpoint: {e}")
+                metrics.increment('llm_failovers_total')
+        if isinstance(last_error, OllamaEndpointNotFoundError):
+            raise last_error
+        raise EndpointUnavailableError(
+            f"No Ollama endpoint could serve the request (tried {[endpoint.base_url for endpoint in tried]}): {last_error}"
+        )
+
+    def _start_health_checks(self):
+        if self._health_check_seconds <= 0 or self._health_thread is not None:
+            return
+        with self._health_lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name='ollama-health', daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self._health_check_seconds)
+            for endpoint in self.endpoints:
+                # Endpoints serving traffic prove their health with it; idle and failing ones are probed
+                if endpoint.state != CLOSED or endpoint.outstanding == 0:
+                    endpoint.check_health()
+
+
+# Endpoints by base URL and pools by their URLs; every client of the same host shares its
+# session, limits and circuit breaker
+_endpoints = {}
+_pools = {}
+_registry_lock = threading.Lock()
+
+
+def get_endpoint(base_url: str, max_concurrency: int = 4, redis_url: str = None, global_max_concurrency: int = 0,
+                 lease_seconds: float = 300, failure_threshold: int = 3, cooldown_seconds: float = 30) -> OllamaEndpoint:
+    """
+    Returns the process-wide OllamaEndpoint for `base_url`, creating it on first use
+    with the given settings. With `redis_url` and `global_max_concurrency` set, the
+    host's requests are also limited across processes.
+    """
+    base_url = base_url.rstrip('/')
+    with _registry_lock:
+        endpoint = _endpoints.get(base_url)
+        if endpoint is None:
+            global_semaphore = None
+            if redis_url and global_max_concurrency > 0:
+                try:
+                    import redis
+                    global_semaphore = RedisSemaphore(
+                        redis.Redis.from_url(redis_url), base_url, global_max_concurrency, lease_seconds
+                    )
+                except ImportError:
+                    logger.warning("OLLAMA_GLOBAL_MAX_CONCURRENCY is set but the 'redis' package is not installed; "
+                                   "limiting concurrency per process only.")
+            endpoint = _endpoints[base_url] = OllamaEndpoint(
+                base_url, max_concurrency, global_semaphore, failure_threshold, cooldown_seconds
+            )
+            logger.info(f"Ollama endpoint {base_url}: up to {max_concurrency} concurrent requests per process"
+                        + (f", {global_max_concurrency} in total." if global_semaphore else "."))
+        return endpoint
+
+
+def get_endpoint_pool(base_urls: List[str], health_check_seconds: float = 0, **endpoint_settings) -> OllamaEndpointPool:
+    """Returns the process-wide pool over `base_urls`, creating it (and its endpoints) on first use."""
+    key = tuple(url.rstrip('/') for url in base_urls)
+    pool = _pools.get(key)
+    if pool is None:
+        endpoints = [get_endpoint(url, **endpoint_settings) for url in key]
+        with _registry_lock:
+            pool = _pools.setdefault(key, OllamaEndpointPool(endpoints, health_check_seconds))
+    return pool
+
+
+class PooledChatOllama(ChatOllama):
+    """
+    ChatOllama that sends its requests through the shared OllamaEndpointPool of
+    `base_urls` (or of its single `base_url`): pooled keep-alive connections,
+    bounded concurrency, least-outstanding routing and failover, instead of
+    opening a new connection with `requests.post` for every call.
+    """
+    base_urls: Optional[List[str]] = None
+
+    def _open_pooled_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None, **kwargs: Any) -> Iterator[str]:
+        """Builds the request like langchain-community's `_create_stream` (0.0.38) and sends it through the pool."""
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+        headers = {"Content-Type": "application/json", **(self.headers if isinstance(self.headers, dict) else {})}
+        # `api_url` is built on `base_url`; the pool sends the same path to the endpoint it picks
+        path = api_url[len(self.base_url):]
+        pool = get_endpoint_pool(self.base_urls or [self.base_url])
+        return pool.open_stream(path, headers, request_payload, timeout=self.timeout)
+
+    def _create_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None, **kwargs: Any) -> Iterator[str]:
+        return self._open_pooled_stream(api_url, payload, stop, **kwargs)
+
+    async def _acreate_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None,
+                              **kwargs: Any) -> AsyncIterator[str]:
+        """
+        The async calls (`ainvoke`, `astream`) go through the same pool: the blocking
+        stream is opened and read in the default executor, one line at a time.
+        """
+        loop = asyncio.get_running_loop()
+        lines = await loop.run_in_executor(None, functools.partial(self._open_pooled_stream, api_url, payload, stop, **kwargs))
+        try:
+            while True:
+                line = await loop.run_in_executor(None, next, lines, None)
+                if line is None:
+                    return
+                yield line
+        finally:
+            # Frees the endpoint slot if the caller stops reading early
+            await loop.run_in_executor(None, lines.close)
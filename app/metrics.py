@@ -0,0 +1,107 @@
+import bisect
+import threading
+
+
+class _Summary:
+    """Running count/sum/min/max of an observed value."""
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'avg': round(self.total / self.count, 3) if self.count else None,
+            'min': self.min,
+            'max': self.max
+        }
+
+
+# Default upper bounds (ms) of histogram buckets, suited to request latencies
+DEFAULT_LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+
+
+class _Histogram:
+    """Counts of observed values per bucket (upper bound inclusive), plus a summary."""
+    __slots__ = ('bounds', 'counts', 'summary')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.summary = _Summary()
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.summary.observe(value)
+
+    def as_dict(self):
+        buckets = {f"le_{bound}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets['le_inf'] = self.counts[-1]
+        return {**self.summary.as_dict(), 'buckets': buckets}
+
+
+class MetricsRegistry:
+    """
+    A minimal, thread-safe, in-process registry of counters, gauges, summaries and histograms.
+
+    Metrics are per process: each gunicorn worker and Celery child keeps its own.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+        self._histograms = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counter(self, name: str) -> float:
+        """Returns the current value of the counter `name` (0 if it was never incremented)."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = self._summaries[name] = _Summary()
+            summary.observe(value)
+
+    def observe_histogram(self, name: str, value: float, buckets=DEFAULT_LATENCY_BUCKETS_MS):
+        """Records `value` in the histogram `name`; its buckets are fixed by the first observation."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        """Returns a JSON-serializable copy of all metrics."""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'summaries': {name: summary.as_dict() for name, summary in self._summaries.items()},
+                'histograms': {name: histogram.as_dict() for name, histogram in self._histograms.items()}
+            }
+
+
+# The process-wide registry
+metrics = MetricsRegistry()
@@ -0,0 +1,86 @@
+import gc
+import os
+import time
+import logging
+from app.ai_models import init_embeddings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Encoded once after loading, so the first real request does not pay for lazy initialization
+WARM_UP_TEXT = "Invoice INV-00001: payment of 100.00 EUR is due within 30 days."
+
+# Torch's intra-op thread count before the warm-up limited it, restored in forked children
+_torch_threads = None
+
+
+def process_memory(pid='self') -> dict:
+    """
+    Returns the memory of a process in MB: `rss` (resident pages, shared ones counted in
+    full), `pss` (shared pages divided among the processes sharing them) and `uss`
+    (private pages). Reads /proc/<pid>/smaps_rollup, so it is empty outside Linux.
+    """
+    fields = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'uss', 'Private_Dirty': 'uss'}
+    memory = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    key = fields[name]
+                    memory[key] = memory.get(key, 0) + int(value.split()[0]) / 1024
+    except OSError:
+        return {}
+    return {key: round(value, 1) for key, value in memory.items()}
+
+
+def _limit_torch_threads():
+    """
+    Runs the warm-up single-threaded: forked children cannot use an OpenMP thread pool
+    the parent has started, and would hang on their first encode.
+    """
+    global _torch_threads
+    try:
+        import torch
+    except ImportError:
+        return
+    _torch_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+
+
+def preload_models(embeddings_model_name: str, warm_up: bool = True, forks: bool = True) -> dict:
+    """
+    Loads the embeddings model into this process before it forks its workers (Celery
+    `worker_init`, gunicorn `when_ready`), so the children share the weights copy-on-write
+    instead of each loading its own copy on their first request. With `warm_up`, one
+    text is encoded (single-threaded if the process `forks` afterwards). Afterwards the loaded objects are moved out of the garbage
+    collector's reach (`gc.freeze`), so collections in the children do not copy the
+    pages they live on. Returns the load time and the RSS before and after.
+    """
+    before = process_memory()
+    started = time.perf_counter()
+    if forks:
+        _limit_torch_threads()
+    embeddings = init_embeddings(embeddings_model_name)
+    if warm_up:
+        embeddings.embed_query(WARM_UP_TEXT)
+    seconds = time.perf_counter() - started
+    gc.collect()
+    gc.freeze()
+    after = process_memory()
+
+    metrics.set_gauge('model_preload_seconds', round(seconds, 3))
+    logger.info(f"Preloaded the embeddings model '{embeddings_model_name}' in {seconds:.2f}s "
+                f"(pid {os.getpid()}, RSS {before.get('rss')} -> {after.get('rss')} MB).")
+    return {'seconds': seconds, 'rss_before_mb': before.get('rss'), 'rss_after_mb': after.get('rss')}
+
+
+def after_fork():
+    """Runs in each forked child of a process that preloaded the models."""
+    if _torch_threads:
+        import torch
+        torch.set_num_threads(_torch_threads)
+    memory = process_memory()
+    if memory:
+        logger.info(f"Worker process {os.getpid()} started on preloaded models "
+                    f"(RSS {memory.get('rss')} MB, PSS {memory.get('pss')} MB, private {memory.get('uss')} MB).")
@@ -0,0 +1,62 @@
+import datetime
+import logging
+import numpy as np
+from bson.binary import Binary
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+
+def pack_embeddings(embeddings) -> dict:
+    """Packs a list of equally long vectors into float32 bytes (a quarter of a BSON array of doubles)."""
+    values = np.asarray(embeddings, dtype=np.float32)
+    return {'count': len(embeddings), 'data': Binary(values.astype('<f4').tobytes())}
+
+
+def unpack_embeddings(packed: dict) -> list:
+    if not packed['count']:
+        return []
+    return np.frombuffer(packed['data'], dtype='<f4').reshape(packed['count'], -1).tolist()
+
+
+class PipelineCheckpoints:
+    """
+    The outputs of the stages of document processing runs, so a stage that fails and
+    is retried (or is redelivered after a worker died) resumes from the outputs of the
+    stages before it instead of starting the document over:
+
+        {"_id": "<doc_id>:<run_id>:<stage>", "doc_id": ..., "run_id": ..., "stage": "extract",
+         "output": {...}, "created_at": ..., "expires_at": ...}
+
+    A run's checkpoints are removed once its result is saved; those of abandoned runs
+    expire after `ttl_seconds` (MongoDB TTL index).
+    """
+    def __init__(self, collection, ttl_seconds: float = 7 * 24 * 3600):
+        self._collection = collection
+        self._ttl = datetime.timedelta(seconds=ttl_seconds)
+
+    def create_indexes(self):
+        self._collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+        self._collection.create_index([('doc_id', ASCENDING), ('run_id', ASCENDING)])
+
+    @staticmethod
+    def _key(doc_id: str, run_id: str, stage: str) -> str:
+        return f"{doc_id}:{run_id}:{stage}"
+
+    def save(self, doc_id: str, run_id: str, stage: str, output: dict):
+        now = datetime.datetime.utcnow()
+        self._collection.replace_one(
+            {'_id': self._key(doc_id, run_id, stage)},
+            {'doc_id': doc_id, 'run_id': run_id, 'stage': stage, 'output': output,
+             'created_at': now, 'expires_at': now + self._ttl},
+            upsert=True
+        )
+
+    def load(self, doc_id: str, run_id: str, stage: str):
+        """Returns the checkpointed output of `stage`, or None if it has not completed."""
+        record = self._collection.find_one({'_id': self._key(doc_id, run_id, stage)}, {'output': 1})
+        return record['output'] if record else None
+
+    def clear(self, doc_id: str, run_id: str) -> int:
+        """Removes the checkpoints of one run; returns how many were removed."""
+        return self._collection.delete_many({'doc_id': doc_id, 'run_id': run_id}).deleted_count
@@ -0,0 +1,120 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Processing lanes and the Redis broker priority of their messages (0 is served first).
+# Single uploads and reprocess requests go to the interactive lane, bulk uploads to the
+# bulk lane, so an urgent document never waits behind a backfill.
+INTERACTIVE_LANE = 'interactive'
+BULK_LANE = 'bulk'
+LANE_PRIORITIES = OrderedDict([(INTERACTIVE_LANE, 0), (BULK_LANE, 9)])
+
+# Separator kombu puts between a queue name and its priority in the Redis key of a
+# priority lane, e.g. 'extract:9'. Messages of priority 0 stay in the plain 'extract' list.
+PRIORITY_SEPARATOR = ':'
+
+# --- Global Broker Client ---
+# Reads the lane depths straight from the Redis lists of the Celery broker.
+g_broker_redis = None
+broker_redis_lock = threading.Lock()
+
+
+def get_broker_redis(broker_url: str):
+    """Returns a global Redis client of the Celery broker, or None if the broker is not Redis."""
+    global g_broker_redis
+    if not broker_url.startswith(('redis://', 'rediss://')):
+        return None
+    with broker_redis_lock:
+        if g_broker_redis is None:
+            import redis
+            g_broker_redis = redis.Redis.from_url(broker_url, socket_timeout=2, socket_connect_timeout=2)
+    return g_broker_redis
+
+
+def broker_transport_options() -> dict:
+    """Redis transport options that keep one list per lane and serve them by priority."""
+    return {
+        'priority_steps': sorted(LANE_PRIORITIES.values()),
+        'sep': PRIORITY_SEPARATOR,
+        'queue_order_strategy': 'priority',
+    }
+
+
+def lane_priority(lane: str) -> int:
+    return LANE_PRIORITIES[lane]
+
+
+def lane_for_priority(priority) -> str:
+    """Returns the lane of a message priority; messages without one are interactive."""
+    for lane, lane_priority in reversed(LANE_PRIORITIES.items()):
+        if priority is not None and priority >= lane_priority:
+            return lane
+    return INTERACTIVE_LANE
+
+
+def lane_key(queue: str, lane: str) -> str:
+    """The Redis list holding the messages of `lane` on `queue`."""
+    priority = lane_priority(lane)
+    return f"{queue}{PRIORITY_SEPARATOR}{priority}" if priority else queue
+
+
+def fair_share(waiting: Dict[str, int], in_flight: Dict[str, int], max_in_flight: int,
+               max_per_batch: int) -> Dict[str, int]:
+    """
+    Decides how many waiting documents of each bulk batch to dispatch now.
+
+    At most `max_in_flight` bulk documents are in flight overall and `max_per_batch`
+    per batch. Free slots are handed out one at a time to the batches in turn, in the
+    order of `waiting` (oldest batch first), so a large backfill cannot starve a small
+    batch that arrives after it.
+    """
+    free = max_in_flight - sum(in_flight.values())
+    counts = {batch_id: 0 for batch_id in waiting}
+    while free > 0:
+        granted = False
+        for batch_id, count in waiting.items():
+            if free <= 0:
+                break
+            if counts[batch_id] < count and in_flight.get(batch_id, 0) + counts[batch_id] < max_per_batch:
+                counts[batch_id] += 1
+                free -= 1
+                granted = True
+        if not granted:
+            break
+    return {batch_id: count for batch_id, count in counts.items() if count}
+
+
+def lane_stats(redis_client, queues: List[str]) -> dict:
+    """
+    Reports, per lane and queue, the number of messages waiting in the broker and the
+    age of the oldest one (`oldest_wait_ms`), from the `enqueued_at` header stamped on
+    every task message when it is published.
+    """
+    now = time.time()
+    stats = {}
+    for lane in LANE_PRIORITIES:
+        keys = [lane_key(queue, lane) for queue in queues]
+        pipe = redis_client.pipeline()
+        for key in keys:
+            pipe.llen(key)
+            # Messages are pushed on the left and consumed from the right
+            pipe.lindex(key, -1)
+        replies = pipe.execute()
+        lane_queues = {}
+        for queue, depth, oldest in zip(queues, replies[0::2], replies[1::2]):
+            entry = {'depth': depth, 'oldest_wait_ms': None}
+            if oldest:
+                try:
+                    enqueued_at = json.loads(oldest)['headers'].get('enqueued_at')
+                except (ValueError, KeyError, TypeError):
+                    enqueued_at = None
+                if enqueued_at:
+                    entry['oldest_wait_ms'] = round((now - enqueued_at) * 1000, 1)
+            lane_queues[queue] = entry
+        stats[lane] = {'depth': sum(entry['depth'] for entry in lane_queues.values()), 'queues': lane_queues}
+    return stats
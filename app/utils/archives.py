@@ -0,0 +1,146 @@
+import os
+import logging
+import tarfile
+import zipfile
+import mimetypes
+import tempfile
+from typing import Iterator
+from werkzeug.datastructures import FileStorage
+
+logger = logging.getLogger(__name__)
+
+# Zip archives need random access, so the upload is spooled to disk past this size
+ZIP_SPOOL_MAX_MEMORY = 64 * 1024 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# The compression ratio limit only applies once this much has been unpacked, as the
+# headers of many tiny members (or a partly read gzip stream) skew the ratio of small amounts
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+ZIP_MIMETYPES = {'application/zip', 'application/x-zip-compressed'}
+TAR_MIMETYPES = {'application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-gtar'}
+
+
+class ArchiveLimitError(ValueError):
+    """Raised when an archive exceeds the member count, size or compression ratio limits."""
+
+
+class ArchiveLimits:
+    """
+    Limits on what an archive may unpack to, against zip and tar bombs: at most
+    `max_members` files and `max_bytes` uncompressed bytes in total, at a compression
+    ratio of at most `max_ratio`. Declared sizes are checked up front where the format
+    has them, and the bytes actually unpacked are counted as they stream out.
+    """
+    def __init__(self, max_members: int, max_bytes: int, max_ratio: float):
+        self.max_members = max_members
+        self.max_bytes = max_bytes
+        self.max_ratio = max_ratio
+        self.members = 0
+        self.unpacked = 0
+
+    def add_member(self):
+        self.members += 1
+        if self.members > self.max_members:
+            raise ArchiveLimitError(f"Archive has more than {self.max_members} files")
+
+    def check_declared(self, name: str, declared_size: int, compressed_size: int = None):
+        """Checks the uncompressed (and, for zip members, compressed) size an archive declares for a member."""
+        if declared_size > self.max_bytes:
+            raise ArchiveLimitError(f"'{name}' unpacks to more than {self.max_bytes} bytes")
+        if compressed_size is not None and declared_size > RATIO_CHECK_MIN_BYTES \
+                and declared_size > self.max_ratio * max(compressed_size, 1):
+            raise ArchiveLimitError(f"'{name}' has a compression ratio above {self.max_ratio}")
+
+    def add_bytes(self, count: int, compressed_total: int):
+        self.unpacked += count
+        if self.unpacked > self.max_bytes:
+            raise ArchiveLimitError(f"Archive unpacks to more than {self.max_bytes} bytes")
+        if self.unpacked > RATIO_CHECK_MIN_BYTES and self.unpacked > self.max_ratio * max(compressed_total, 1):
+            raise ArchiveLimitError(f"Archive has a compression ratio above {self.max_ratio}")
+
+
+class _CountingReader:
+    """Wraps a binary stream and counts the bytes read from it."""
+    def __init__(self, stream):
+        self._stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.count += len(data)
+        return data
+
+
+class _LimitedMemberStream:
+    """Counts the bytes read from an archive member against the archive's limits."""
+    def __init__(self, stream, limits: ArchiveLimits, compressed_total):
+        self._stream = stream
+        self._limits = limits
+        self._compressed_total = compressed_total
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._limits.add_bytes(len(data), self._compressed_total())
+        return data
+
+
+def archive_kind(mimetype: str, filename: str = '') -> str:
+    """Returns 'zip' or 'tar' for an archive upload, or None if it is not one."""
+    name = (filename or '').lower()
+    if mimetype in ZIP_MIMETYPES or name.endswith('.zip'):
+        return 'zip'
+    if mimetype in TAR_MIMETYPES or name.endswith(('.tar', '.tar.gz', '.tgz')):
+        return 'tar'
+    return None
+
+
+def _member_file(name: str, stream) -> FileStorage:
+    filename = os.path.basename(name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return FileStorage(stream=stream, filename=filename, content_type=content_type)
+
+
+def iter_archive_files(stream, kind: str, limits: ArchiveLimits) -> Iterator[FileStorage]:
+    """
+    Yields every regular file in a zip or (optionally compressed) tar archive read
+    from `stream`, as a FileStorage named after the member's base name.
+
+    Tar archives are unpacked while the upload streams in; each yielded file must be
+    consumed before the next one is requested. Zip archives keep their index at the
+    end, so they are first spooled to a temporary file. Raises ArchiveLimitError,
+    while iterating or reading a member, once the archive exceeds `limits`.
+    """
+    if kind == 'tar':
+        counting = _CountingReader(stream)
+        with tarfile.open(fileobj=counting, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    # A tar member's size is exact; the ratio is checked against the bytes read so far
+                    limits.add_member()
+                    limits.check_declared(member.name, member.size)
+                    member_stream = _LimitedMemberStream(archive.extractfile(member), limits, lambda: counting.count)
+                    yield _member_file(member.name, member_stream)
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_MEMORY) as spool:
+        while True:
+            chunk = stream.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            spool.write(chunk)
+        archive_size = spool.tell()
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir()]
+            # The central directory declares every member's size, so a bomb is refused before unpacking
+            if len(members) > limits.max_members:
+                raise ArchiveLimitError(f"Archive has more than {limits.max_members} files")
+            for info in members:
+                limits.check_declared(info.filename, info.file_size, info.compress_size)
+            if sum(info.file_size for info in members) > limits.max_bytes:
+                raise ArchiveLimitError(f"Archive unpacks to more than {limits.max_bytes} bytes")
+            for info in members:
+                limits.add_member()
+                with archive.open(info) as member_stream:
+                    yield _member_file(info.filename, _LimitedMemberStream(member_stream, limits, lambda: archive_size))
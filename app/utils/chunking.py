@@ -0,0 +1,100 @@
+import bisect
+import logging
+from typing import List, NamedTuple, Optional
+from .doc_utils import join_segments
+
+logger = logging.getLogger(__name__)
+
+# Fallback break points inside a segment, from strongest to weakest
+_BREAK_SEQUENCES = ["\n\n", "\n", ". ", " "]
+
+
+class TextChunk(NamedTuple):
+    """
+    A retrieval-sized slice of a document's text.
+
+    `start`/`end` are character offsets into the joined document text, and
+    `segment_kind`, `first_segment`/`last_segment` and `sheet_name` locate the chunk
+    in terms of the TextSegments (pages, paragraphs, sheets) it was cut from.
+    """
+    index: int
+    text: str
+    start: int
+    end: int
+    segment_kind: Optional[str]
+    first_segment: Optional[int]
+    last_segment: Optional[int]
+    sheet_name: Optional[str]
+
+
+def _find_break(text, segment_ends, start, limit):
+    """
+    Picks where a chunk starting at `start` should end, at most at `limit`.
+    Segment boundaries are preferred, then paragraph, line, sentence and word breaks,
+    as long as the chunk stays at least half full.
+    """
+    floor = start + (limit - start) // 2
+    i = bisect.bisect_right(segment_ends, limit) - 1
+    if i >= 0 and segment_ends[i] > floor:
+        return segment_ends[i]
+    for sequence in _BREAK_SEQUENCES:
+        cut = text.rfind(sequence, floor, limit)
+        if cut != -1:
+            return cut + len(sequence)
+    return limit
+
+
+def chunk_segments(segments, chunk_size: int = 1000, chunk_overlap: int = 150) -> List[TextChunk]:
+    """
+    Splits extracted TextSegments into chunks of at most `chunk_size` characters,
+    cutting on page/paragraph/sheet boundaries where possible. Consecutive chunks
+    share up to `chunk_overlap` characters of context, starting on a word boundary.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size.")
+
+    segments = list(segments)
+    text = join_segments(segments)
+    segment_starts = [segment.start for segment in segments]
+    segment_ends = [segment.end for segment in segments]
+
+    chunks = []
+    position = 0
+    while position < len(text):
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            break
+
+        limit = position + chunk_size
+        end = len(text) if limit >= len(text) else _find_break(text, segment_ends, position, limit)
+        chunk_end = end
+        while chunk_end > position and text[chunk_end - 1].isspace():
+            chunk_end -= 1
+
+        first = bisect.bisect_right(segment_ends, position)
+        last = bisect.bisect_left(segment_starts, chunk_end) - 1
+        first_segment = segments[first] if first < len(segments) else None
+        last_segment = segments[last] if last >= 0 else None
+        chunks.append(TextChunk(
+            index=len(chunks),
+            text=text[position:chunk_end],
+            start=position,
+            end=chunk_end,
+            segment_kind=first_segment.kind if first_segment else None,
+            first_segment=first_segment.index if first_segment else None,
+            last_segment=last_segment.index if last_segment else None,
+            sheet_name=first_segment.name if first_segment else None
+        ))
+
+        if end >= len(text):
+            break
+        # Step back for the overlap, but never restart mid-word or fail to advance
+        next_position = max(end - chunk_overlap, position + 1)
+        if next_position < end:
+            space = text.find(" ", next_position, end)
+            next_position = space + 1 if space != -1 else end
+        position = next_position
+
+    logger.info(f"Split {len(text)} characters into {len(chunks)} chunks.")
+    return chunks
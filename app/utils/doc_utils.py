@@ -1,90 +1,193 @@
 import io
+import codecs
 import json
+import time
 import logging
 import openpyxl
 import docx
-import os
+from typing import Iterator, NamedTuple, Optional
 from PyPDF2 import PdfReader
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from .pdf_extraction import iter_pdf_pages_parallel, parallel_extraction_available
+from .prompt_builder import (PromptBudget, estimate_tokens, format_categories, format_examples, split_text,
+                             merge_extractions)
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.chat_models import ChatOllama
+from app.ai_models import get_llm
+from app.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-# --- Text Extraction Functions ---
+# Segments are joined with this separator to form the full document text
+SEGMENT_SEPARATOR = "\n"
+# Number of spreadsheet rows grouped into a single 'sheet' segment
+XLSX_ROWS_PER_SEGMENT = 500
+# Number of bytes of plain text decoded per 'text' segment
+TEXT_BLOCK_SIZE = 64 * 1024
 
-def get_doc_text(file_content, content_type):
+
+class TextExtractionError(ValueError):
+    """Raised when a document's text cannot be extracted, e.g. because the file is corrupt."""
+
+
+class TextSegment(NamedTuple):
     """
-    Extracts text from a document's byte content based on its MIME type.
+    A piece of extracted text together with its position in the document.
+
+    `kind` is 'page', 'paragraph', 'sheet' or 'text', and `index` counts segments
+    of that kind from zero. `name` is the sheet name for spreadsheets.
+    `start`/`end` are character offsets into the joined document text.
     """
-    logger.info(f"Extracting text for content type: {content_type}")
-    text = ""
+    kind: str
+    index: int
+    name: Optional[str]
+    text: str
+    start: int
+    end: int
+
+# --- Text Extraction Functions ---
+
+def _iter_pdf_segments(file_stream, pdf_workers=0, pdf_parallel_threshold=0):
+    reader = PdfReader(file_stream)
+    page_count = len(reader.pages)
+    next_page = 0
+
+    if pdf_workers > 1 and page_count >= pdf_parallel_threshold and parallel_extraction_available():
+        logger.info(f"Extracting {page_count} PDF pages across {pdf_workers} processes.")
+        try:
+            for page_text in iter_pdf_pages_parallel(file_stream, page_count, pdf_workers):
+                yield 'page', next_page, None, page_text
+                next_page += 1
+        except BrokenProcessPool as e:
+            logger.warning(f"Parallel PDF extraction failed at page {next_page}, continuing serially: {e}")
+
+    for page_number in range(next_page, page_count):
+        yield 'page', page_number, None, reader.pages[page_number].extract_text() or ""
+
+def _iter_docx_segments(file_stream):
+    doc = docx.Document(file_stream)
+    for para_number, para in enumerate(doc.paragraphs):
+        yield 'paragraph', para_number, None, para.text
+
+def _iter_xlsx_segments(file_stream):
+    # read_only mode streams rows from the archive instead of building the whole workbook
+    workbook = openpyxl.load_workbook(file_stream, read_only=True, data_only=True)
     try:
-        file_stream = io.BytesIO(file_content)
-        
-        if "pdf" in content_type:
-            reader = PdfReader(file_stream)
-            for page in reader.pages:
-                text += page.extract_text() or ""
-        elif "vnd.openxmlformats-officedocument.wordprocessingml.document" in content_type: # .docx
-            doc = docx.Document(file_stream)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-        elif "vnd.openxmlformats-officedocument.spreadsheetml.sheet" in content_type: # .xlsx
-            workbook = openpyxl.load_workbook(file_stream)
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                for row in sheet.iter_rows():
-                    for cell in row:
-                        if cell.value:
-                            text += str(cell.value) + " "
-                    text += "\n"
-        elif "text" in content_type:
-            text = file_content.decode('utf-8', errors='ignore')
-        else:
+        block_number = 0
+        for sheet in workbook.worksheets:
+            rows = []
+            for row in sheet.iter_rows(values_only=True):
+                rows.append(" ".join(str(value) for value in row if value))
+                if len(rows) == XLSX_ROWS_PER_SEGMENT:
+                    yield 'sheet', block_number, sheet.title, "\n".join(rows)
+                    block_number += 1
+                    rows = []
+            if rows:
+                yield 'sheet', block_number, sheet.title, "\n".join(rows)
+                block_number += 1
+    finally:
+        workbook.close()
+
+def _iter_plain_text_segments(file_stream):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    block_number = 0
+    pending = ""
+    while True:
+        raw = file_stream.read(TEXT_BLOCK_SIZE)
+        pending += decoder.decode(raw, final=not raw)
+        if not raw:
+            break
+        # Cut blocks at the last line break so lines are never split across segments
+        cut = pending.rfind("\n")
+        if cut != -1:
+            yield 'text', block_number, None, pending[:cut]
+            block_number += 1
+            pending = pending[cut + 1:]
+    if pending:
+        yield 'text', block_number, None, pending
+
+def iter_doc_segments(file_content, content_type, pdf_workers=0, pdf_parallel_threshold=0) -> Iterator[TextSegment]:
+    """
+    Lazily extracts text from a document as a sequence of TextSegments
+    (PDF pages, DOCX paragraphs, blocks of spreadsheet rows or plain-text blocks).
+
+    `file_content` may be bytes or a seekable binary stream such as a GridFS file.
+    Only one segment is materialised at a time, so memory stays bounded
+    regardless of the document size. Empty segments are skipped.
+
+    PDFs with at least `pdf_parallel_threshold` pages are split across a pool of
+    `pdf_workers` processes when `pdf_workers` is greater than one.
+
+    Raises TextExtractionError if extraction fails partway, so a truncated text is
+    never mistaken for the whole document.
+    """
+    logger.info(f"Extracting text segments for content type: {content_type}")
+    file_stream = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+
+    if "pdf" in content_type:
+        raw_segments = _iter_pdf_segments(file_stream, pdf_workers, pdf_parallel_threshold)
+    elif "vnd.openxmlformats-officedocument.wordprocessingml.document" in content_type: # .docx
+        raw_segments = _iter_docx_segments(file_stream)
+    elif "vnd.openxmlformats-officedocument.spreadsheetml.sheet" in content_type: # .xlsx
+        raw_segments = _iter_xlsx_segments(file_stream)
+    else:
+        if "text" not in content_type:
             logger.warning(f"Unsupported content type for text extraction: {content_type}. Trying plain text decode.")
-            text = file_content.decode('utf-8', errors='ignore')
+        raw_segments = _iter_plain_text_segments(file_stream)
 
+    offset = 0
+    try:
+        for kind, index, name, text in raw_segments:
+            text = text.strip()
+            if not text:
+                continue
+            if offset:
+                offset += len(SEGMENT_SEPARATOR)
+            yield TextSegment(kind, index, name, text, offset, offset + len(text))
+            offset += len(text)
     except Exception as e:
         logger.error(f"Error extracting text for content_type {content_type}: {e}", exc_info=True)
-        return "" 
+        raise TextExtractionError(f"Could not extract the text of the {content_type} document: {e}") from e
 
-    if not text.strip():
+    if not offset:
         logger.warning(f"Could not extract any text for content_type: {content_type}")
 
-    return text.strip()
-
-
-# --- AI-Powered Extraction Functions ---
+def join_segments(segments) -> str:
+    """Joins TextSegments into the full document text, matching their offsets."""
+    return SEGMENT_SEPARATOR.join(segment.text for segment in segments)
 
-def get_kvps_and_category(text: str, examples: list = []):
+def get_doc_text(file_content, content_type):
     """
-    Extracts Key-Value Pairs (KVPs) and determines a category from the text,
-    guided by provided examples.
+    Extracts the full text from a document's byte content based on its MIME type.
+    Returns an empty string if the text cannot be extracted.
     """
-    logger.info("Initializing local LLM call to extract KVPs and category.")
+    try:
+        return join_segments(iter_doc_segments(file_content, content_type))
+    except TextExtractionError:
+        return ""
 
-    if not text or not text.strip():
-        logger.warning("Input text is empty. Skipping LLM call.")
-        return {}, None
 
-    # --- Construct the System Prompt ---
+# --- AI-Powered Extraction Functions ---
+
+def _extraction_system_prompt(categories_str: str = '', examples_str: str = '', part: tuple = None) -> str:
+    """Builds the system prompt of a KVP/category extraction call; `part` is (number, count) for a map step."""
     system_prompt = """You are an expert document analysis AI. Your task is to analyze the user's document text and perform two actions:
 1.  **Categorize the Document**: Classify the document into a relevant category.
 2.  **Extract Key-Value Pairs (KVPs)**: Identify and extract important information from the document as key-value pairs.
 
 You MUST return the output as a single, valid JSON object with two keys: 'category' and 'kvps'. The 'kvps' value must be a JSON object itself. Do not provide any other text, explanation, or markdown formatting."""
 
+    system_prompt += categories_str
+
     # --- Inject Fine-Tuning Examples into the Prompt ---
-    if examples:
-        example_str = "\n\nHere are some examples of how to categorize documents correctly:\n"
-        for ex in examples:
-            # We truncate the example text to keep the prompt concise
-            truncated_text = (ex['text'][:200] + '...') if len(ex['text']) > 200 else ex['text']
-            example_str += f"- Document text starting with: '{truncated_text}' should be categorized as '{ex['category']}'.\n"
-        
-        system_prompt += example_str
-    
+    system_prompt += examples_str
+
+    if part:
+        system_prompt += (f"\n\nThe document is too long to be analyzed at once; you are given part {part[0]} of {part[1]}. "
+                          "Only extract key-value pairs that appear in this part.")
+
     system_prompt += """\n\nNow, analyze the following document. Remember to only return the final JSON object.
 
 Example output format:
@@ -96,23 +199,15 @@ Example output format:
     "total_amount": "500.00"
   }
 }"""
+    return system_prompt
 
-    # --- LLM and Prompt Configuration ---
-
-    try:
-        # Connect to the local LLM using Ollama
-        llm = ChatOllama(
-            base_url=os.environ.get("OLLAMA_BASE_URL"),
-            model=os.environ.get("CHAT_MODEL_NAME", "phi3:mini"),
-            temperature=0
-        )
-    except Exception as e:
-        logger.error(f"Failed to initialize the Ollama LLM. Ensure Ollama is running and accessible. Error: {e}", exc_info=True)
-        raise ConnectionError("Could not connect to the local AI model via Ollama.") from e
 
+def _invoke_extraction(llm, system_prompt: str, text: str):
+    """Runs one extraction call and parses its JSON output into (kvps, category)."""
     prompt = ChatPromptTemplate.from_messages(
         [
-            ("system", system_prompt),
+            # Braces in the prompt (the JSON example, category names, example texts) are literal text
+            ("system", system_prompt.replace("{", "{{").replace("}", "}}")),
             ("user", "{input_text}"),
         ]
     )
@@ -121,6 +216,7 @@ Example output format:
 
     # --- Invoke the Chain and Parse the Output ---
     logger.info("Invoking local LLM chain for analysis...")
+    llm_response = None
     try:
         llm_response = chain.invoke({"input_text": text})
         logger.debug(f"Raw LLM response: {llm_response}")
@@ -137,8 +233,6 @@ Example output format:
         if not isinstance(kvps, dict):
             logger.warning("LLM output for 'kvps' was not a dictionary. Defaulting to empty.")
             kvps = {}
-
-        logger.info(f"LLM analysis successful. Suggested Category='{category}'.")
         return kvps, category
 
     except json.JSONDecodeError as e:
@@ -147,4 +241,95 @@ Example output format:
         raise ValueError("LLM returned malformed JSON.") from e
     except Exception as e:
         logger.error(f"An unexpected error occurred during LLM chain invocation: {e}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+
+
+def _map_reduce_extraction(llm, text: str, categories_str: str, examples_str: str, budget: PromptBudget,
+                           max_parts: int, workers: int):
+    """
+    Extracts KVPs and a category from a document too long for one call: the text is
+    split into parts that fit the budget, each part is analyzed in parallel, and the
+    results are merged by a weighted vote.
+    """
+    # The part note adds a few tokens; size the parts for the longest one
+    part_tokens = budget.input_tokens(_extraction_system_prompt(categories_str, examples_str, (max_parts, max_parts)))
+    parts = split_text(text, part_tokens)
+    if len(parts) > max_parts:
+        logger.warning(f"Document needs {len(parts)} parts of {part_tokens} tokens; only the first {max_parts} are analyzed.")
+        parts = parts[:max_parts]
+    logger.info(f"Document exceeds the LLM context; extracting from {len(parts)} parts in parallel.")
+    metrics.increment('llm_map_reduce_total')
+    metrics.observe('llm_map_reduce_parts', len(parts))
+
+    def extract(numbered_part):
+        number, part = numbered_part
+        return _invoke_extraction(llm, _extraction_system_prompt(categories_str, examples_str, (number, len(parts))), part)
+
+    results, weights = [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(parts)))) as executor:
+        futures = [executor.submit(extract, numbered_part) for numbered_part in enumerate(parts, 1)]
+        for part, future in zip(parts, futures):
+            try:
+                results.append(future.result())
+                weights.append(estimate_tokens(part))
+            except ValueError as e:
+                # One unreadable part should not fail the whole document
+                logger.warning(f"Skipping a document part whose analysis failed: {e}")
+    if not results:
+        raise ValueError("LLM analysis failed for every part of the document.")
+    return merge_extractions(results, weights)
+
+
+def get_kvps_and_category(text: str, examples: list = [], categories: list = None, cache=None, refresh_cache: bool = False,
+                          budget: PromptBudget = None):
+    """
+    Extracts Key-Value Pairs (KVPs) and determines a category from the text,
+    guided by provided examples and, if given, the list of known categories.
+
+    The prompt is built within a token budget (LLM_CONTEXT_TOKENS by default):
+    few-shot examples are shortened or dropped to fit LLM_EXAMPLE_TOKENS, known
+    categories beyond LLM_CATEGORY_TOKENS are left out, and a text too long for
+    one call is analyzed in parts whose results are merged. A budget that leaves
+    the text fewer than MIN_INPUT_TOKENS raises ValueError.
+
+    With an LLMResponseCache as `cache`, a cached result for the same model, prompt
+    and text is returned without calling the LLM, and new results are cached.
+    `refresh_cache` skips the lookup but still caches the new result.
+    """
+    logger.info("Initializing local LLM call to extract KVPs and category.")
+
+    if not text or not text.strip():
+        logger.warning("Input text is empty. Skipping LLM call.")
+        return {}, None
+
+    config = current_app.config
+    budget = budget or PromptBudget.from_config(config)
+    categories_str = format_categories(categories, budget.category_tokens)
+    examples_str = format_examples(examples, budget.example_tokens)
+    system_prompt = _extraction_system_prompt(categories_str, examples_str)
+    # Fails before the LLM is called when the budget leaves too little room for the text
+    input_tokens = budget.input_tokens(system_prompt)
+
+    # The shared client reuses pooled connections and honours the Ollama concurrency limits
+    llm = get_llm()
+    model_name = llm.model
+    if cache is not None and not refresh_cache:
+        cached = cache.get(model_name, system_prompt, text)
+        if cached is not None:
+            logger.info(f"Using cached LLM analysis. Suggested Category='{cached.get('category')}'.")
+            return cached.get("kvps", {}), cached.get("category")
+
+    started = time.perf_counter()
+    if estimate_tokens(text) <= input_tokens:
+        kvps, category = _invoke_extraction(llm, system_prompt, text)
+    else:
+        kvps, category = _map_reduce_extraction(
+            llm, text, categories_str, examples_str, budget,
+            max_parts=config['LLM_MAP_REDUCE_MAX_PARTS'], workers=config['LLM_MAP_REDUCE_WORKERS']
+        )
+    metrics.observe('llm_extraction_latency_ms', (time.perf_counter() - started) * 1000)
+
+    logger.info(f"LLM analysis successful. Suggested Category='{category}'.")
+    if cache is not None:
+        cache.set(model_name, system_prompt, text, {"kvps": kvps, "category": category})
+    return kvps, category
@@ -0,0 +1,62 @@
+import struct
+import numpy as np
+from bson.binary import Binary
+
+# User-defined BSON binary subtypes (0x80-0xFF) for packed embeddings
+FLOAT16_SUBTYPE = 0x80
+INT8_SUBTYPE = 0x81
+
+# int8 embeddings are prefixed with their little-endian float32 scale factor
+_SCALE = struct.Struct('<f')
+
+STORAGE_FORMATS = ('float32', 'float16', 'int8')
+
+
+def encode_embedding(vector, storage_format: str = 'float32'):
+    """
+    Encodes an embedding for storage in MongoDB.
+
+    'float32' keeps the plain BSON array of doubles (required by Atlas $vectorSearch).
+    'float16' packs the vector into a half-precision bson.Binary (4x smaller).
+    'int8' quantizes it symmetrically to int8 with a per-vector scale factor (8x smaller).
+    """
+    if vector is None:
+        return None
+    if storage_format == 'float32':
+        return [float(value) for value in vector]
+
+    values = np.asarray(vector, dtype=np.float32)
+    if storage_format == 'float16':
+        return Binary(values.astype('<f2').tobytes(), FLOAT16_SUBTYPE)
+    if storage_format == 'int8':
+        peak = float(np.max(np.abs(values))) if values.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        quantized = np.clip(np.rint(values / scale), -127, 127).astype(np.int8)
+        return Binary(_SCALE.pack(scale) + quantized.tobytes(), INT8_SUBTYPE)
+    raise ValueError(f"Unknown embedding storage format '{storage_format}'.")
+
+
+def decode_embedding(value) -> np.ndarray:
+    """
+    Decodes a stored embedding into a NumPy vector.
+
+    Packed float16 embeddings are viewed in place over the BSON bytes (no copy);
+    int8 embeddings are viewed in place and then multiplied by their scale factor.
+    """
+    if value is None:
+        return None
+    if isinstance(value, Binary):
+        if value.subtype == FLOAT16_SUBTYPE:
+            return np.frombuffer(value, dtype='<f2')
+        if value.subtype == INT8_SUBTYPE:
+            scale, = _SCALE.unpack_from(value)
+            return np.frombuffer(value, dtype=np.int8, offset=_SCALE.size) * np.float32(scale)
+        raise ValueError(f"Unknown embedding binary subtype {value.subtype}.")
+    return np.asarray(value, dtype=np.float32)
+
+
+def embedding_format(value) -> str:
+    """Returns the storage format of a stored embedding."""
+    if isinstance(value, Binary):
+        return 'float16' if value.subtype == FLOAT16_SUBTYPE else 'int8'
+    return 'float32'
@@ -0,0 +1,108 @@
+import os
+import math
+import shutil
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PyPDF2 import PdfReader
+
+logger = logging.getLogger(__name__)
+
+# Each worker process gets roughly this many page ranges, so a slow range
+# (e.g. a page full of vector graphics) does not leave the other workers idle.
+RANGES_PER_WORKER = 4
+
+# --- Globals for the extraction pool ---
+# The pool is created lazily, once per process, and reused across documents.
+g_pdf_executor = None
+g_pdf_executor_workers = 0
+pdf_executor_lock = threading.Lock()
+# Whether this process may start the pool, checked once per process (pid -> bool)
+g_pool_allowed = {}
+
+
+def parallel_extraction_available() -> bool:
+    """
+    False in daemonic processes, such as the children of a prefork Celery worker, which
+    are not allowed to start child processes; parallel extraction needs a non-forking
+    worker pool (`--pool threads` or `solo`) or the API process.
+    """
+    pid = os.getpid()
+    allowed = g_pool_allowed.get(pid)
+    if allowed is None:
+        allowed = g_pool_allowed[pid] = not multiprocessing.current_process().daemon
+        if not allowed:
+            logger.warning("PDF_EXTRACTION_WORKERS is set, but this is a daemonic process (e.g. a prefork "
+                           "Celery child) that cannot start a process pool; PDFs are extracted serially.")
+    return allowed
+
+
+def get_pdf_executor(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Provides a process-wide pool for PDF page extraction, recreating it
+    if the requested number of workers changes.
+    """
+    global g_pdf_executor, g_pdf_executor_workers
+    with pdf_executor_lock:
+        if g_pdf_executor is None or g_pdf_executor_workers != max_workers:
+            if g_pdf_executor is not None:
+                g_pdf_executor.shutdown(wait=False)
+            logger.info(f"Starting PDF extraction pool with {max_workers} processes.")
+            g_pdf_executor = ProcessPoolExecutor(max_workers=max_workers)
+            g_pdf_executor_workers = max_workers
+    return g_pdf_executor
+
+
+def _discard_pdf_executor():
+    global g_pdf_executor
+    with pdf_executor_lock:
+        if g_pdf_executor is not None:
+            g_pdf_executor.shutdown(wait=False)
+        g_pdf_executor = None
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> list:
+    """Runs in a pool process: extracts the text of pages [start, stop) of the PDF at `path`."""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def split_page_range(page_count: int, max_workers: int) -> list:
+    """Splits [0, page_count) into contiguous (start, stop) ranges for the pool."""
+    range_size = max(1, math.ceil(page_count / (max_workers * RANGES_PER_WORKER)))
+    return [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+
+
+def iter_pdf_pages_parallel(file_stream, page_count: int, max_workers: int):
+    """
+    Extracts the pages of a PDF across a process pool and yields their text in page order.
+
+    The stream is spooled to a temporary file once so that each pool process can
+    open the PDF itself instead of receiving the whole file through a pipe.
+    Raises BrokenProcessPool if the pool cannot be used; the caller falls back to serial extraction.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as spool:
+        file_stream.seek(0)
+        shutil.copyfileobj(file_stream, spool)
+        spool.flush()
+
+        ranges = split_page_range(page_count, max_workers)
+        executor = get_pdf_executor(max_workers)
+        try:
+            futures = [executor.submit(_extract_page_range, spool.name, start, stop) for start, stop in ranges]
+        except (BrokenProcessPool, RuntimeError, AssertionError) as e:
+            # e.g. a daemonic Celery child that is not allowed to fork
+            _discard_pdf_executor()
+            raise BrokenProcessPool(f"PDF extraction pool is unavailable: {e}") from e
+
+        # Results are consumed in submission order, which keeps pages in order
+        for future in futures:
+            try:
+                page_texts = future.result()
+            except BrokenProcessPool:
+                _discard_pdf_executor()
+                raise
+            yield from page_texts
@@ -0,0 +1,172 @@
+import re
+import json
+import math
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+# Rough characters per token of English text for Llama/Phi-style tokenizers. Token counts
+# are estimated from it rather than with the model's own tokenizer, which Ollama does not
+# expose; budgets should keep some headroom.
+CHARS_PER_TOKEN = 3.5
+
+# Lengths (characters) tried for each few-shot example text, longest first
+EXAMPLE_TEXT_LENGTHS = (200, 100, 50)
+
+# Fewest tokens a call must leave for the document text; a smaller budget would split a
+# document into parts too small to analyze, so the extraction fails instead
+MIN_INPUT_TOKENS = 256
+
+# Fallback break points when splitting text, from strongest to weakest
+_BREAK_SEQUENCES = ["\n\n", "\n", ". ", " "]
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens of `text`."""
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+
+class PromptBudget(NamedTuple):
+    """
+    Token budget of one extraction call: the model's context window, the part of it
+    reserved for the response, and the most the few-shot examples and the list of
+    known categories may take.
+    """
+    context_tokens: int = 4096
+    response_tokens: int = 768
+    example_tokens: int = 512
+    category_tokens: int = 256
+
+    @classmethod
+    def from_config(cls, config) -> 'PromptBudget':
+        return cls(
+            context_tokens=config['LLM_CONTEXT_TOKENS'],
+            response_tokens=config['LLM_RESPONSE_TOKENS'],
+            example_tokens=config['LLM_EXAMPLE_TOKENS'],
+            category_tokens=config['LLM_CATEGORY_TOKENS']
+        )
+
+    def input_tokens(self, system_prompt: str) -> int:
+        """
+        Tokens left for the document text next to `system_prompt`. Raises ValueError when
+        fewer than MIN_INPUT_TOKENS are left, i.e. the budget is misconfigured.
+        """
+        tokens = self.context_tokens - self.response_tokens - estimate_tokens(system_prompt)
+        if tokens < MIN_INPUT_TOKENS:
+            raise ValueError(
+                f"Only {tokens} tokens of the {self.context_tokens}-token context are left for the document text "
+                f"(at least {MIN_INPUT_TOKENS} are needed); raise LLM_CONTEXT_TOKENS or lower LLM_RESPONSE_TOKENS, "
+                f"LLM_EXAMPLE_TOKENS or LLM_CATEGORY_TOKENS."
+            )
+        return tokens
+
+
+def format_categories(categories: list, budget_tokens: int) -> str:
+    """
+    Formats the known categories for the system prompt within `budget_tokens`; the
+    categories that do not fit, from the end of the list, are left out.
+    """
+    if not categories or budget_tokens <= 0:
+        return ''
+    header = "\n\nWhenever one fits, use one of these existing categories: "
+    names = []
+    for category in categories:
+        candidate = header + ", ".join(f"'{c}'" for c in names + [category]) + "."
+        if estimate_tokens(candidate) > budget_tokens:
+            break
+        names.append(category)
+    return header + ", ".join(f"'{c}'" for c in names) + "." if names else ''
+
+
+def format_examples(examples: list, budget_tokens: int) -> str:
+    """
+    Formats few-shot examples for the system prompt within `budget_tokens`. Example
+    texts are shortened step by step (EXAMPLE_TEXT_LENGTHS) until all of them fit;
+    if they still do not, the examples that do not fit are left out.
+    """
+    if not examples or budget_tokens <= 0:
+        return ''
+    header = "\n\nHere are some examples of how to categorize documents correctly:\n"
+
+    def line(example, length):
+        text = example['text']
+        truncated_text = (text[:length] + '...') if len(text) > length else text
+        return f"- Document text starting with: '{truncated_text}' should be categorized as '{example['category']}'.\n"
+
+    for length in EXAMPLE_TEXT_LENGTHS:
+        formatted = header + ''.join(line(example, length) for example in examples)
+        if estimate_tokens(formatted) <= budget_tokens:
+            return formatted
+
+    formatted = header
+    for example in examples:
+        candidate = formatted + line(example, EXAMPLE_TEXT_LENGTHS[-1])
+        if estimate_tokens(candidate) > budget_tokens:
+            break
+        formatted = candidate
+    return formatted if formatted != header else ''
+
+
+def split_text(text: str, max_tokens: int) -> List[str]:
+    """
+    Splits `text` into parts of at most `max_tokens` (estimated), cutting on paragraph,
+    line, sentence or word breaks where possible.
+    """
+    max_chars = max(1, int(max_tokens * CHARS_PER_TOKEN))
+    parts = []
+    start = 0
+    while start < len(text):
+        limit = start + max_chars
+        if limit >= len(text):
+            parts.append(text[start:])
+            break
+        floor = start + max_chars // 2
+        end = limit
+        for sequence in _BREAK_SEQUENCES:
+            cut = text.rfind(sequence, floor, limit)
+            if cut != -1:
+                end = cut + len(sequence)
+                break
+        parts.append(text[start:end])
+        start = end
+    return [part for part in parts if part.strip()]
+
+
+def _normalize_key(key: str) -> str:
+    return re.sub(r'[^0-9a-z]+', '_', str(key).lower()).strip('_')
+
+
+def _normalize_value(value) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return re.sub(r'\s+', ' ', str(value)).strip().lower()
+
+
+def merge_extractions(results: List[Tuple[dict, Optional[str]]], weights: List[float]) -> Tuple[dict, Optional[str]]:
+    """
+    Merges the (kvps, category) extracted from the parts of one document.
+
+    The category is decided by a vote weighted by the size of each part. KVPs are
+    grouped by normalized key ("Invoice Number" and "invoice_number" are the same
+    key); when parts disagree on a value, the value with the largest total weight
+    wins. Ties go to the earliest part, where headers usually are.
+    """
+    category_votes = OrderedDict()
+    for (_, category), weight in zip(results, weights):
+        if category:
+            category_votes[category] = category_votes.get(category, 0) + weight
+    category = max(category_votes, key=category_votes.get) if category_votes else None
+
+    # normalized key -> (first spelling of the key, {normalized value -> [first value, total weight]})
+    candidates = OrderedDict()
+    for (kvps, _), weight in zip(results, weights):
+        for key, value in (kvps or {}).items():
+            if value in (None, ''):
+                continue
+            name, values = candidates.setdefault(_normalize_key(key), (key, OrderedDict()))
+            entry = values.setdefault(_normalize_value(value), [value, 0])
+            entry[1] += weight
+
+    kvps = {}
+    for name, values in candidates.values():
+        kvps[name] = max(values.values(), key=lambda entry: entry[1])[0]
+    return kvps, category
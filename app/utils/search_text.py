@@ -0,0 +1,31 @@
+import re
+
+# Length of the text snippet returned with each search result
+SNIPPET_LENGTH = 200
+
+
+def kvp_search_text(kvps) -> str:
+    """Flattens KVP values (including nested ones) into one string for the text index."""
+    if isinstance(kvps, dict):
+        return " ".join(kvp_search_text(value) for value in kvps.values())
+    if isinstance(kvps, (list, tuple)):
+        return " ".join(kvp_search_text(value) for value in kvps)
+    return "" if kvps is None else str(kvps)
+
+
+def make_snippet(text: str, query: str):
+    """
+    Cuts a window of about SNIPPET_LENGTH characters around the first query term found
+    in `text`, and returns it with the [start, end) offsets of every matched term.
+    """
+    terms = [re.escape(term) for term in re.findall(r'\w+', query)]
+    if not text or not terms:
+        return None, []
+    pattern = re.compile(r'\b(?:' + '|'.join(terms) + r')\w*', re.IGNORECASE)
+    first = pattern.search(text)
+    start = 0
+    if first and first.start() > SNIPPET_LENGTH // 4:
+        # Start a little before the first match, at a word boundary
+        start = text.rfind(' ', 0, first.start() - SNIPPET_LENGTH // 4) + 1
+    snippet = text[start:start + SNIPPET_LENGTH]
+    return snippet, [[match.start(), match.end()] for match in pattern.finditer(snippet)]
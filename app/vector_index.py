@@ -0,0 +1,214 @@
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows are stored in a preallocated matrix that grows by this factor
+GROWTH_FACTOR = 2
+# Removed rows are compacted away once they make up this share of the matrix
+COMPACTION_RATIO = 0.25
+# IVF uses about sqrt(n) clusters, trained with k-means on this many sampled vectors per cluster
+IVF_TRAIN_ITERATIONS = 8
+IVF_SAMPLES_PER_CLUSTER = 32
+# Rows are assigned to clusters in blocks of this size to bound temporary memory
+IVF_ASSIGN_BLOCK = 65_536
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalizes float32 rows so that a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class LocalVectorIndex:
+    """
+    An in-memory cosine-similarity index over chunk embeddings.
+
+    Vectors live in one contiguous, L2-normalized float32 matrix, so a flat search is
+    a single matrix-vector product. Rows are grouped by parent document, which makes
+    replacing or removing all chunks of a document cheap; removed rows are masked out
+    and compacted away later.
+
+    In 'ivf' mode (or 'auto' once `ivf_threshold` vectors are indexed) the rows are
+    additionally clustered with k-means, and a search only scores the rows of the
+    `nprobe` clusters closest to the query.
+    """
+    def __init__(self, dimensions: int, mode: str = 'auto', ivf_threshold: int = 200_000, nprobe: int = 8):
+        if mode not in ('flat', 'ivf', 'auto'):
+            raise ValueError(f"Unknown local index mode '{mode}'.")
+        self.dimensions = dimensions
+        self.mode = mode
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._vectors = np.zeros((1024, dimensions), dtype=np.float32)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._size = 0
+        self._chunk_ids = []
+        self._doc_ids = []
+        self._category_codes = {}
+        self._row_categories = np.zeros(1024, dtype=np.int32)
+        # Creation time of each row's document as a POSIX timestamp (NaN if unknown)
+        self._row_created = np.full(1024, np.nan)
+        self._rows_by_doc = {}
+        self._removed = 0
+        # IVF state: cluster centroids and the cluster each row belongs to
+        self._centroids = None
+        self._assignments = np.zeros(1024, dtype=np.int32)
+        self._trained_size = 0
+
+    def __len__(self):
+        return self._size - self._removed
+
+    def _reserve(self, extra: int):
+        needed = self._size + extra
+        capacity = len(self._vectors)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= GROWTH_FACTOR
+        self._vectors = np.resize(self._vectors, (capacity, self.dimensions))
+        self._alive = np.resize(self._alive, capacity)
+        self._alive[self._size:] = False
+        self._assignments = np.resize(self._assignments, capacity)
+        self._row_categories = np.resize(self._row_categories, capacity)
+        self._row_created = np.resize(self._row_created, capacity)
+
+    def set_category(self, doc_id: str, category):
+        """Updates the category of an already indexed document's rows."""
+        with self._lock:
+            rows = self._rows_by_doc.get(doc_id)
+            if rows:
+                self._row_categories[rows] = self._category_codes.setdefault(category, len(self._category_codes))
+
+    def set_document(self, doc_id: str, chunk_ids: list, vectors, category=None, created_at: float = None):
+        """
+        Replaces all indexed chunks of `doc_id` with the given chunk ids and vectors.
+        `created_at` is the document's creation time as a POSIX timestamp.
+        """
+        with self._lock:
+            self.remove_document(doc_id)
+            if not chunk_ids:
+                return
+            vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(chunk_ids), self.dimensions))
+            self._reserve(len(chunk_ids))
+            start, stop = self._size, self._size + len(chunk_ids)
+            self._vectors[start:stop] = vectors
+            self._alive[start:stop] = True
+            self._chunk_ids.extend(chunk_ids)
+            self._doc_ids.extend([doc_id] * len(chunk_ids))
+            self._row_categories[start:stop] = self._category_codes.setdefault(category, len(self._category_codes))
+            self._row_created[start:stop] = np.nan if created_at is None else created_at
+            if self._centroids is not None:
+                self._assignments[start:stop] = np.argmax(vectors @ self._centroids.T, axis=1)
+            self._rows_by_doc[doc_id] = list(range(start, stop))
+            self._size = stop
+            self._maybe_train()
+
+    def remove_document(self, doc_id: str):
+        with self._lock:
+            rows = self._rows_by_doc.pop(doc_id, None)
+            if not rows:
+                return
+            self._alive[rows] = False
+            self._removed += len(rows)
+            if self._removed > COMPACTION_RATIO * self._size:
+                self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        logger.info(f"Compacting local vector index from {self._size} to {len(keep)} rows.")
+        self._vectors[:len(keep)] = self._vectors[keep]
+        self._assignments[:len(keep)] = self._assignments[keep]
+        self._row_categories[:len(keep)] = self._row_categories[keep]
+        self._row_created[:len(keep)] = self._row_created[keep]
+        self._alive[:len(keep)] = True
+        self._alive[len(keep):] = False
+        self._chunk_ids = [self._chunk_ids[i] for i in keep]
+        self._doc_ids = [self._doc_ids[i] for i in keep]
+        self._rows_by_doc = {}
+        for row, doc_id in enumerate(self._doc_ids):
+            self._rows_by_doc.setdefault(doc_id, []).append(row)
+        self._size = len(keep)
+        self._removed = 0
+
+    def _maybe_train(self):
+        """(Re)trains the IVF clusters when first needed and whenever the index has doubled since."""
+        if self.mode == 'flat' or len(self) < (1 if self.mode == 'ivf' else self.ivf_threshold):
+            return
+        if self._centroids is not None and len(self) < 2 * self._trained_size:
+            return
+        live_rows = np.flatnonzero(self._alive[:self._size])
+        n_lists = max(1, int(np.sqrt(len(live_rows))))
+        rng = np.random.default_rng(0)
+        sample_size = min(len(live_rows), n_lists * IVF_SAMPLES_PER_CLUSTER)
+        sample = self._vectors[rng.choice(live_rows, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), size=min(n_lists, len(sample)), replace=False)]
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=len(centroids)) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+        self._centroids = centroids
+        for start in range(0, self._size, IVF_ASSIGN_BLOCK):
+            block = self._vectors[start:min(start + IVF_ASSIGN_BLOCK, self._size)]
+            self._assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        self._trained_size = len(self)
+        logger.info(f"Trained {len(centroids)} IVF clusters over {len(self)} vectors.")
+
+    def search(self, query_vector, k: int = 4, doc_id: str = None, category=None, created_range: tuple = None):
+        """
+        Returns up to `k` (chunk_id, doc_id, score) tuples, best first.
+        `doc_id`, `category` and `created_range` (a [low, high) pair of POSIX
+        timestamps, either end may be None) restrict the search to matching rows.
+        """
+        query = normalize(np.asarray(query_vector, dtype=np.float32).reshape(self.dimensions))
+        with self._lock:
+            if doc_id is not None:
+                rows = np.asarray(self._rows_by_doc.get(doc_id, []), dtype=np.int64)
+            elif self._centroids is not None:
+                probes = np.argpartition(-(self._centroids @ query), min(self.nprobe, len(self._centroids)) - 1)[:self.nprobe]
+                probe_mask = np.zeros(len(self._centroids), dtype=bool)
+                probe_mask[probes] = True
+                rows = np.flatnonzero(probe_mask[self._assignments[:self._size]] & self._alive[:self._size])
+            else:
+                rows = None
+
+            if category is not None:
+                code = self._category_codes.get(category)
+                if code is None:
+                    return []
+                candidates = rows if rows is not None else np.flatnonzero(self._alive[:self._size])
+                rows = candidates[self._row_categories[candidates] == code]
+
+            if created_range is not None:
+                low, high = created_range
+                candidates = rows if rows is not None else np.flatnonzero(self._alive[:self._size])
+                created = self._row_created[candidates]
+                keep = ~np.isnan(created)
+                if low is not None:
+                    keep &= created >= low
+                if high is not None:
+                    keep &= created < high
+                rows = candidates[keep]
+
+            if rows is None:
+                scores = self._vectors[:self._size] @ query
+                scores[~self._alive[:self._size]] = -np.inf
+                rows = np.arange(self._size)
+            else:
+                if len(rows) == 0:
+                    return []
+                scores = self._vectors[rows] @ query
+
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (self._chunk_ids[rows[i]], self._doc_ids[rows[i]], float(scores[i]))
+                for i in top if np.isfinite(scores[i])
+            ]
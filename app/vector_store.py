@@ -1,32 +1,107 @@
+import time
 import logging
+import datetime
+import threading
 from typing import Any, Iterable, List, Optional
+from flask import current_app
 from langchain.vectorstores.base import VectorStore
 from langchain.schema.embeddings import Embeddings
 from langchain.schema.document import Document
 from bson import ObjectId
+from app.vector_index import LocalVectorIndex
+from app.utils.embedding_codec import decode_embedding
 
 logger = logging.getLogger(__name__)
 
 # --- Global Vector Store ---
-# This will hold the single, shared instance of the MongoVectorStore.
+# This will hold the single, shared instance of the configured vector store backend.
 g_vector_store = None
+vector_store_lock = threading.Lock()
+
+# Documents changed this long before the previous sync are re-checked, to absorb
+# clock differences between the API and worker hosts. Re-indexing is idempotent.
+SYNC_OVERLAP = datetime.timedelta(seconds=30)
 
 def get_vector_store(db_client, embeddings_model):
     """
-    Returns a global instance of the MongoVectorStore.
+    Returns a global instance of the vector store selected by VECTOR_STORE_BACKEND:
+    MongoVectorStore ('atlas') or LocalVectorStore ('local').
     """
     global g_vector_store
-    if g_vector_store is None:
-        g_vector_store = MongoVectorStore(db_client, embeddings_model)
+    with vector_store_lock:
+        if g_vector_store is None:
+            config = current_app.config
+            backend = config.get('VECTOR_STORE_BACKEND', 'atlas')
+            if backend == 'local':
+                g_vector_store = LocalVectorStore(
+                    db_client,
+                    embeddings_model,
+                    dimensions=config['VECTOR_DIMENSIONS'],
+                    mode=config['LOCAL_VECTOR_INDEX_MODE'],
+                    ivf_threshold=config['LOCAL_VECTOR_INDEX_IVF_THRESHOLD'],
+                    nprobe=config['LOCAL_VECTOR_INDEX_NPROBE'],
+                    sync_seconds=config['LOCAL_VECTOR_INDEX_SYNC_SECONDS']
+                )
+            elif backend == 'atlas':
+                g_vector_store = MongoVectorStore(db_client, embeddings_model)
+            else:
+                raise ValueError(f"Unknown VECTOR_STORE_BACKEND '{backend}'.")
     return g_vector_store
 
 
+# Chunk fields returned with every search result
+CHUNK_PROJECTION = {
+    "_id": 1,
+    "doc_id": 1,
+    "chunk_index": 1,
+    "filename": 1,
+    "text": 1, # The text of the chunk only, not the whole document
+    "category": 1,
+    "segment_kind": 1,
+    "first_segment": 1,
+    "last_segment": 1
+}
+
+def _timestamp(value: datetime.datetime) -> float:
+    """
+    Converts a datetime into a POSIX timestamp; naive datetimes are UTC, as stored by
+    the app, and aware ones (e.g. from a filter with an offset) are converted to UTC.
+    """
+    if value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).timestamp()
+    return value.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def _created_range(condition: dict) -> tuple:
+    """Converts a `created_at` filter such as {'$gte': start, '$lt': end} into a [low, high) timestamp pair."""
+    low = condition.get('$gte') or condition.get('$gt')
+    high = condition.get('$lt') or condition.get('$lte')
+    return (_timestamp(low) if low else None, _timestamp(high) if high else None)
+
+def _chunk_to_document(res: dict, score: Optional[float]) -> Document:
+    """Converts a `document_chunks` record into a chunk-level LangChain Document."""
+    return Document(
+        page_content=res.get('text', ''),
+        metadata={
+            'doc_id': str(res.get('doc_id')),
+            'chunk_id': str(res.get('_id')),
+            'chunk_index': res.get('chunk_index'),
+            'filename': res.get('filename', 'N/A'),
+            'category': res.get('category', 'N/A'),
+            'segment_kind': res.get('segment_kind'),
+            'first_segment': res.get('first_segment'),
+            'last_segment': res.get('last_segment'),
+            'score': score
+        }
+    )
+
+
 class MongoVectorStore(VectorStore):
     """
     A custom LangChain VectorStore that uses MongoDB as the backend.
-    It uses the `$vectorSearch` aggregation pipeline for similarity searches.
+    It uses the `$vectorSearch` aggregation pipeline for similarity searches
+    over the `document_chunks` collection, so each result is a single passage.
     """
-    def __init__(self, db_client: Any, embeddings_model: Embeddings, collection_name: str = 'documents', index_name: str = "vector_index"):
+    def __init__(self, db_client: Any, embeddings_model: Embeddings, collection_name: str = 'document_chunks', index_name: str = "vector_index"):
         self._db_client = db_client
         self._collection = self._db_client.db[collection_name]
         self._embeddings = embeddings_model
@@ -46,65 +121,190 @@ class MongoVectorStore(VectorStore):
 
         Args:
             query: The text to search for.
-            k: The number of results to return.
+            k: The number of chunks to return.
             filter: An optional MongoDB filter to apply before the vector search.
+                A string `doc_id` restricts the search to that document's chunks.
 
         Returns:
-            A list of LangChain Document objects matching the search.
+            A list of chunk-level LangChain Document objects whose metadata
+            carries the parent `doc_id`.
         """
         logger.info(f"Performing similarity search for query: '{query[:30]}...'")
-        query_embedding = self._embeddings.embed_query(query)
+        return self.similarity_search_by_vector(self._embeddings.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        """Like `similarity_search`, for an already embedded query."""
 
         # Base filter excludes soft-deleted documents by default
         pre_filter = {"deleted_at": {"$exists": False}}
         if filter:
             pre_filter.update(filter)
+            if isinstance(pre_filter.get('doc_id'), str):
+                pre_filter['doc_id'] = ObjectId(pre_filter['doc_id'])
 
         pipeline = [
             {
                 "$vectorSearch": {
                     "index": self._index_name,
                     "path": "embedding",
-                    "queryVector": query_embedding,
+                    "queryVector": embedding,
                     "numCandidates": 150,
                     "limit": k,
                     "filter": pre_filter
                 }
             },
             {
-                "$project": {
-                    "_id": 1,
-                    "filename": 1,
-                    "text": 1, # The raw text content of the document
-                    "category": 1,
-                    "score": {"$meta": "vectorSearchScore"}
-                }
+                "$project": {**CHUNK_PROJECTION, "score": {"$meta": "vectorSearchScore"}}
             }
         ]
 
         try:
             results = list(self._collection.aggregate(pipeline))
-            logger.info(f"Found {len(results)} documents in vector search.")
+            logger.info(f"Found {len(results)} chunks in vector search.")
         except Exception as e:
             logger.error(f"Error during MongoDB vector search: {e}", exc_info=True)
             # This can happen if the index is not ready or the query is malformed.
             return []
         
         # Convert MongoDB documents to LangChain's Document format
-        documents = []
-        for res in results:
-            doc = Document(
-                page_content=res.get('text', ''),
-                metadata={
-                    'doc_id': str(res.get('_id')),
-                    'filename': res.get('filename', 'N/A'),
-                    'category': res.get('category', 'N/A'),
-                    'score': res.get('score')
-                }
-            )
-            documents.append(doc)
+        return [_chunk_to_document(res, res.get('score')) for res in results]
+
+    @classmethod
+    def from_texts(cls, *args, **kwargs):
+        """This method is not applicable for this implementation."""
+        raise NotImplementedError("from_texts is not supported.")
+
+
+class LocalVectorStore(VectorStore):
+    """
+    A LangChain VectorStore that searches an in-process LocalVectorIndex instead of
+    Atlas `$vectorSearch`, so semantic search also works on plain MongoDB.
+
+    The index is loaded from the `embedding` fields of `document_chunks` on first use.
+    Afterwards, at most every `sync_seconds`, documents whose `vectors_updated_at`
+    changed (processed, reprocessed, recategorized, soft-deleted or restored) are
+    re-read, which keeps the index incrementally in sync with the Celery workers.
+    """
+    def __init__(self, db_client: Any, embeddings_model: Embeddings, dimensions: int, mode: str = 'auto',
+                 ivf_threshold: int = 200_000, nprobe: int = 16, sync_seconds: float = 5):
+        self._chunks = db_client.db['document_chunks']
+        self._documents = db_client.db['documents']
+        self._embeddings = embeddings_model
+        self._index = LocalVectorIndex(dimensions, mode=mode, ivf_threshold=ivf_threshold, nprobe=nprobe)
+        self._sync_seconds = sync_seconds
+        self._synced_until = None
+        self._last_sync_check = 0.0
+        self._sync_lock = threading.Lock()
+        logger.info(f"LocalVectorStore initialized (mode={mode}).")
+
+    def _index_chunks(self, doc_id: str, chunks: list):
+        created_at = chunks[0].get('created_at') if chunks else None
+        self._index.set_document(
+            doc_id,
+            [chunk['_id'] for chunk in chunks],
+            [decode_embedding(chunk['embedding']) for chunk in chunks],
+            category=chunks[0].get('category') if chunks else None,
+            created_at=_timestamp(created_at) if created_at else None
+        )
+
+    def _load_all(self):
+        started = time.perf_counter()
+        cursor = self._chunks.find(
+            {'deleted_at': {'$exists': False}, 'embedding': {'$ne': None}},
+            {'doc_id': 1, 'embedding': 1, 'category': 1, 'created_at': 1}
+        ).sort([('doc_id', 1), ('chunk_index', 1)])
+        doc_id, chunks = None, []
+        for chunk in cursor:
+            if chunk['doc_id'] != doc_id:
+                if chunks:
+                    self._index_chunks(str(doc_id), chunks)
+                doc_id, chunks = chunk['doc_id'], []
+            chunks.append(chunk)
+        if chunks:
+            self._index_chunks(str(doc_id), chunks)
+        logger.info(f"Loaded {len(self._index)} chunk vectors into the local index in {time.perf_counter() - started:.1f}s.")
+
+    def _reload_document(self, doc: dict):
+        doc_id = str(doc['_id'])
+        if 'deleted_at' in doc:
+            self._index.remove_document(doc_id)
+            return
+        chunks = list(self._chunks.find(
+            {'doc_id': doc['_id'], 'embedding': {'$ne': None}},
+            {'embedding': 1, 'category': 1, 'created_at': 1}
+        ).sort('chunk_index', 1))
+        self._index_chunks(doc_id, chunks)
+
+    def sync(self, force: bool = False):
+        """Brings the index up to date with the database, at most once every `sync_seconds` unless forced."""
+        with self._sync_lock:
+            now = time.monotonic()
+            if not force and self._synced_until is not None and now - self._last_sync_check < self._sync_seconds:
+                return
+            self._last_sync_check = now
+            sync_started = datetime.datetime.utcnow()
+            if self._synced_until is None:
+                self._load_all()
+            else:
+                changed = self._documents.find(
+                    {'vectors_updated_at': {'$gte': self._synced_until - SYNC_OVERLAP}},
+                    {'_id': 1, 'deleted_at': 1}
+                )
+                for doc in changed:
+                    self._reload_document(doc)
+            self._synced_until = sync_started
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        """This method is not used in this application, as documents are added via the database methods."""
+        logger.warning("add_texts is not implemented for this vector store.")
+        raise NotImplementedError("Adding texts directly is not supported.")
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        """
+        Performs a similarity search against the in-process index.
+
+        Args:
+            query: The text to search for.
+            k: The number of chunks to return.
+            filter: Optional `doc_id`, `category` and/or `created_at` range
+                (e.g. {'$gte': start, '$lt': end}) to restrict the search to.
+
+        Returns:
+            A list of chunk-level LangChain Document objects whose metadata
+            carries the parent `doc_id`.
+        """
+        logger.info(f"Performing local similarity search for query: '{query[:30]}...'")
+        return self.similarity_search_by_vector(self._embeddings.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        """Like `similarity_search`, for an already embedded query."""
+        filter = dict(filter or {})
+        doc_id = filter.pop('doc_id', None)
+        category = filter.pop('category', None)
+        created_at = filter.pop('created_at', None)
+        if filter:
+            logger.warning(f"Local vector store ignores unsupported filter fields: {list(filter)}")
+
+        self.sync()
+        hits = self._index.search(
+            embedding,
+            k=k,
+            doc_id=str(doc_id) if doc_id else None,
+            category=category,
+            created_range=_created_range(created_at) if created_at else None
+        )
+        if not hits:
+            return []
 
-        return documents
+        chunks = {chunk['_id']: chunk for chunk in self._chunks.find({'_id': {'$in': [chunk_id for chunk_id, _, _ in hits]}}, CHUNK_PROJECTION)}
+        logger.info(f"Found {len(chunks)} chunks in local vector search.")
+        return [_chunk_to_document(chunks[chunk_id], score) for chunk_id, _, score in hits if chunk_id in chunks]
 
     @classmethod
     def from_texts(cls, *args, **kwargs):
@@ -21,16 +21,186 @@ class Config:
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
 
+    # Read-through cache of single documents and the category list. Each process keeps up to
+    # CACHE_MAX_ENTRIES entries, taking at most CACHE_MAX_BYTES bytes (documents are cached with their
+    # text), for CACHE_LOCAL_TTL_SECONDS (0 entries disables the local tier); with
+    # CACHE_REDIS_URL set, entries are also shared through Redis for CACHE_REDIS_TTL_SECONDS.
+    # Changes made by another process become visible after at most CACHE_LOCAL_TTL_SECONDS.
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    CACHE_LOCAL_TTL_SECONDS = float(os.environ.get('CACHE_LOCAL_TTL_SECONDS', 5))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', '')
+    CACHE_REDIS_TTL_SECONDS = int(os.environ.get('CACHE_REDIS_TTL_SECONDS', 300))
+
+    # How often `celery beat` recomputes the materialized dashboard statistics to repair any drift
+    DASHBOARD_STATS_RECONCILE_SECONDS = float(os.environ.get('DASHBOARD_STATS_RECONCILE_SECONDS', 3600))
+
     # --- AI Model Configuration ---
 
     # On-premise LLM Server URL (Ollama)
     OLLAMA_BASE_URL = os.environ.get('OLLAMA_BASE_URL', 'http://127.0.0.1:11434')
 
+    # Comma-separated Ollama hosts serving the same models (defaults to OLLAMA_BASE_URL). Each request
+    # goes to the healthy host with the fewest outstanding requests and fails over to the others.
+    # After OLLAMA_CIRCUIT_FAILURE_THRESHOLD consecutive failures a host gets no traffic for
+    # OLLAMA_CIRCUIT_COOLDOWN_SECONDS; hosts are health-checked every OLLAMA_HEALTH_CHECK_SECONDS (0 disables).
+    OLLAMA_BASE_URLS = [url.strip() for url in os.environ.get('OLLAMA_BASE_URLS', OLLAMA_BASE_URL).split(',') if url.strip()]
+    OLLAMA_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('OLLAMA_CIRCUIT_FAILURE_THRESHOLD', 3))
+    OLLAMA_CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get('OLLAMA_CIRCUIT_COOLDOWN_SECONDS', 30))
+    OLLAMA_HEALTH_CHECK_SECONDS = float(os.environ.get('OLLAMA_HEALTH_CHECK_SECONDS', 10))
+
+    # Requests to an Ollama host share a pooled keep-alive connection per process. Each process keeps
+    # at most OLLAMA_MAX_CONCURRENCY requests in flight per host; further ones wait for a slot. With
+    # OLLAMA_GLOBAL_MAX_CONCURRENCY > 0 the API and all workers together are also limited to that
+    # many per host, coordinated through Redis (OLLAMA_CONCURRENCY_REDIS_URL, the Celery broker by default).
+    OLLAMA_MAX_CONCURRENCY = int(os.environ.get('OLLAMA_MAX_CONCURRENCY', 4))
+    OLLAMA_GLOBAL_MAX_CONCURRENCY = int(os.environ.get('OLLAMA_GLOBAL_MAX_CONCURRENCY', 0))
+    OLLAMA_CONCURRENCY_REDIS_URL = os.environ.get('OLLAMA_CONCURRENCY_REDIS_URL', CELERY_BROKER_URL)
+    # Seconds before an Ollama request times out (also the lease of a cluster-wide slot)
+    OLLAMA_REQUEST_TIMEOUT = int(os.environ.get('OLLAMA_REQUEST_TIMEOUT', 300))
+
     # Name of the local embeddings model (runs in-app)
     EMBEDDINGS_MODEL_NAME = os.environ.get('EMBEDDINGS_MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
+
+    # With MODEL_PRELOAD set, Celery workers and gunicorn (gunicorn.conf.py) load the embeddings model
+    # once in the parent process, before forking, so the children share it copy-on-write instead of
+    # each loading it on its first request; MODEL_PRELOAD_WARM_UP also encodes one text first.
+    # Only worth it for processes that embed (the API and the embedding workers).
+    MODEL_PRELOAD = os.environ.get('MODEL_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+    MODEL_PRELOAD_WARM_UP = os.environ.get('MODEL_PRELOAD_WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+
+    # With EMBEDDINGS_SERVICE_URL set (e.g. http://127.0.0.1:8001), the API and the workers embed through
+    # the standalone embedding service (`python -m app.embedding_server`, listening on
+    # EMBEDDINGS_SERVICE_HOST:EMBEDDINGS_SERVICE_PORT) instead of loading the model themselves;
+    # it batches the requests of all of them together. MODEL_PRELOAD is then ignored.
+    EMBEDDINGS_SERVICE_URL = os.environ.get('EMBEDDINGS_SERVICE_URL')
+    EMBEDDINGS_SERVICE_HOST = os.environ.get('EMBEDDINGS_SERVICE_HOST', '127.0.0.1')
+    EMBEDDINGS_SERVICE_PORT = int(os.environ.get('EMBEDDINGS_SERVICE_PORT', 8001))
+    EMBEDDINGS_SERVICE_TIMEOUT_SECONDS = float(os.environ.get('EMBEDDINGS_SERVICE_TIMEOUT_SECONDS', 30))
     
     # Dimensions of the embeddings model output vector
     VECTOR_DIMENSIONS = int(os.environ.get('VECTOR_DIMENSIONS', 384))
 
     # Name of the chat/extraction model served by Ollama
     CHAT_MODEL_NAME = os.environ.get('CHAT_MODEL_NAME', 'phi3:mini')
+
+    # Context window requested from Ollama for KVP/category extraction (Ollama's own default is
+    # 2048 tokens), of which LLM_RESPONSE_TOKENS are kept free for the answer and at most
+    # LLM_EXAMPLE_TOKENS go to few-shot examples and LLM_CATEGORY_TOKENS to the list of known
+    # categories (the categories that do not fit are left out). Longer documents are split into up to
+    # LLM_MAP_REDUCE_MAX_PARTS parts that fit, analyzed LLM_MAP_REDUCE_WORKERS at a time, and the
+    # per-part results merged by a vote. Token counts are estimated at ~3.5 characters per token;
+    # extraction fails when these settings leave fewer than 256 tokens for the document text.
+    LLM_CONTEXT_TOKENS = int(os.environ.get('LLM_CONTEXT_TOKENS', 4096))
+    LLM_RESPONSE_TOKENS = int(os.environ.get('LLM_RESPONSE_TOKENS', 768))
+    LLM_EXAMPLE_TOKENS = int(os.environ.get('LLM_EXAMPLE_TOKENS', 512))
+    LLM_CATEGORY_TOKENS = int(os.environ.get('LLM_CATEGORY_TOKENS', 256))
+    LLM_MAP_REDUCE_MAX_PARTS = int(os.environ.get('LLM_MAP_REDUCE_MAX_PARTS', 16))
+    LLM_MAP_REDUCE_WORKERS = int(os.environ.get('LLM_MAP_REDUCE_WORKERS', 4))
+
+    # Results of the KVP/category extraction are cached in the `llm_cache` collection, keyed by a hash
+    # of the model name, prompt (including categories and examples) and document text, so reprocessing
+    # and task retries of unchanged documents skip the LLM. Entries expire after LLM_CACHE_TTL_SECONDS;
+    # beyond LLM_CACHE_MAX_ENTRIES the least recently used are removed (0 disables the cache).
+    # Entries of other models are dropped on startup when CHAT_MODEL_NAME changes.
+    LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 100000))
+
+    # Query embeddings of the last CHAT_QUERY_EMBEDDING_CACHE_SIZE distinct chat questions are kept
+    # in memory, so repeated questions skip the embedding model (0 disables the cache)
+    CHAT_QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('CHAT_QUERY_EMBEDDING_CACHE_SIZE', 1024))
+
+    # Documents are processed in stages (extract -> classify -> embed -> persist), each a Celery task
+    # whose output is checkpointed in MongoDB so retries resume at the failing stage. Checkpoints of
+    # runs that never finish are removed after PIPELINE_CHECKPOINT_TTL_SECONDS.
+    PIPELINE_CHECKPOINT_TTL_SECONDS = int(os.environ.get('PIPELINE_CHECKPOINT_TTL_SECONDS', 7 * 24 * 3600))
+
+    # Single uploads and reprocess requests are processed in the high-priority interactive lane;
+    # bulk uploads go to the low-priority bulk lane, fed in by a dispatcher (run every
+    # BULK_DISPATCH_INTERVAL_SECONDS and whenever a bulk document finishes) that keeps at most
+    # BULK_MAX_IN_FLIGHT bulk documents in flight, at most BULK_MAX_IN_FLIGHT_PER_BATCH of each batch.
+    # Bulk documents dispatched more than BULK_DISPATCH_STALE_SECONDS ago and still queued (e.g. their
+    # message was lost) no longer count as in flight and are dispatched again.
+    BULK_MAX_IN_FLIGHT = int(os.environ.get('BULK_MAX_IN_FLIGHT', 200))
+    BULK_MAX_IN_FLIGHT_PER_BATCH = int(os.environ.get('BULK_MAX_IN_FLIGHT_PER_BATCH', 50))
+    BULK_DISPATCH_INTERVAL_SECONDS = float(os.environ.get('BULK_DISPATCH_INTERVAL_SECONDS', 5))
+    BULK_DISPATCH_STALE_SECONDS = int(os.environ.get('BULK_DISPATCH_STALE_SECONDS', 3600))
+
+    # Workers started with `--autoscale=max,min` size their pool from the backlog of their queues:
+    # every AUTOSCALE_CHECK_SECONDS they aim for enough processes to work off the waiting tasks
+    # (at the queue's average task run time) within AUTOSCALE_TARGET_DRAIN_SECONDS, and add one
+    # while the oldest waiting task has waited longer than AUTOSCALE_MAX_WAIT_SECONDS.
+    AUTOSCALE_CHECK_SECONDS = float(os.environ.get('AUTOSCALE_CHECK_SECONDS', 5))
+    AUTOSCALE_TARGET_DRAIN_SECONDS = float(os.environ.get('AUTOSCALE_TARGET_DRAIN_SECONDS', 60))
+    AUTOSCALE_MAX_WAIT_SECONDS = float(os.environ.get('AUTOSCALE_MAX_WAIT_SECONDS', 30))
+
+    # Embedding requests from concurrently processed documents are grouped into micro-batches
+    # of up to EMBEDDING_BATCH_SIZE texts, waiting at most EMBEDDING_BATCH_WAIT_MS for a batch to fill.
+    # Cross-document batching needs a worker pool that runs tasks concurrently in one process
+    # (e.g. `celery worker --pool threads`); with prefork each child batches only its own chunks.
+    EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+    EMBEDDING_BATCH_WAIT_MS = float(os.environ.get('EMBEDDING_BATCH_WAIT_MS', 20))
+    # A caller waits at most EMBEDDING_REQUEST_TIMEOUT_SECONDS for its embeddings (the time its
+    # batch waits and is embedded), then fails instead of blocking its thread for good.
+    EMBEDDING_REQUEST_TIMEOUT_SECONDS = float(os.environ.get('EMBEDDING_REQUEST_TIMEOUT_SECONDS', 120))
+
+    # Vector search backend: 'atlas' uses MongoDB Atlas $vectorSearch, 'local' keeps an in-process
+    # NumPy index of the chunk embeddings and works against any MongoDB (e.g. the mongo:6.0 container).
+    VECTOR_STORE_BACKEND = os.environ.get('VECTOR_STORE_BACKEND', 'atlas')
+
+    # Local index search mode: 'flat' (exact), 'ivf' (clustered, approximate) or 'auto'
+    # (flat until LOCAL_VECTOR_INDEX_IVF_THRESHOLD vectors, then ivf)
+    LOCAL_VECTOR_INDEX_MODE = os.environ.get('LOCAL_VECTOR_INDEX_MODE', 'auto')
+    LOCAL_VECTOR_INDEX_IVF_THRESHOLD = int(os.environ.get('LOCAL_VECTOR_INDEX_IVF_THRESHOLD', 200000))
+
+    # Number of IVF clusters scanned per query; higher is more accurate but slower
+    LOCAL_VECTOR_INDEX_NPROBE = int(os.environ.get('LOCAL_VECTOR_INDEX_NPROBE', 16))
+
+    # Minimum number of seconds between checks for processed or deleted documents to index
+    LOCAL_VECTOR_INDEX_SYNC_SECONDS = float(os.environ.get('LOCAL_VECTOR_INDEX_SYNC_SECONDS', 5))
+
+    # How embeddings are stored: 'float32' (BSON array of doubles, required for Atlas $vectorSearch),
+    # 'float16' (packed half precision) or 'int8' (quantized with a per-vector scale factor).
+    # Existing documents are converted with `flask --app main embeddings migrate`.
+    EMBEDDING_STORAGE_FORMAT = os.environ.get('EMBEDDING_STORAGE_FORMAT', 'float32')
+
+    # Documents are split into chunks of at most this many characters, each embedded separately.
+    # The default keeps chunks within the token limit of the default sentence-transformer.
+    CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', 1000))
+
+    # Number of characters consecutive chunks share, so passages cut at a boundary keep their context
+    CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', 150))
+
+    # Hybrid search (`/documents/search?mode=hybrid`) fuses the lexical and vector rankings with
+    # reciprocal rank fusion: score = sum(1 / (HYBRID_SEARCH_RRF_K + rank)). Each side contributes
+    # at least HYBRID_SEARCH_CANDIDATES documents to the fusion.
+    HYBRID_SEARCH_RRF_K = int(os.environ.get('HYBRID_SEARCH_RRF_K', 60))
+    HYBRID_SEARCH_CANDIDATES = int(os.environ.get('HYBRID_SEARCH_CANDIDATES', 50))
+
+    # MongoDB scores every document matching a full-text query before it can sort them, so a broad
+    # query costs the same at any page. Search pages reach at most the first SEARCH_MAX_RESULTS
+    # results (deeper offsets are rejected), and a lexical search query running longer than
+    # SEARCH_MAX_TIME_MS (0: no limit) is aborted with a 503. `scripts/bench_search.py` measures
+    # the latency of broad and narrow queries at increasing offsets.
+    SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 1000))
+    SEARCH_MAX_TIME_MS = int(os.environ.get('SEARCH_MAX_TIME_MS', 2000))
+
+    # --- Text Extraction ---
+
+    # Number of processes used to extract PDF pages in parallel (0 or 1 keeps extraction serial).
+    # The pool needs a process allowed to have children: a Celery worker with a non-forking pool
+    # (`--pool threads` or `--pool solo`), which keeps one pool per worker. Prefork children are
+    # daemonic and cannot start it, so they always extract serially; docker-compose therefore runs
+    # worker-extract with `--pool threads` and sets this, at the cost of the autoscaler, which only
+    # resizes prefork pools.
+    PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', 0))
+
+    # PDFs with fewer pages than this are always extracted serially
+    PDF_PARALLEL_PAGE_THRESHOLD = int(os.environ.get('PDF_PARALLEL_PAGE_THRESHOLD', 50))
+
+    # Limits on zip/tar archives uploaded to `/documents/bulk`, against archive bombs: at most
+    # ARCHIVE_MAX_FILES files and ARCHIVE_MAX_UNCOMPRESSED_BYTES unpacked bytes in total, at a
+    # compression ratio of at most ARCHIVE_MAX_COMPRESSION_RATIO. Larger archives are refused with 400.
+    ARCHIVE_MAX_FILES = int(os.environ.get('ARCHIVE_MAX_FILES', 10000))
+    ARCHIVE_MAX_UNCOMPRESSED_BYTES = int(os.environ.get('ARCHIVE_MAX_UNCOMPRESSED_BYTES', 2 * 1024 ** 3))
+    ARCHIVE_MAX_COMPRESSION_RATIO = float(os.environ.get('ARCHIVE_MAX_COMPRESSION_RATIO', 100))
@@ -0,0 +1,30 @@
+"""
+Gunicorn settings of the API: `gunicorn -c gunicorn.conf.py main:app`.
+
+With MODEL_PRELOAD set, the master loads the embeddings model before it forks the
+workers (`when_ready`), so they share one copy of the weights instead of each loading
+its own on the first chat or search request. The app itself is still created in each
+worker (no `preload_app`): its MongoDB and Redis clients must not be shared across a fork.
+"""
+import os
+from config import Config
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+# Threaded workers, so streamed chat answers do not block other requests
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def when_ready(server):
+    if Config.MODEL_PRELOAD and not Config.EMBEDDINGS_SERVICE_URL:
+        from app.model_preload import preload_models
+        result = preload_models(Config.EMBEDDINGS_MODEL_NAME, warm_up=Config.MODEL_PRELOAD_WARM_UP)
+        server.log.info(f"Preloaded the embeddings model in {result['seconds']:.2f}s "
+                        f"(master RSS {result['rss_before_mb']} -> {result['rss_after_mb']} MB)")
+
+
+def post_fork(server, worker):
+    if Config.MODEL_PRELOAD and not Config.EMBEDDINGS_SERVICE_URL:
+        from app.model_preload import after_fork
+        after_fork()
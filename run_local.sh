@@ -32,7 +32,7 @@ echo ""
 echo "1. In the FIRST new terminal, start the Celery Worker:"
 echo "   --------------------------------------------------"
 echo "   source .venv/bin/activate"
-echo "   celery -A app.celery_worker.celery_app worker --loglevel=info"
+echo "   celery -A app.celery_worker.celery_app worker -Q celery,extract,llm,embed --loglevel=info"
 
 echo ""
 echo "2. In the SECOND new terminal, start the Flask Web Server:"
@@ -85,7 +85,7 @@ start_services() {
 
     # 2. Start Celery Worker in the background
     echo "Starting Celery Worker..."
-    nohup celery -A app.celery_worker.celery_app worker --loglevel=info --pidfile=${CELERY_PID} > ${CELERY_LOG} 2>&1 &
+    nohup celery -A app.celery_worker.celery_app worker -Q celery,extract,llm,embed --loglevel=info --pidfile=${CELERY_PID} > ${CELERY_LOG} 2>&1 &
 
     echo "Services started. Check ${GUNICORN_LOG} and ${CELERY_LOG} for output."
     echo "API will be available at ${FLASK_APP_URL}"
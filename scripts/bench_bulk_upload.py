@@ -0,0 +1,79 @@
+"""
+Benchmarks single-file vs. bulk ingestion against the configured MongoDB.
+
+Stores `--files` small text files once the way `POST /documents` does (one GridFS
+put, one insert_one and one read-back per file) and once the way
+`POST /documents/bulk` does (batched GridFS writes and one insert_many per
+batch), and reports files/second for both. Every file has distinct content, so
+upload deduplication does not kick in. Task enqueueing is not included.
+The benchmark documents are removed afterwards.
+
+Usage (from the project root):
+    python -m scripts.bench_bulk_upload --files 2000 --size 4096
+"""
+import io
+import time
+import uuid
+import argparse
+from werkzeug.datastructures import FileStorage
+from app.database import MongoDatabase
+from app.blueprints.documents import _new_document, BULK_UPLOAD_BATCH_SIZE
+from config import Config
+
+
+def make_files(count: int, size: int, label: str) -> list:
+    body = b"Invoice INV-00042 total 1234.56 EUR due on receipt. " * (size // 52 + 1)
+    return [FileStorage(stream=io.BytesIO((f"{label} {i:06d} ".encode() + body)[:size]),
+                        filename=f"bench_{i:06d}.txt", content_type='text/plain')
+            for i in range(count)]
+
+
+def single(db, files, batch_id) -> float:
+    started = time.perf_counter()
+    for file in files:
+        stored = db.save_file(file)
+        doc_id = db.create_document(_new_document(file, stored, batch_id))
+        db.get_document(doc_id)
+    return time.perf_counter() - started
+
+
+def bulk(db, files, batch_id, batch_size: int) -> float:
+    started = time.perf_counter()
+    for start in range(0, len(files), batch_size):
+        batch = files[start:start + batch_size]
+        stored_files = db.save_files(batch)
+        db.create_documents([_new_document(file, stored, batch_id) for file, stored in zip(batch, stored_files)])
+    return time.perf_counter() - started
+
+
+def cleanup(db, batch_id):
+    docs = list(db.documents.find({'batch_id': batch_id}, {'file_id': 1}))
+    for doc in docs:
+        db.release_file(doc['file_id'])
+    db.documents.delete_many({'batch_id': batch_id})
+    db.reconcile_dashboard_statistics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=4096, help="Bytes per file")
+    parser.add_argument('--batch-size', type=int, default=BULK_UPLOAD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    db = MongoDatabase(Config.MONGO_URI, Config.VECTOR_DIMENSIONS)
+    batch_id = f"bench-{uuid.uuid4().hex}"
+    try:
+        single_seconds = single(db, make_files(args.files, args.size, f"{batch_id}-single"), batch_id)
+        bulk_seconds = bulk(db, make_files(args.files, args.size, f"{batch_id}-bulk"), batch_id, args.batch_size)
+    finally:
+        cleanup(db, batch_id)
+
+    print(f"{args.files} files x {args.size} bytes")
+    print(f"{'mode':>8} {'seconds':>9} {'files/s':>9}")
+    print(f"{'single':>8} {single_seconds:>9.2f} {args.files / single_seconds:>9.0f}")
+    print(f"{'bulk':>8} {bulk_seconds:>9.2f} {args.files / bulk_seconds:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmarks per-document embedding against the cross-document EmbeddingBatcher.
+
+Simulates `--threads` worker threads each embedding the chunks of `--docs`
+documents, first by calling the model once per document (the old path) and then
+through a shared EmbeddingBatcher, and reports documents/minute for both.
+
+Usage (from the project root):
+    python -m scripts.bench_embedding_batching --docs 200 --chunks 3 --threads 8
+"""
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from langchain.embeddings import HuggingFaceEmbeddings
+from app.embedding_batcher import EmbeddingBatcher
+from app.metrics import metrics
+from config import Config
+
+
+def make_documents(count: int, chunks_per_doc: int) -> list:
+    return [
+        [f"Invoice INV-{d:05d} section {c}: payment of {d * 7 % 1000}.00 EUR is due within 30 days "
+         f"to the supplier account listed on page {c + 1}." * 4 for c in range(chunks_per_doc)]
+        for d in range(count)
+    ]
+
+
+def run(embeddings, documents, threads: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(embeddings.embed_documents, documents))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--chunks', type=int, default=3, help="Chunks per document")
+    parser.add_argument('--threads', type=int, default=8, help="Concurrently processed documents")
+    parser.add_argument('--batch-size', type=int, default=Config.EMBEDDING_BATCH_SIZE)
+    parser.add_argument('--wait-ms', type=float, default=Config.EMBEDDING_BATCH_WAIT_MS)
+    args = parser.parse_args()
+
+    model = HuggingFaceEmbeddings(
+        model_name=Config.EMBEDDINGS_MODEL_NAME,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': False}
+    )
+    documents = make_documents(args.docs, args.chunks)
+    model.embed_documents(documents[0])  # warm-up
+
+    per_doc = run(model, documents, args.threads)
+    batcher = EmbeddingBatcher(model, max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+    batched = run(batcher, documents, args.threads)
+
+    print(f"{args.docs} documents x {args.chunks} chunks, {args.threads} threads")
+    print(f"{'mode':>10} {'seconds':>9} {'docs/min':>10}")
+    print(f"{'per-doc':>10} {per_doc:>9.2f} {args.docs / per_doc * 60:>10.0f}")
+    print(f"{'batched':>10} {batched:>9.2f} {args.docs / batched * 60:>10.0f}")
+
+    summaries = metrics.snapshot()['summaries']
+    print(f"batch size: {summaries['embedding_batch_size']}")
+    print(f"batch latency (ms): {summaries['embedding_batch_latency_ms']}")
+    print(f"request latency (ms): {summaries['embedding_request_latency_ms']}")
+
+
+if __name__ == '__main__':
+    main()
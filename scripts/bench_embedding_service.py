@@ -0,0 +1,124 @@
+"""
+Benchmarks in-process embedding against the standalone embedding service.
+
+Forks `--processes` worker processes with `--threads` threads each, which embed
+the chunks of `--docs` documents between them, first with the model loaded in
+every process (batched per process by an EmbeddingBatcher, the in-process mode)
+and then through one embedding service (`python -m app.embedding_server`, started
+by this script), which batches the requests of all processes together. Reports
+documents/minute, the latency of a document's embedding request, and the memory
+of the processes involved (the total PSS, with the service's in remote mode).
+
+Usage (from the project root):
+    python -m scripts.bench_embedding_service --docs 400 --chunks 3 --processes 4 --threads 4
+"""
+import sys
+import time
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from app.ai_models import init_embeddings
+from app.embedding_batcher import EmbeddingBatcher
+from app.embedding_client import RemoteEmbeddings
+from app.model_preload import process_memory
+from scripts.bench_embedding_batching import make_documents
+from config import Config
+
+
+def worker(mode: str, args, documents: list, barrier, results):
+    if mode == 'remote':
+        embeddings = RemoteEmbeddings(f"http://127.0.0.1:{args.port}")
+    else:
+        embeddings = EmbeddingBatcher(init_embeddings(args.model), max_batch_size=args.batch_size,
+                                      max_wait_ms=args.wait_ms)
+    embeddings.embed_documents(documents[0])  # warm-up
+
+    def embed(texts):
+        started = time.perf_counter()
+        embeddings.embed_documents(texts)
+        return (time.perf_counter() - started) * 1000
+
+    barrier.wait()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        latencies = list(pool.map(embed, documents))
+    results.put({'latencies_ms': latencies, **process_memory()})
+    barrier.wait()
+
+
+def run(mode: str, args, documents: list, service_pid: int = None) -> dict:
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(args.processes + 1)
+    results = context.Queue()
+    shares = [documents[i::args.processes] for i in range(args.processes)]
+    processes = [context.Process(target=worker, args=(mode, args, share, barrier, results)) for share in shares]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    started = time.perf_counter()
+    reports = [results.get() for _ in processes]
+    seconds = time.perf_counter() - started
+    service_pss = process_memory(service_pid).get('pss', 0) if service_pid else 0
+    barrier.wait()
+    for process in processes:
+        process.join()
+
+    latencies = sorted(latency for report in reports for latency in report['latencies_ms'])
+    return {
+        'mode': mode,
+        'seconds': seconds,
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'total_pss_mb': service_pss + sum(report.get('pss', 0) for report in reports),
+    }
+
+
+def start_service(args) -> subprocess.Popen:
+    service = subprocess.Popen([
+        sys.executable, '-m', 'app.embedding_server', '--port', str(args.port), '--model', args.model,
+        '--batch-size', str(args.batch_size), '--wait-ms', str(args.wait_ms)
+    ], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if service.poll() is not None:
+            raise RuntimeError("The embedding service exited during startup")
+        try:
+            requests.get(f"http://127.0.0.1:{args.port}/health", timeout=1).raise_for_status()
+            return service
+        except requests.RequestException:
+            time.sleep(0.5)
+    service.terminate()
+    raise RuntimeError("The embedding service did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=400)
+    parser.add_argument('--chunks', type=int, default=3, help="Chunks per document")
+    parser.add_argument('--processes', type=int, default=4, help="Worker processes")
+    parser.add_argument('--threads', type=int, default=4, help="Concurrently processed documents per process")
+    parser.add_argument('--port', type=int, default=Config.EMBEDDINGS_SERVICE_PORT)
+    parser.add_argument('--model', default=Config.EMBEDDINGS_MODEL_NAME)
+    parser.add_argument('--batch-size', type=int, default=Config.EMBEDDING_BATCH_SIZE)
+    parser.add_argument('--wait-ms', type=float, default=Config.EMBEDDING_BATCH_WAIT_MS)
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs, args.chunks)
+    rows = [run('in-process', args, documents)]
+    service = start_service(args)
+    try:
+        rows.append(run('remote', args, documents, service_pid=service.pid))
+    finally:
+        service.terminate()
+        service.wait()
+
+    print(f"{args.docs} documents x {args.chunks} chunks, {args.processes} processes x {args.threads} threads")
+    print(f"{'mode':>10} {'seconds':>9} {'docs/min':>10} {'p50 ms':>8} {'p95 ms':>8} {'total PSS MB':>13}")
+    for row in rows:
+        print(f"{row['mode']:>10} {row['seconds']:>9.2f} {args.docs / row['seconds'] * 60:>10.0f} "
+              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['total_pss_mb']:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmarks KVP/category extraction on long documents against the configured Ollama.
+
+Runs every fixture document through `get_kvps_and_category` twice: once sending
+the whole text in a single call (the old behaviour, where Ollama silently cuts
+off what does not fit its context) and once with the token-budgeted map-reduce
+extraction. Reports the average latency, the category accuracy and the recall
+of the expected key-value pairs (an expected value counts as found if it occurs
+in any extracted value) for both.
+
+The fixture set is synthetic by default: long invoices, contracts and bank
+statements with their key facts spread over the beginning, middle and end of
+filler text. `--fixtures` reads a JSON Lines file of
+{"text": ..., "category": ..., "kvps": {...}} records instead.
+
+Usage (from the project root):
+    python -m scripts.bench_long_extraction --docs 6 --pages 40
+"""
+import json
+import time
+import random
+import argparse
+from flask import Flask
+from app.utils.doc_utils import get_kvps_and_category
+from app.utils.prompt_builder import PromptBudget, estimate_tokens
+from config import Config
+
+CATEGORIES = ['Invoice', 'Contract', 'Bank Statement']
+
+FACTS = {
+    'Invoice': [('invoice_number', 'INV-{n:05d}'), ('customer_name', 'Acme Holdings {n}'), ('total_amount', '{n}42.17')],
+    'Contract': [('contract_number', 'CTR-{n:05d}'), ('party_name', 'Northwind Traders {n}'), ('effective_date', '2024-0{m}-15')],
+    'Bank Statement': [('account_number', 'DE89 3704 0044 0532 {n:04d}'), ('statement_period', '2024-0{m}'), ('closing_balance', '{n}900.00')],
+}
+
+FILLER = ("This section describes general terms, delivery conditions and handling notes that apply to the "
+          "items and services listed in this document. ")
+
+
+def make_fixtures(count: int, pages: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    fixtures = []
+    for n in range(count):
+        category = CATEGORIES[n % len(CATEGORIES)]
+        kvps = {key: pattern.format(n=n + 1, m=n % 9 + 1) for key, pattern in FACTS[category]}
+        page_texts = [FILLER * rng.randint(12, 20) for _ in range(pages)]
+        # Key facts at the start, in the middle and near the end
+        for (key, value), page in zip(kvps.items(), (0, pages // 2, pages - 1)):
+            page_texts[page] = f"{key.replace('_', ' ').title()}: {value}\n" + page_texts[page]
+        page_texts[0] = f"{category.upper()}\n" + page_texts[0]
+        fixtures.append({'text': '\n\n'.join(page_texts), 'category': category, 'kvps': kvps})
+    return fixtures
+
+
+def score(fixture: dict, kvps: dict, category: str):
+    extracted = ' | '.join(str(value) for value in kvps.values()).lower()
+    found = sum(1 for value in fixture['kvps'].values() if str(value).lower() in extracted)
+    return (category or '').lower() == fixture['category'].lower(), found, len(fixture['kvps'])
+
+
+def run(fixtures: list, budget: PromptBudget) -> dict:
+    latencies, correct, found, expected = [], 0, 0, 0
+    for fixture in fixtures:
+        started = time.perf_counter()
+        try:
+            kvps, category = get_kvps_and_category(fixture['text'], categories=CATEGORIES, budget=budget)
+        except Exception as e:
+            print(f"  extraction failed: {e}")
+            kvps, category = {}, None
+        latencies.append(time.perf_counter() - started)
+        is_correct, hits, total = score(fixture, kvps, category)
+        correct += is_correct
+        found += hits
+        expected += total
+    return {
+        'avg_seconds': sum(latencies) / len(latencies),
+        'category_accuracy': correct / len(fixtures),
+        'kvp_recall': found / expected if expected else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=6)
+    parser.add_argument('--pages', type=int, default=40, help="Pages of filler per synthetic document")
+    parser.add_argument('--fixtures', help="JSON Lines file of fixture documents")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures) as f:
+            fixtures = [json.loads(line) for line in f if line.strip()]
+    else:
+        fixtures = make_fixtures(args.docs, args.pages)
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    budgeted = PromptBudget.from_config(app.config)
+    # A budget no document exceeds: the whole text goes into a single call
+    single_call = budgeted._replace(context_tokens=10 ** 9)
+
+    avg_tokens = sum(estimate_tokens(fixture['text']) for fixture in fixtures) / len(fixtures)
+    print(f"{len(fixtures)} documents, ~{avg_tokens:.0f} tokens each, context {budgeted.context_tokens} tokens")
+    print(f"{'mode':>12} {'avg s':>8} {'category':>9} {'kvp recall':>11}")
+    with app.app_context():
+        for mode, budget in (('single call', single_call), ('map-reduce', budgeted)):
+            result = run(fixtures, budget)
+            print(f"{mode:>12} {result['avg_seconds']:>8.2f} {result['category_accuracy']:>9.0%} {result['kvp_recall']:>11.0%}")
+
+
+if __name__ == '__main__':
+    main()
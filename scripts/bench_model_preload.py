@@ -0,0 +1,101 @@
+"""
+Benchmarks lazy model loading in each worker process against preloading the model
+once in the parent before it forks (MODEL_PRELOAD).
+
+For each mode, a fresh parent process (optionally preloading and warming up the
+embeddings model) forks `--processes` children, as a prefork Celery worker or
+gunicorn does. Each child encodes one text, and reports the time from its fork to
+that first embedding and its memory while all children are alive: RSS counts
+shared pages in full, PSS divides them among the processes sharing them, so the
+PSS total is what the pool really costs.
+
+Usage (from the project root):
+    python -m scripts.bench_model_preload --processes 4
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+import multiprocessing
+from app.ai_models import init_embeddings
+from app.model_preload import WARM_UP_TEXT, preload_models, after_fork, process_memory
+from config import Config
+
+MODES = ('lazy', 'preload')
+
+
+def child(model_name: str, preloaded: bool, forked_at: float, barrier, results):
+    if preloaded:
+        after_fork()
+    init_embeddings(model_name).embed_query(WARM_UP_TEXT)
+    first_embedding = time.perf_counter() - forked_at
+    barrier.wait()
+    results.put({'first_embedding_seconds': first_embedding, **process_memory()})
+    barrier.wait()
+
+
+def run_mode(mode: str, model_name: str, processes: int) -> dict:
+    """Runs one mode in this process; it must not have loaded the model yet."""
+    context = multiprocessing.get_context('fork')
+    preload_seconds = 0.0
+    if mode == 'preload':
+        preload_seconds = preload_models(model_name)['seconds']
+
+    barrier = context.Barrier(processes + 1)
+    results = context.Queue()
+    forked_at = time.perf_counter()
+    children = [
+        context.Process(target=child, args=(model_name, mode == 'preload', forked_at, barrier, results))
+        for _ in range(processes)
+    ]
+    for process in children:
+        process.start()
+    barrier.wait()
+    parent = process_memory()
+    reports = [results.get() for _ in children]
+    barrier.wait()
+    for process in children:
+        process.join()
+
+    return {
+        'mode': mode,
+        'preload_seconds': preload_seconds,
+        'first_embedding_seconds': max(report['first_embedding_seconds'] for report in reports),
+        'child_rss_mb': sum(report.get('rss', 0) for report in reports) / processes,
+        'child_uss_mb': sum(report.get('uss', 0) for report in reports) / processes,
+        'total_pss_mb': parent.get('pss', 0) + sum(report.get('pss', 0) for report in reports),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4, help="Forked worker processes")
+    parser.add_argument('--model', default=Config.EMBEDDINGS_MODEL_NAME)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.model, args.processes)))
+        return
+
+    # Each mode runs in a fresh interpreter, so the model is never already loaded
+    rows = []
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'scripts.bench_model_preload', '--mode', mode,
+             '--processes', str(args.processes), '--model', args.model],
+            check=True, capture_output=True, text=True
+        ).stdout
+        rows.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{args.processes} processes, model {args.model}")
+    print(f"{'mode':>8} {'preload s':>10} {'1st embed s':>12} {'child RSS MB':>13} "
+          f"{'child USS MB':>13} {'total PSS MB':>13}")
+    for row in rows:
+        print(f"{row['mode']:>8} {row['preload_seconds']:>10.2f} {row['first_embedding_seconds']:>12.2f} "
+              f"{row['child_rss_mb']:>13.0f} {row['child_uss_mb']:>13.0f} {row['total_pss_mb']:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
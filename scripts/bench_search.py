@@ -0,0 +1,123 @@
+"""
+Benchmarks full-text search (`db.search_documents`) against the configured MongoDB.
+
+Inserts `--docs` processed documents whose text all contains a broad term and,
+in 1% of them, a narrow one, then searches each term at increasing offsets, up
+to `--max-results` (SEARCH_MAX_RESULTS) and past it with the cap lifted. For
+each search it reports the latency and the documents MongoDB examined (from
+`explain`): a $text query sorted by relevance scores every match, so the cost
+follows the number of matches, not the page. Searches are run once more with
+`--max-time-ms` (SEARCH_MAX_TIME_MS) to show which of them would be aborted.
+The benchmark documents are removed afterwards.
+
+Usage (from the project root):
+    python -m scripts.bench_search --docs 100000 --repeat 5
+"""
+import time
+import uuid
+import random
+import argparse
+import datetime
+from pymongo.errors import ExecutionTimeout
+from app.database import MongoDatabase, LIST_EXCLUDED_FIELDS, _search_filter
+from config import Config
+
+BROAD_TERM = 'invoice'
+NARROW_TERM = 'reconciliation'
+FILLER = ("payment total amount due customer account order shipment delivery tax "
+          "supplier contract reference balance statement period remittance").split()
+INSERT_BATCH_SIZE = 1000
+
+
+def make_documents(count: int, batch_id: str) -> list:
+    rng = random.Random(42)
+    now = datetime.datetime.utcnow()
+    documents = []
+    for i in range(count):
+        words = [BROAD_TERM] + rng.choices(FILLER, k=200)
+        if i % 100 == 0:
+            words.append(NARROW_TERM)
+        rng.shuffle(words)
+        documents.append({
+            'filename': f"bench_{i:07d}.txt",
+            'text': ' '.join(words),
+            'kvp_text': '',
+            'kvps': {},
+            'status': 'Processed',
+            'category': 'Invoice',
+            'batch_id': batch_id,
+            'created_at': now,
+        })
+    return documents
+
+
+def docs_examined(db, query: str, offset: int, limit: int) -> int:
+    plan = (
+        db.documents.find({'$text': {'$search': query}, **_search_filter(None)},
+                          {**LIST_EXCLUDED_FIELDS, 'score': {'$meta': 'textScore'}})
+        .sort([('score', {'$meta': 'textScore'})])
+        .skip(offset)
+        .limit(limit)
+        .explain()
+    )
+    return plan.get('executionStats', {}).get('totalDocsExamined', -1)
+
+
+def measure(db, query: str, offset: int, limit: int, repeat: int) -> dict:
+    latencies, timed_out = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            db.search_documents(query, limit=limit, offset=offset)
+        except ExecutionTimeout:
+            timed_out += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        'p50_ms': latencies[len(latencies) // 2],
+        'max_ms': latencies[-1],
+        'timed_out': timed_out,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=100_000)
+    parser.add_argument('--limit', type=int, default=20, help="Results per page")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of each search")
+    parser.add_argument('--max-results', type=int, default=Config.SEARCH_MAX_RESULTS)
+    parser.add_argument('--max-time-ms', type=int, default=Config.SEARCH_MAX_TIME_MS)
+    args = parser.parse_args()
+
+    db = MongoDatabase(Config.MONGO_URI, Config.VECTOR_DIMENSIONS)
+    db.create_indexes()
+    batch_id = f"bench-{uuid.uuid4().hex}"
+    documents = make_documents(args.docs, batch_id)
+    offsets = [0, args.max_results // 2, args.max_results - args.limit, args.max_results * 5]
+    rows = []
+    try:
+        for start in range(0, len(documents), INSERT_BATCH_SIZE):
+            db.documents.insert_many(documents[start:start + INSERT_BATCH_SIZE], ordered=False)
+        for query in (BROAD_TERM, NARROW_TERM):
+            for offset in offsets:
+                # The cap is lifted here, so searches past it can be measured too
+                db.search_max_results, db.search_max_time_ms = 10 ** 9, 0
+                row = {'query': query, 'offset': offset, 'capped': offset >= args.max_results,
+                       'examined': docs_examined(db, query, offset, args.limit),
+                       **measure(db, query, offset, args.limit, args.repeat)}
+                db.search_max_time_ms = args.max_time_ms
+                row['aborted'] = measure(db, query, offset, args.limit, 1)['timed_out'] if args.max_time_ms else 0
+                rows.append(row)
+    finally:
+        db.documents.delete_many({'batch_id': batch_id})
+
+    print(f"{args.docs} documents, {args.limit} per page, SEARCH_MAX_RESULTS {args.max_results}, "
+          f"SEARCH_MAX_TIME_MS {args.max_time_ms or 'off'}")
+    print(f"{'query':>15} {'offset':>8} {'examined':>9} {'p50 ms':>8} {'max ms':>8} {'rejected':>9} {'aborted':>8}")
+    for row in rows:
+        print(f"{row['query']:>15} {row['offset']:>8} {row['examined']:>9} {row['p50_ms']:>8.1f} "
+              f"{row['max_ms']:>8.1f} {'yes' if row['capped'] else 'no':>9} {'yes' if row['aborted'] else 'no':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+A stand-in for an Ollama server, for exercising the LLM client's routing,
+circuit breaking and failover locally without GPUs.
+
+Answers `POST /api/chat` and `POST /api/generate` with a fixed JSON extraction
+result (streamed like Ollama, one JSON object per line) after `--latency`
+seconds, and `GET /api/tags` with a one-model list. `--fail-rate` makes that
+fraction of requests return 500.
+
+Usage (from the project root), e.g. two stubs and the API pointed at both:
+    python -m scripts.ollama_stub --port 11501 &
+    python -m scripts.ollama_stub --port 11502 --latency 0.5 --fail-rate 0.2 &
+    OLLAMA_BASE_URLS=http://127.0.0.1:11501,http://127.0.0.1:11502 flask --app main run
+"""
+import json
+import time
+import random
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RESPONSE_TEXT = json.dumps({"category": "Invoice", "kvps": {"invoice_number": "INV-12345"}})
+
+
+def make_handler(model: str, latency: float, fail_rate: float):
+    class OllamaStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status: int, body: bytes, content_type: str = 'application/json'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/api/tags':
+                self._send(200, json.dumps({"models": [{"name": model}]}).encode())
+            else:
+                self._send(404, b'{"error": "not found"}')
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path not in ('/api/chat', '/api/generate'):
+                self._send(404, b'{"error": "not found"}')
+                return
+            time.sleep(latency)
+            if random.random() < fail_rate:
+                self._send(500, b'{"error": "stub failure"}')
+                return
+            if self.path == '/api/chat':
+                parts = [{"model": request.get('model'), "message": {"role": "assistant", "content": RESPONSE_TEXT}, "done": False},
+                         {"model": request.get('model'), "message": {"role": "assistant", "content": ""}, "done": True}]
+            else:
+                parts = [{"model": request.get('model'), "response": RESPONSE_TEXT, "done": False},
+                         {"model": request.get('model'), "response": "", "done": True}]
+            self._send(200, ''.join(json.dumps(part) + '\n' for part in parts).encode(), 'application/x-ndjson')
+
+        def log_message(self, format, *args):
+            pass
+
+    return OllamaStubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--model', default='phi3:mini')
+    parser.add_argument('--latency', type=float, default=0.1, help="Seconds before each response")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests answered with 500")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.model, args.latency, args.fail_rate))
+    print(f"Ollama stub listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import random
+import socket
+import threading
+from http.server import ThreadingHTTPServer
+import mongomock
+import mongomock.gridfs
+import pytest
+from app import database
+from scripts.ollama_stub import make_handler
+
+# GridFS on mongomock collections, for the file storage of MongoDatabase
+mongomock.gridfs.enable_gridfs_integration()
+
+
+class OllamaStub:
+    """
+    A `scripts.ollama_stub` server on an ephemeral localhost port, serving from a background
+    thread. It counts the chat/generate requests it receives, and `fail_rate` may be changed
+    while it runs (clients keep their connections open, so the handler cannot be swapped).
+    """
+    def __init__(self, model: str = 'phi3:mini', latency: float = 0.0, fail_rate: float = 0.0):
+        self.requests = 0
+        self.fail_rate = fail_rate
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler(model, latency))
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def _handler(self, model: str, latency: float):
+        stub = self
+
+        class CountingHandler(make_handler(model, latency, fail_rate=0.0)):
+            def do_POST(self):
+                stub.requests += 1
+                if random.random() < stub.fail_rate:
+                    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                    self._send(500, b'{"error": "stub failure"}')
+                    return
+                super().do_POST()
+
+        return CountingHandler
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def ollama_stub():
+    """Starts Ollama stubs on demand: `ollama_stub(latency=..., fail_rate=...)`; all are stopped afterwards."""
+    stubs = []
+
+    def start(**kwargs) -> OllamaStub:
+        stubs.append(OllamaStub(**kwargs))
+        return stubs[-1]
+
+    yield start
+    for stub in stubs:
+        stub.stop()
+
+
+@pytest.fixture
+def unused_url():
+    """The URL of a localhost port nothing listens on, so connections to it are refused."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """A MongoDatabase on an empty mongomock database."""
+    monkeypatch.setattr(database, 'MongoClient', lambda uri, **kwargs: mongomock.MongoClient(uri))
+    return database.MongoDatabase('mongodb://localhost/test', 384)
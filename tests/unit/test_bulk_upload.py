@@ -0,0 +1,95 @@
+import io
+import tarfile
+import pytest
+from flask import Flask
+from app import database
+from app.blueprints import documents
+from app.celery_worker import dispatch_bulk_documents_task
+from config import Config
+
+
+def tar_archive(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client(mongo_db, monkeypatch):
+    monkeypatch.setattr(documents, 'BULK_UPLOAD_BATCH_SIZE', 2)
+    monkeypatch.setattr(dispatch_bulk_documents_task, 'delay', lambda *args, **kwargs: None)
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.db = mongo_db
+    app.register_blueprint(documents.documents_bp, url_prefix='/api/v1')
+    return app.test_client()
+
+
+def upload(client, files: dict):
+    return client.post('/api/v1/documents/bulk?filename=upload.tar.gz', data=tar_archive(files),
+                       content_type='application/gzip')
+
+
+def test_queues_every_file_of_a_valid_archive(client, mongo_db):
+    response = upload(client, {f"{n}.txt": f"document {n}".encode() for n in range(3)})
+
+    assert response.status_code == 202
+    assert response.json['accepted'] == 3
+    assert mongo_db.documents.count_documents({}) == 3
+    assert mongo_db.db['fs.files'].count_documents({}) == 3
+
+
+def test_failed_batch_is_rolled_back_and_earlier_batches_stay_queued(client, mongo_db, monkeypatch):
+    # Files over 16 bytes are streamed into GridFS and smaller ones written at once, so the
+    # failed batch has written both kinds before the archive turns out to be too large
+    monkeypatch.setattr(database, 'BULK_INLINE_FILE_SIZE', 16)
+    monkeypatch.setattr(database, 'BULK_WRITE_BYTES', 1)
+    monkeypatch.setattr(documents, 'BULK_UPLOAD_BATCH_SIZE', 3)
+    shared = b'content stored by an earlier upload'
+    upload(client, {'shared.txt': shared})
+    client.application.config['ARCHIVE_MAX_FILES'] = 5
+
+    # The second batch stores shared.txt and e.txt, then the sixth member exceeds the limit
+    response = upload(client, {'a.txt': b'first', 'b.txt': b'second', 'c.txt': b'third',
+                               'shared.txt': shared, 'e.txt': b'fifth', 'f.txt': b'sixth'})
+
+    assert response.status_code == 207
+    assert response.json['error'].startswith('Archive refused')
+    assert response.json['accepted'] == 3
+    assert [('document_id' in result, 'error' in result) for result in response.json['files']] == [
+        (True, False), (True, False), (True, False), (False, True), (False, True)
+    ]
+    assert mongo_db.documents.count_documents({}) == 4
+    files = {record['filename']: record['ref_count'] for record in mongo_db.db['fs.files'].find()}
+    assert files == {'shared.txt': 1, 'a.txt': 1, 'b.txt': 1, 'c.txt': 1}
+    stored_ids = [record['_id'] for record in mongo_db.db['fs.files'].find()]
+    assert mongo_db.db['fs.chunks'].count_documents({'files_id': {'$nin': stored_ids}}) == 0
+
+
+def test_archive_refused_before_anything_was_queued(client, mongo_db):
+    client.application.config['ARCHIVE_MAX_FILES'] = 1
+
+    response = upload(client, {'a.txt': b'first', 'b.txt': b'second'})
+
+    assert response.status_code == 400
+    assert response.json['accepted'] == 0
+    assert mongo_db.db['fs.files'].count_documents({}) == 0
+    assert mongo_db.db['fs.chunks'].count_documents({}) == 0
+
+
+def test_files_are_released_when_their_documents_cannot_be_created(client, mongo_db, monkeypatch):
+    def fail(docs_data):
+        raise RuntimeError('insert failed')
+    monkeypatch.setattr(mongo_db, 'create_documents', fail)
+
+    response = client.post('/api/v1/documents/bulk', data={
+        'files': [(io.BytesIO(b'first'), 'a.txt'), (io.BytesIO(b'second'), 'b.txt')]
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 500
+    assert mongo_db.db['fs.files'].count_documents({}) == 0
+    assert mongo_db.db['fs.chunks'].count_documents({}) == 0
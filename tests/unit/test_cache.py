@@ -0,0 +1,113 @@
+import fakeredis
+import pytest
+from app import cache as cache_module
+from app.cache import TwoTierCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+def shared_cache(redis_server, **settings) -> TwoTierCache:
+    """A cache whose Redis tier is on `redis_server`, as in one of several processes."""
+    cache = TwoTierCache(**settings)
+    cache._redis = fakeredis.FakeRedis(server=redis_server)
+    return cache
+
+
+def test_local_entries_expire_after_the_ttl(clock):
+    cache = TwoTierCache(local_ttl=5)
+    cache.set('doc', b'v1')
+
+    clock.now += 4.9
+    assert cache.get('doc') == b'v1'
+    clock.now += 0.2
+    assert cache.get('doc') is None
+    assert cache._bytes == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TwoTierCache(max_entries=2)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    cache.get('a')
+
+    cache.set('c', b'3')
+
+    assert [cache.get(key) for key in ('a', 'b', 'c')] == [b'1', None, b'3']
+
+
+def test_entries_are_evicted_beyond_max_bytes(clock):
+    cache = TwoTierCache(max_bytes=10)
+    cache.set('a', b'x' * 4)
+    cache.set('b', b'x' * 4)
+    cache.set('a', b'x' * 5)
+
+    # Replacing an entry counts only its new size; 'b' is the oldest once 'a' is rewritten
+    assert cache._bytes == 9
+    cache.set('c', b'x' * 3)
+    assert [cache.get(key) for key in ('a', 'b', 'c')] == [b'x' * 5, None, b'x' * 3]
+    assert cache._bytes == 8
+
+    # A value larger than the whole tier is not cached locally
+    cache.set('big', b'x' * 11)
+    assert cache.get('big') is None
+    assert cache._bytes == 8
+
+
+def test_redis_tier_is_shared_and_refills_the_local_tier(clock, redis_server):
+    api, worker = shared_cache(redis_server), shared_cache(redis_server)
+    api.set('doc', b'v1')
+
+    assert worker.get('doc') == b'v1'
+    worker._redis = None
+    assert worker.get('doc') == b'v1'
+
+
+def test_read_racing_an_invalidation_is_not_cached(clock):
+    cache = TwoTierCache()
+    generation = cache.generation('doc')
+    # ...the reader loads v1 from the database while a writer changes the document
+    cache.delete('doc')
+
+    cache.set('doc', b'v1', generation=generation)
+
+    assert cache.get('doc') is None
+    cache.set('doc', b'v2', generation=cache.generation('doc'))
+    assert cache.get('doc') == b'v2'
+
+
+def test_read_racing_an_invalidation_in_another_process_is_not_cached(clock, redis_server):
+    api, worker = shared_cache(redis_server), shared_cache(redis_server)
+    generation = api.generation('doc')
+    worker.delete('doc')
+
+    api.set('doc', b'v1', generation=generation)
+
+    assert api.get('doc') is None
+    assert worker.get('doc') is None
+
+
+def test_read_through_without_redis_generation_is_not_cached(clock, redis_server):
+    cache = shared_cache(redis_server)
+
+    # Redis could not be read when the generation was taken
+    cache.set('doc', b'v1', generation=(0, None))
+
+    assert cache.get('doc') is None
@@ -0,0 +1,110 @@
+import datetime
+from app.dashboard_stats import apply_update, reconciliation, stats_delta
+
+CREATED_AT = datetime.datetime(2024, 6, 1, 12, 0, 0)
+PROCESSED_AT = CREATED_AT + datetime.timedelta(seconds=42, milliseconds=500)
+
+
+def document(**fields) -> dict:
+    return {'status': 'Queued for Processing', 'category': None, 'created_at': CREATED_AT,
+            'processed_at': None, **fields}
+
+
+def test_new_document_counts_once():
+    assert stats_delta(None, document()) == {
+        None: {'document_count': 1, 'status_counts.Queued for Processing': 1}
+    }
+
+
+def test_processing_to_processed_moves_the_status_and_category_and_adds_the_processing_time():
+    before = document(status='Processing')
+    after = apply_update(before, {'$set': {'status': 'Processed', 'category': 'Invoices', 'processed_at': PROCESSED_AT}})
+
+    assert stats_delta(before, after) == {
+        None: {'document_count': -1, 'status_counts.Processing': -1},
+        'Invoices': {'document_count': 1, 'status_counts.Processed': 1,
+                     'processing_time_count': 1, 'processing_time_ms_sum': 42500}
+    }
+
+
+def test_soft_delete_and_restore_are_opposite():
+    processed = document(status='Processed', category='Invoices', processed_at=PROCESSED_AT)
+    deleted = apply_update(processed, {'$set': {'deleted_at': PROCESSED_AT}})
+    restored = apply_update(deleted, {'$unset': {'deleted_at': ''}})
+
+    removed = {'Invoices': {'document_count': -1, 'status_counts.Processed': -1,
+                            'processing_time_count': -1, 'processing_time_ms_sum': -42500}}
+    assert stats_delta(processed, deleted) == removed
+    assert stats_delta(deleted, restored) == {
+        'Invoices': {path: -value for path, value in removed['Invoices'].items()}
+    }
+    # Deleted documents do not count, so changing them changes nothing
+    assert stats_delta(deleted, apply_update(deleted, {'$set': {'category': 'Receipts'}})) == {}
+
+
+def test_recategorize_moves_the_document_between_categories():
+    before = document(status='Processed', category='Invoices', processed_at=PROCESSED_AT)
+    after = apply_update(before, {'$set': {'status': 'Re-categorized', 'category': 'Receipts'}})
+
+    assert stats_delta(before, after) == {
+        'Invoices': {'document_count': -1, 'status_counts.Processed': -1,
+                     'processing_time_count': -1, 'processing_time_ms_sum': -42500},
+        'Receipts': {'document_count': 1, 'status_counts.Re-categorized': 1,
+                     'processing_time_count': 1, 'processing_time_ms_sum': 42500}
+    }
+
+
+def test_unrelated_changes_leave_the_statistics_alone():
+    before = document(status='Processed', category='Invoices', processed_at=PROCESSED_AT)
+
+    assert stats_delta(before, apply_update(before, {'$set': {'kvps.total': '12.00'}})) == {}
+
+
+def test_processing_time_ignores_microseconds_mongodb_does_not_store():
+    before = document(status='Processing')
+    after = dict(before, status='Processed', processed_at=PROCESSED_AT + datetime.timedelta(microseconds=999))
+
+    assert stats_delta(before, after)[None]['processing_time_ms_sum'] == 42500
+
+
+def test_reconciliation_corrects_only_the_drifted_counters():
+    expected = {'category': 'Invoices', 'document_count': 3, 'status_counts': {'Processed': 2, 'Processing': 1},
+                'processing_time_count': 2, 'processing_time_ms_sum': 85000.4}
+    actual = {'category': 'Invoices', 'document_count': 4, 'status_counts': {'Processed': 2, 'Processing': 2},
+              'processing_time_count': 2, 'processing_time_ms_sum': 85000}
+
+    guard, increments = reconciliation(expected, actual)
+
+    # The processing time sum is within the rounding tolerance
+    assert increments == {'document_count': -1, 'status_counts.Processing': -1}
+    assert guard == {'document_count': 4, 'status_counts.Processed': 2, 'status_counts.Processing': 2,
+                     'processing_time_count': 2, 'processing_time_ms_sum': 85000}
+    assert reconciliation(expected, expected)[1] == {}
+
+
+def test_reconciliation_zeroes_categories_without_documents():
+    actual = {'category': 'Receipts', 'document_count': 1, 'status_counts': {'Processed': 1}}
+
+    assert reconciliation(None, actual)[1] == {'document_count': -1, 'status_counts.Processed': -1}
+
+
+def test_reconcile_dashboard_statistics_fixes_drifted_records_only(mongo_db):
+    mongo_db.documents.insert_many([
+        document(status='Processed', category='Invoices', processed_at=PROCESSED_AT),
+        document(status='Processing', category='Invoices'),
+        document(status='Processed', category='Receipts', processed_at=PROCESSED_AT),
+        document(status='Processed', category='Receipts', deleted_at=PROCESSED_AT),
+    ])
+    invoices = {'category': 'Invoices', 'document_count': 2, 'status_counts': {'Processed': 1, 'Processing': 1},
+                'processing_time_count': 1, 'processing_time_ms_sum': 42500}
+    receipts = {'category': 'Receipts', 'document_count': 2, 'status_counts': {'Processed': 2},
+                'processing_time_count': 2, 'processing_time_ms_sum': 85000}
+    mongo_db.dashboard_stats.insert_many([dict(invoices), dict(receipts)])
+
+    assert mongo_db.reconcile_dashboard_statistics() == 1
+
+    records = {record['category']: record for record in mongo_db.dashboard_stats.find({}, {'_id': 0})}
+    assert records['Invoices'] == invoices
+    assert records['Receipts'] == {'category': 'Receipts', 'document_count': 1, 'status_counts': {'Processed': 1},
+                                   'processing_time_count': 1, 'processing_time_ms_sum': 42500}
+    assert mongo_db.reconcile_dashboard_statistics() == 0
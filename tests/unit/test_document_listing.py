@@ -0,0 +1,42 @@
+import datetime
+import pytest
+from flask import Flask
+from app.blueprints import documents
+from config import Config
+
+
+@pytest.fixture
+def client(mongo_db):
+    mongo_db.documents.insert_one({
+        'filename': 'invoice.pdf', 'status': 'Processed', 'category': 'Invoice',
+        'created_at': datetime.datetime.utcnow(), 'kvps': {'total': '12.00'},
+        'text': 'Invoice INV-12345', 'embedding': [0.1, 0.2], 'kvp_text': '12.00'
+    })
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.db = mongo_db
+    app.register_blueprint(documents.documents_bp, url_prefix='/api/v1')
+    return app.test_client()
+
+
+def test_returns_only_the_requested_fields(client):
+    response = client.get('/api/v1/documents?fields=filename,kvps')
+
+    assert response.status_code == 200
+    [doc] = response.get_json()['documents']
+    assert set(doc) == {'_id', 'filename', 'kvps', 'created_at'}
+
+
+def test_leaves_bulky_fields_out_by_default(client):
+    [doc] = client.get('/api/v1/documents').get_json()['documents']
+
+    assert doc['filename'] == 'invoice.pdf'
+    assert not {'text', 'embedding', 'kvp_text'} & set(doc)
+
+
+@pytest.mark.parametrize('fields', ['text', 'filename,embedding', 'kvp_text', '$where', 'kvps,kvps.total', 'kvps.total'])
+def test_rejects_unknown_fields(client, fields):
+    response = client.get(f'/api/v1/documents?fields={fields}')
+
+    assert response.status_code == 400
+    assert 'Unknown fields' in response.get_json()['error']
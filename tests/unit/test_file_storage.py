@@ -0,0 +1,88 @@
+import io
+import pytest
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+from app import database
+from config import Config
+
+
+def upload(content: bytes, filename: str = 'invoice.txt') -> FileStorage:
+    return FileStorage(stream=io.BytesIO(content), filename=filename, content_type='text/plain')
+
+
+def ref_count(db, file_id) -> int:
+    record = db.db['fs.files'].find_one({'_id': database.ObjectId(file_id)})
+    return record['ref_count'] if record else 0
+
+
+@pytest.fixture
+def db(mongo_db):
+    # Soft delete and restore write audit logs through current_app.db
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.db = mongo_db
+    with app.app_context():
+        yield mongo_db
+
+
+def test_same_content_twice_in_one_batch_is_stored_once(db):
+    first, second, other = db.save_files([upload(b'invoice 1'), upload(b'invoice 1', 'copy.txt'), upload(b'invoice 2')])
+
+    assert (first.deduplicated, second.deduplicated, other.deduplicated) == (False, True, False)
+    assert first.file_id == second.file_id != other.file_id
+    assert ref_count(db, first.file_id) == 2
+    assert db.db['fs.files'].count_documents({}) == 2
+    assert db.get_file_content(second.file_id) == b'invoice 1'
+
+
+@pytest.mark.parametrize('inline_size', [database.BULK_INLINE_FILE_SIZE, 0])
+def test_content_already_stored_is_shared(db, monkeypatch, inline_size):
+    # With no inline size, every file of the batch is streamed and claimed like a single upload
+    monkeypatch.setattr(database, 'BULK_INLINE_FILE_SIZE', inline_size)
+    existing = db.save_file(upload(b'invoice 1'))
+
+    [stored] = db.save_files([upload(b'invoice 1', 'again.txt')])
+    single = db.save_file(upload(b'invoice 1', 'once more.txt'))
+
+    assert stored == database.StoredFile(existing.file_id, existing.sha256, True)
+    assert single.file_id == existing.file_id and single.deduplicated
+    assert ref_count(db, existing.file_id) == 3
+    assert db.db['fs.files'].count_documents({}) == 1
+    assert db.db['fs.chunks'].count_documents({}) == 1
+
+
+def test_release_deletes_the_file_with_its_last_reference(db):
+    first = db.save_file(upload(b'invoice 1'))
+    db.save_file(upload(b'invoice 1', 'copy.txt'))
+
+    db.release_file(first.file_id)
+    assert ref_count(db, first.file_id) == 1
+    assert db.get_file_content(first.file_id) == b'invoice 1'
+
+    db.release_file(first.file_id)
+    assert db.db['fs.files'].count_documents({}) == 0
+    assert db.db['fs.chunks'].count_documents({}) == 0
+    # Releasing a file that is already gone does nothing
+    db.release_file(first.file_id)
+
+    # The same content uploaded again is stored anew, not revived
+    again = db.save_file(upload(b'invoice 1'))
+    assert not again.deduplicated and again.file_id != first.file_id
+    assert ref_count(db, again.file_id) == 1
+
+
+def test_restored_document_keeps_its_shared_file(db):
+    stored = db.save_files([upload(b'invoice 1'), upload(b'invoice 1', 'copy.txt')])
+    kept_id, purged_id = db.create_documents([
+        {'filename': 'invoice.txt', 'file_id': f.file_id, 'status': 'Processed', 'category': None} for f in stored
+    ])
+
+    # Soft deletes keep the reference; only purging the document releases it
+    assert db.soft_delete_document(kept_id) and db.soft_delete_document(purged_id)
+    assert ref_count(db, stored[0].file_id) == 2
+    assert db.restore_document(kept_id)
+    assert db.purge_document(purged_id)
+
+    assert ref_count(db, stored[0].file_id) == 1
+    assert db.get_document(kept_id)['file_id'] == stored[0].file_id
+    assert db.get_file_content(stored[0].file_id) == b'invoice 1'
@@ -0,0 +1,62 @@
+from langchain.schema import Document
+from app.hybrid_search import hybrid_search, reciprocal_rank_fusion
+
+
+class FakeDatabase:
+    """The lexical side: returns `lexical` for any query; `documents` are looked up by id and status."""
+    def __init__(self, lexical: list, documents: dict):
+        self.lexical = lexical
+        self.documents = documents
+        self.hydrated = []
+
+    def search_documents(self, query, limit=20, offset=0, filters=None):
+        return {"documents": [dict(self.documents[doc_id], _id=doc_id) for doc_id in self.lexical[offset:offset + limit]]}
+
+    def get_documents_by_ids(self, doc_ids, filters=None):
+        self.hydrated.extend(doc_ids)
+        status = (filters or {}).get('status')
+        return [dict(self.documents[doc_id], _id=doc_id) for doc_id in doc_ids
+                if doc_id in self.documents and (not status or self.documents[doc_id]['status'] == status)]
+
+
+class FakeVectorStore:
+    def __init__(self, doc_ids: list):
+        self.chunks = [Document(page_content=f"passage of {doc_id}", metadata={'doc_id': doc_id}) for doc_id in doc_ids]
+
+    def similarity_search(self, query, k=4, filter=None):
+        return self.chunks[:k]
+
+
+def test_rrf_scores_items_found_by_both_rankings_highest():
+    fused = reciprocal_rank_fusion([['a', 'b'], ['b', 'c']], k=60)
+    assert [item for item, _ in fused] == ['b', 'a', 'c']
+
+
+def test_vector_hits_removed_by_the_filters_do_not_take_page_slots():
+    documents = {doc_id: {'filename': f"{doc_id}.txt", 'status': 'Processed', 'snippet': 'x'}
+                 for doc_id in ('l1', 'l2', 'v1', 'v2', 'v3')}
+    # v1 and v2 are only found by the vector search, and not processed yet
+    documents['v1']['status'] = documents['v2']['status'] = 'Queued for Processing'
+    db = FakeDatabase(['l1', 'l2'], documents)
+    vector_store = FakeVectorStore(['v1', 'v2', 'l1', 'v3'])
+
+    first = hybrid_search(db, vector_store, 'invoice', limit=2, offset=0, filters={'status': 'Processed'})
+    second = hybrid_search(db, vector_store, 'invoice', limit=2, offset=first['next_offset'],
+                           filters={'status': 'Processed'})
+
+    assert [doc['_id'] for doc in first['documents']] == ['l1', 'l2']
+    assert [doc['_id'] for doc in second['documents']] == ['v3']
+    assert second['next_offset'] is None
+    assert first['documents'][0]['vector_rank'] == 1
+    assert second['documents'][0]['vector_rank'] == 2
+    assert sorted(set(db.hydrated)) == ['v1', 'v2', 'v3']
+
+
+def test_deleted_vector_hits_are_dropped():
+    documents = {'l1': {'filename': 'l1.txt', 'status': 'Processed', 'snippet': 'x'}}
+    db = FakeDatabase(['l1'], documents)
+
+    result = hybrid_search(db, FakeVectorStore(['gone', 'l1']), 'invoice', limit=10)
+
+    assert [doc['_id'] for doc in result['documents']] == ['l1']
+    assert result['documents'][0]['vector_rank'] == 1
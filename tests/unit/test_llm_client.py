@@ -0,0 +1,145 @@
+import time
+import asyncio
+import pytest
+from app import llm_client
+from app.llm_client import (CLOSED, OPEN, HALF_OPEN, EndpointUnavailableError, OllamaEndpoint,
+                            OllamaEndpointPool, PooledChatOllama, get_endpoint_pool)
+from app.metrics import metrics
+
+CHAT_PATH = '/api/chat'
+HEADERS = {'Content-Type': 'application/json'}
+PAYLOAD = {'model': 'phi3:mini', 'messages': [{'role': 'user', 'content': 'Invoice INV-12345'}]}
+
+
+def make_pool(*urls, **endpoint_settings) -> OllamaEndpointPool:
+    return OllamaEndpointPool([OllamaEndpoint(url, **endpoint_settings) for url in urls])
+
+
+def request(pool: OllamaEndpointPool) -> list:
+    """Sends one chat request through `pool` and reads the whole streamed response."""
+    return list(pool.open_stream(CHAT_PATH, HEADERS, PAYLOAD, timeout=5))
+
+
+@pytest.fixture
+def first_choice(monkeypatch):
+    """Breaks routing ties in favour of the first endpoint, so the tests do not depend on chance."""
+    monkeypatch.setattr(llm_client.random, 'choice', lambda candidates: candidates[0])
+
+
+def test_routes_to_the_endpoint_with_fewest_outstanding_requests(ollama_stub, first_choice):
+    busy, idle = ollama_stub(), ollama_stub()
+    pool = make_pool(busy.url, idle.url)
+
+    # Streams hold their endpoint's slot until they are read
+    held = [pool.open_stream(CHAT_PATH, HEADERS, PAYLOAD, timeout=5) for _ in range(4)]
+    assert [endpoint.outstanding for endpoint in pool.endpoints] == [2, 2]
+    assert (busy.requests, idle.requests) == (2, 2)
+
+    # Ties went to `busy`, so it took the first and third request; once they are done it has none left
+    for stream in held[0::2]:
+        list(stream)
+    assert [endpoint.outstanding for endpoint in pool.endpoints] == [0, 2]
+    request(pool)
+    request(pool)
+    assert (busy.requests, idle.requests) == (4, 2)
+
+    for stream in held[1::2]:
+        list(stream)
+    assert [endpoint.outstanding for endpoint in pool.endpoints] == [0, 0]
+
+
+def test_fails_over_to_the_next_endpoint(ollama_stub, unused_url, first_choice):
+    failing, healthy = ollama_stub(fail_rate=1.0), ollama_stub()
+    pool = make_pool(unused_url, failing.url, healthy.url)
+    failovers = metrics.snapshot()['counters'].get('llm_failovers_total', 0)
+
+    lines = request(pool)
+
+    assert 'INV-12345' in ''.join(lines)
+    assert (failing.requests, healthy.requests) == (1, 1)
+    assert [endpoint.consecutive_failures for endpoint in pool.endpoints] == [1, 1, 0]
+    assert metrics.snapshot()['counters']['llm_failovers_total'] == failovers + 2
+    assert all(endpoint.outstanding == 0 for endpoint in pool.endpoints)
+
+
+def test_raises_when_no_endpoint_can_serve(ollama_stub, unused_url):
+    failing = ollama_stub(fail_rate=1.0)
+    pool = make_pool(unused_url, failing.url)
+
+    with pytest.raises(EndpointUnavailableError):
+        request(pool)
+    assert failing.requests == 1
+    assert all(endpoint.outstanding == 0 for endpoint in pool.endpoints)
+
+
+def test_circuit_opens_then_half_opens_and_closes(ollama_stub):
+    stub = ollama_stub(fail_rate=1.0)
+    pool = make_pool(stub.url, failure_threshold=2, cooldown_seconds=0.2)
+    endpoint = pool.endpoints[0]
+
+    for _ in range(2):
+        with pytest.raises(EndpointUnavailableError):
+            request(pool)
+    assert endpoint.state == OPEN
+
+    # An open circuit gets no traffic during its cooldown
+    with pytest.raises(EndpointUnavailableError):
+        request(pool)
+    assert stub.requests == 2
+
+    stub.fail_rate = 0.0
+    time.sleep(0.25)
+    assert endpoint.is_routable(time.monotonic())
+    # The first request after the cooldown is the single half-open trial
+    trial = pool.open_stream(CHAT_PATH, HEADERS, PAYLOAD, timeout=5)
+    assert endpoint.state == CLOSED
+    list(trial)
+    assert endpoint.consecutive_failures == 0
+    request(pool)
+    assert stub.requests == 4
+
+
+def test_half_open_trial_admits_one_request_and_reopens_on_failure(ollama_stub):
+    stub = ollama_stub(fail_rate=1.0)
+    pool = make_pool(stub.url, failure_threshold=1, cooldown_seconds=0.2)
+    endpoint = pool.endpoints[0]
+
+    with pytest.raises(EndpointUnavailableError):
+        request(pool)
+    assert endpoint.state == OPEN
+    time.sleep(0.25)
+
+    # While the trial is in flight, no other request is routed to the endpoint
+    assert pool._choose([]) is endpoint
+    assert endpoint.state == HALF_OPEN
+    assert pool._choose([]) is None
+    endpoint.record_failure('trial failed')
+    endpoint.outstanding -= 1
+
+    # A failed trial reopens the circuit for another cooldown
+    assert endpoint.state == OPEN
+    assert not endpoint.is_routable(time.monotonic())
+    with pytest.raises(EndpointUnavailableError):
+        request(pool)
+    assert stub.requests == 1
+
+
+@pytest.mark.parametrize('call', ['invoke', 'ainvoke', 'astream'])
+def test_chat_model_sends_sync_and_async_calls_through_the_pool(ollama_stub, call):
+    stub = ollama_stub()
+    llm = PooledChatOllama(base_url=stub.url, model='phi3:mini')
+    requests_total = metrics.snapshot()['counters'].get('llm_requests_total', 0)
+
+    if call == 'invoke':
+        content = llm.invoke('Invoice INV-12345').content
+    elif call == 'ainvoke':
+        content = asyncio.run(llm.ainvoke('Invoice INV-12345')).content
+    else:
+        async def stream():
+            return ''.join([chunk.content async for chunk in llm.astream('Invoice INV-12345')])
+        content = asyncio.run(stream())
+
+    assert content
+    assert stub.requests == 1
+    assert metrics.snapshot()['counters']['llm_requests_total'] == requests_total + 1
+    assert all(endpoint.outstanding == 0 for endpoint in get_endpoint_pool([stub.url]).endpoints)
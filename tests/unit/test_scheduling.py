@@ -0,0 +1,61 @@
+import datetime
+from app.scheduling import fair_share
+
+NOW = datetime.datetime(2024, 6, 1, 12, 0, 0)
+STALE_BEFORE = NOW - datetime.timedelta(minutes=10)
+
+
+def test_fair_share_splits_free_slots_round_robin_across_unequal_backlogs():
+    # A large backfill does not take every slot from the small batches after it
+    assert fair_share({'backfill': 1000, 'small': 2, 'medium': 5}, {}, max_in_flight=8, max_per_batch=8) == {
+        'backfill': 3, 'small': 2, 'medium': 3
+    }
+
+
+def test_fair_share_counts_documents_already_in_flight():
+    shares = fair_share({'backfill': 1000, 'small': 3}, {'backfill': 5, 'done': 1}, max_in_flight=8, max_per_batch=5)
+
+    # Two free slots; the backfill is at its per-batch limit
+    assert shares == {'small': 2}
+
+
+def test_fair_share_respects_the_per_batch_limit_and_leaves_slots_unused():
+    assert fair_share({'a': 10, 'b': 1}, {}, max_in_flight=10, max_per_batch=3) == {'a': 3, 'b': 1}
+
+
+def test_fair_share_grants_nothing_without_free_slots():
+    assert fair_share({'a': 10}, {'b': 4}, max_in_flight=4, max_per_batch=4) == {}
+
+
+def queued(batch_id: str, minutes: int, **fields) -> dict:
+    return {'batch_id': batch_id, 'processing_lane': 'bulk', 'status': 'Queued for Processing',
+            'created_at': NOW + datetime.timedelta(minutes=minutes), **fields}
+
+
+def test_claim_bulk_documents_claims_the_oldest_waiting_documents(mongo_db):
+    ids = mongo_db.documents.insert_many([queued('batch', minutes) for minutes in (3, 1, 2)]).inserted_ids
+    mongo_db.documents.insert_many([
+        queued('other', 0),
+        queued('batch', 0, status='Processing'),
+        queued('batch', 0, deleted_at=NOW),
+    ])
+
+    claimed = mongo_db.claim_bulk_documents('batch', 2, STALE_BEFORE)
+
+    assert claimed == [str(ids[1]), str(ids[2])]
+    assert mongo_db.claim_bulk_documents('batch', 2, STALE_BEFORE) == [str(ids[0])]
+    assert mongo_db.claim_bulk_documents('batch', 2, STALE_BEFORE) == []
+
+
+def test_claim_bulk_documents_reclaims_stale_dispatches_only(mongo_db):
+    stale, recent, new = mongo_db.documents.insert_many([
+        queued('batch', 0, dispatched_at=STALE_BEFORE - datetime.timedelta(seconds=1), dispatch_token='lost'),
+        queued('batch', 1, dispatched_at=datetime.datetime.utcnow(), dispatch_token='in flight'),
+        queued('batch', 2),
+    ]).inserted_ids
+
+    claimed = mongo_db.claim_bulk_documents('batch', 5, STALE_BEFORE)
+
+    assert claimed == [str(stale), str(new)]
+    assert mongo_db.documents.find_one({'_id': stale})['dispatch_token'] != 'lost'
+    assert mongo_db.documents.find_one({'_id': recent})['dispatch_token'] == 'in flight'